@@ -16,7 +16,8 @@ try:
     from langchain.agents import initialize_agent, Tool, AgentType
     from langchain.tools import tool
     from utils.generic_ingestor import ingest_file
-    from utils.dbt_runner import run_dbt_command
+    from utils.dbt_runner import run_dbt_command, streaming
+    from utils.analytics_snapshot import AnalyticsSnapshot, snapshot_enabled
     from langchain_community.utilities import SQLDatabase
     from langchain_community.agent_toolkits import create_sql_agent
 except ImportError:
@@ -25,23 +26,27 @@ except ImportError:
     from langchain.agents import initialize_agent, Tool, AgentType
     from langchain.tools import tool
     from jimwurst.utils.generic_ingestor import ingest_file
-    from jimwurst.utils.dbt_runner import run_dbt_command
+    from jimwurst.utils.dbt_runner import run_dbt_command, streaming
+    from jimwurst.utils.analytics_snapshot import AnalyticsSnapshot, snapshot_enabled
     from langchain_community.utilities import SQLDatabase
     from langchain_community.agent_toolkits import create_sql_agent
 
 @tool
 def ingest_data_tool(file_path: str):
     """
-    Ingests a CSV file into the database. 
-    Input should be the full absolute path to the CSV file.
+    Ingests a data file into the database: CSV (also .csv.gz or zipped), Parquet, JSON/NDJSON or Excel (.xlsx).
+    Input should be the full absolute path to the file.
+    Returns the table it was loaded into, the row count and the load throughput.
     """
     return ingest_file(file_path)
 
 @tool
 def run_transformations_tool(command: str = "build"):
     """
-    Runs dbt transformations to process data. 
-    Input can be 'run' or 'build'. Default is 'build'.
+    Runs dbt transformations to process data.
+    Input is a dbt command: 'build' (the default), 'run', 'test', 'compile' or 'ls', optionally
+    with --select <models> (e.g. 'build --select source:substack+'), --exclude, --threads <n>,
+    --full-refresh, or --defer --state <folder>.
     """
     return run_dbt_command(command)
 
@@ -96,6 +101,8 @@ All relevant schemas (marts, s_*) are in your search path.
 DATA CATEGORIZATION:
 1. RAW DATA: Located in `s_` schemas (e.g., s_substack, s_linkedin). This is the landing zone for the ingestion system.
 2. CURATED DATA: Located in the `marts` schema. This is cleaned, modeled data ready for insight generation and analysis.
+3. INGESTION RUNS: Located in the `meta` schema. `meta.ingestion_runs` has one row per ingestion run (source, status, rows, bytes, wall_seconds, peak_rss_mb) and `meta.ingestion_stage_metrics` splits each run's time into parse, transform and write stages (plus queue_full and queue_empty: the time parsing waited for writes, and writes for parsing). Use them when asked how or why a load was slow.
+4. HEALTH DATA: `marts.fct_apple_health__records_daily` and `marts.fct_apple_health__records_hourly` hold one row per record_type, unit and day (`date`) or hour (`hour_start`) with record_count, value_sum, value_min, value_max, value_avg, value_p10/p50/p90 and duration_seconds. Answer Apple Health questions from them rather than from `s_apple_health.records`.
 
 CRITICAL SCHEMA PRIORITIES:
 1. MART SYSTEM: Use the `marts` schema for all analytical questions and insights. This is your primary source of truth.
@@ -122,6 +129,9 @@ WORKFLOW:
         from langchain_community.agent_toolkits import SQLDatabaseToolkit
         from langchain.tools import Tool as LangChainTool
         
+        # Read-only aggregations are answered from the DuckDB analytics snapshot while it is fresh
+        snapshot = AnalyticsSnapshot() if snapshot_enabled() else None
+
         toolkit = SQLDatabaseToolkit(db=db, llm=self.llm)
         original_tools = toolkit.get_tools()
         cleaned_tools = []
@@ -131,6 +141,10 @@ WORKFLOW:
                 # Create a wrapper that cleans the SQL before calling the original tool
                 def wrapped_query(query: str, tool=t):
                     cleaned = clean_sql(query)
+                    if snapshot is not None:
+                        rows = snapshot.try_query(cleaned)
+                        if rows is not None:
+                            return str(rows)
                     return tool.run(cleaned)
                 
                 # Create a new Tool with the same metadata but our wrapped function
@@ -167,7 +181,7 @@ WORKFLOW:
         DB_PORT = os.getenv("DB_PORT", "5432")
         
         # Define the schemas we want to include in our search path (Focusing only on what matters)
-        schemas = "public,marts,s_spotify,s_linkedin,s_substack,s_telegram,s_bolt,s_apple_health,s_google_sheet"
+        schemas = "public,marts,s_spotify,s_linkedin,s_substack,s_telegram,s_bolt,s_apple_health,s_google_sheet,meta"
         
         # Update URI to include search_path
         db_uri = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}?options=-csearch_path%3D{schemas}"
@@ -220,7 +234,10 @@ WORKFLOW:
         """
         try:
             config = {"callbacks": callbacks} if callbacks else {}
-            response = self.agent.invoke({"input": prompt}, config=config)
+            # dbt's log lines go to the callbacks that can show them while it runs
+            listeners = [cb.on_dbt_event for cb in callbacks or [] if hasattr(cb, "on_dbt_event")]
+            with streaming(*listeners):
+                response = self.agent.invoke({"input": prompt}, config=config)
             
             # Return both output and intermediate steps if available
             if isinstance(response, dict):
@@ -5,6 +5,7 @@ import os
 import sys
 import subprocess
 import signal
+import shutil
 
 # Add project root to sys.path to allow imports
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -78,7 +79,7 @@ with st.container():
     if col1.button("📂 Upload & Transform", use_container_width=True):
         # We can't auto-open the uploader, but we can set a prompt to guide or just rely on the uploader below
         # For now, let's treat this as a prompt query or a guide
-        next_prompt = "I would like to upload a CSV file and run transformations."
+        next_prompt = "I would like to upload a data file and run transformations."
         
     if col2.button("💾 Show DWH Data", use_container_width=True):
         next_prompt = "Show me the data currently in the DWH."
@@ -86,9 +87,12 @@ with st.container():
     if col3.button("📊 Provide Insights", use_container_width=True):
         next_prompt = "Provide insights from the existing data."
 
-    # 2. CSV Upload Widget
-    with st.expander("Upload a CSV File", expanded=False):
-        uploaded_file = st.file_uploader("Choose a CSV file", type="csv")
+    # 2. File Upload Widget (formats supported by utils/generic_ingestor.py)
+    with st.expander("Upload a Data File", expanded=False):
+        uploaded_file = st.file_uploader(
+            "Choose a CSV, Parquet, JSON/NDJSON or Excel file (CSV may be .gz or .zip)",
+            type=["csv", "gz", "zip", "parquet", "json", "ndjson", "jsonl", "xlsx"],
+        )
         source_app = st.text_input("Source Application", placeholder="e.g., Spotify, Apple Health")
         
         if uploaded_file is not None and source_app:
@@ -101,7 +105,7 @@ with st.container():
                 # Save to persistent file
                 file_path = os.path.join(jimwurst_data_dir, uploaded_file.name)
                 with open(file_path, "wb") as f:
-                    f.write(uploaded_file.getvalue())
+                    shutil.copyfileobj(uploaded_file, f)
                 
                 # Construct a prompt for the agent to ingest this specific file with context
                 next_prompt = f"Please ingest the data from this file: {file_path}. This data was generated by {source_app}. After ingestion, please run the transformations."
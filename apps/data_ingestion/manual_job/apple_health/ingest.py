@@ -1,18 +1,22 @@
 import os
 import sys
 import xml.etree.ElementTree as ET
-import psycopg2
-from psycopg2 import sql
 from datetime import datetime
 from tqdm import tqdm
-from psycopg2.extras import execute_values
 
-# Import common utilities
-sys.path.append(os.path.join(os.path.dirname(__file__), '../../../../utils'))
-from ingestion_utils import load_env, get_db_connection, ensure_schema
+if __name__ == "__main__":
+    # Run as a script: make utils importable and load docker/.env before the settings below are read.
+    # The jimwurst CLI (utils/cli.py) does both itself before importing this module.
+    sys.path.append(os.path.join(os.path.dirname(__file__), '../../../..'))
+    from utils.ingestion_utils import load_env
+    load_env()
 
-# Load env vars
-load_env()
+from utils.ingestion_utils import build_arg_parser, Checkpoint, flush_batch
+from utils.ingestion_sinks import Table, PostgresSink, open_sink
+from utils.ingestion_metrics import RunMetrics, historical_throughput
+from utils.ingestion_pipeline import pipelined
+from utils.export_files import walk_files, open_file, is_archive, is_member
+from utils.ingestion_filters import load_filters, project
 
 # Default path points to the external volume location we defined
 DEFAULT_XML_PATH = os.path.expanduser("~/Documents/jimwurst_local_data/apple_health/export.xml")
@@ -20,26 +24,153 @@ XML_PATH = os.getenv("EXPORT_XML_PATH", DEFAULT_XML_PATH)
 
 SCHEMA_NAME = "s_apple_health"
 
-def get_record_count(xml_file):
-    """Quickly counts the number of Record tags in the XML."""
+# A generic records table
+RECORDS = Table(SCHEMA_NAME, "records", [
+    ("type", "VARCHAR(255)"),
+    ("source_name", "VARCHAR(255)"),
+    ("source_version", "VARCHAR(255)"),
+    ("unit", "VARCHAR(50)"),
+    ("creation_date", "TIMESTAMP"),
+    ("start_date", "TIMESTAMP"),
+    ("end_date", "TIMESTAMP"),
+    ("value", "TEXT"),
+    ("device", "TEXT"),
+    ("metadata", "JSONB"),
+])
+
+# The Record attribute behind each column, for the record filters (see utils/ingestion_filters.py)
+RECORD_ATTRIBUTES = {
+    "type": "type",
+    "source_name": "sourceName",
+    "source_version": "sourceVersion",
+    "unit": "unit",
+    "creation_date": "creationDate",
+    "start_date": "startDate",
+    "end_date": "endDate",
+    "value": "value",
+    "device": "device",
+}
+
+# The export is fed to the parser in blocks of whole lines, so every block boundary
+# is a candidate resume point (see iter_records).
+READ_BLOCK_BYTES = 1024 * 1024
+
+def iter_records(xml_file, start_offset=0):
+    """
+    Streams the attributes of every Record element in export.xml.
+
+    Yields (attrib, offset) pairs. offset is the byte position right after the record when
+    the parser is back at the top level of the document, i.e. a point we can resume from by
+    seeking there and re-opening the root element; it is None for any other record (e.g.
+    records nested in a Correlation, or not the last one of its line).
+    """
+    parser = ET.XMLPullParser(events=("start", "end"))
+    depth = 0
+    root = None
+    offset = start_offset
+
+    with open_file(xml_file, 'rb') as f:
+        if start_offset:
+            # Re-open the root element and continue right after the last committed record
+            parser.feed(b"<HealthData>")
+            f.seek(start_offset)
+
+        while True:
+            lines = f.readlines(READ_BLOCK_BYTES)
+            if not lines:
+                break
+            for line in lines:
+                parser.feed(line)
+                offset += len(line)
+
+                records = []
+                for event, elem in parser.read_events():
+                    if event == "start":
+                        depth += 1
+                        if root is None:
+                            root = elem
+                        continue
+                    depth -= 1
+                    if elem.tag == "Record":
+                        records.append(elem.attrib)
+                    if depth == 1:
+                        root.clear() # Free memory of finished top-level elements
+
+                for i, attrib in enumerate(records):
+                    is_last = i == len(records) - 1
+                    yield attrib, (offset if is_last and depth == 1 else None)
+
+def find_export_xml(archive):
+    """The export.xml in the export.zip shared by the Health app (apple_health_export/export.xml), or None."""
+    for path in walk_files(archive):
+        if os.path.basename(path).lower() == "export.xml":
+            return path
+    return None
+
+def get_record_count(xml_file, start_offset=0, keep=None):
+    """Quickly counts the number of Record tags in the XML (that the filter keep lets through)."""
     print("Pre-scanning file to estimate records...")
     count = 0
-    context = ET.iterparse(xml_file, events=("end",))
-    for event, elem in context:
-        if elem.tag == "Record":
+    for attrib, _ in iter_records(xml_file, start_offset):
+        if keep is None or keep(attrib):
             count += 1
-        elem.clear()
     return count
 
-def estimate_and_confirm(count):
+def parse_date(d_str):
+    """Helper to handle dates"""
+    try:
+        # Apple uses '2023-10-25 07:12:05 +0200'
+        return datetime.strptime(d_str, '%Y-%m-%d %H:%M:%S %z')
+    except:
+        return None
+
+# Used for the estimate until meta.ingestion_runs has a few runs to learn from
+DEFAULT_RECORDS_PER_SECOND = 50000
+
+def record_row(attrib):
+    """The records table row of a Record element's attributes."""
+    # Metadata is anything not in our standard list
+    # This is a simplification; Apple Health has many attributes. 
+    # We map the most common common ones to columns.
+    return (
+        attrib.get('type'),
+        attrib.get('sourceName'),
+        attrib.get('sourceVersion'),
+        attrib.get('unit'),
+        parse_date(attrib.get('creationDate')),
+        parse_date(attrib.get('startDate')),
+        parse_date(attrib.get('endDate')),
+        attrib.get('value'),
+        attrib.get('device'),
+        # For now we won't put everything else in JSONB to keep it simple, 
+        # but normally we would grab remaining attributes
+        "{}" 
+    )
+
+def record_rows(xml_file, start_offset=0, keep=None, kept_columns=None):
+    """
+    The records table rows of export.xml as (row, offset) pairs (see iter_records), with the
+    columns kept_columns. Records the filter keep drops are not converted: they only come
+    through as (None, offset) when they are a resume point.
+    """
+    for attrib, offset in iter_records(xml_file, start_offset):
+        if keep is None or keep(attrib):
+            yield project(record_row(attrib), kept_columns), offset
+        elif offset is not None:
+            yield None, offset
+
+def estimate_and_confirm(count, auto_confirm=False, records_per_second=None):
     """Estimates time and asks user for confirmation."""
-    records_per_second = 50000 
+    records_per_second = records_per_second or DEFAULT_RECORDS_PER_SECOND
     est_seconds = count / records_per_second
     
     print(f"\n--- Ingestion Estimate ---")
     print(f"Total Records: {count:,}")
     print(f"Estimated Time: {est_seconds:.1f} seconds (~{records_per_second:,} rec/s)")
     print(f"--------------------------\n")
+
+    if auto_confirm:
+        return
     
     try:
         choice = input("Proceed with ingestion? [Y/n]: ").strip().lower()
@@ -50,13 +181,22 @@ def estimate_and_confirm(count):
         # If running in a non-interactive shell, we proceed
         print("Non-interactive session detected, proceeding...")
 
-def parse_and_ingest(xml_file):
+def parse_and_ingest(xml_file, auto_confirm=False, resume=False, profile_dir=None, use_cache=False, sink=None):
     """
-    Parses the export.xml file.
+    Parses the export.xml file into Postgres, or into another sink (see utils/ingestion_sinks.py).
+    With resume=True, continues after the last checkpointed record instead of rebuilding the table.
+    With a profile_dir, the run is profiled (see utils/ingestion_profiler.py).
+    With use_cache=True, an export that was loaded before is reloaded from its Parquet cache
+    instead of being parsed (see utils/ingestion_cache.py).
     """
     
+    # The Health app shares export.zip: read its export.xml without extracting it
+    archive = xml_file if is_archive(xml_file) else os.path.join(os.path.dirname(xml_file), "export.zip")
+    if (xml_file == archive or not os.path.exists(xml_file)) and is_archive(archive):
+        xml_file = find_export_xml(archive) or xml_file
+
     # Handle case sensitivity if using the default folder
-    if not os.path.exists(xml_file):
+    if not os.path.exists(xml_file) and not is_member(xml_file):
         alt_path = xml_file.replace("export.xml", "Export.xml")
         if os.path.exists(alt_path):
             xml_file = alt_path
@@ -67,109 +207,92 @@ def parse_and_ingest(xml_file):
 
     print(f"Using file: {xml_file}")
     
+    sink = sink or PostgresSink()
+    conn = sink.conn
+    sink.ensure_schema(SCHEMA_NAME)
+    checkpoint = Checkpoint(conn, "apple_health", resume=resume)
+
+    cache = None
+    if use_cache:
+        from utils.ingestion_cache import ExportCache
+        cache = ExportCache("apple_health", SCHEMA_NAME, [xml_file])
+        if cache.manifest() is not None:
+            metrics = RunMetrics("apple_health", profile_dir=profile_dir)
+            with metrics.track(conn):
+                cache.load(conn, metrics)
+            checkpoint.finish()
+            sink.close()
+            return
+
+    if checkpoint.is_done("records"):
+        # Interrupted after its last batch was committed
+        print("All records were loaded by the interrupted run.")
+        checkpoint.finish()
+        sink.close()
+        return
+
+    position = checkpoint.get("records")
+    start_offset = position['offset'] if position else 0
+    record_count = position['record'] if position else 0
+
+    # Only the record types, dates and columns the filters keep are loaded
+    source_filter = load_filters("apple_health")
+    table, kept_columns = source_filter.filtered_table(RECORDS)
+    keep = source_filter.record_filter(RECORDS.name, RECORD_ATTRIBUTES)
+
     # --- New: Estimation Feature ---
-    total_records = get_record_count(xml_file)
-    estimate_and_confirm(total_records)
+    total_records = get_record_count(xml_file, start_offset, keep)
+    estimate_and_confirm(total_records, auto_confirm, historical_throughput(conn, "apple_health", "rows"))
     # ------------------------------
 
-    conn = get_db_connection()
-    ensure_schema(conn, SCHEMA_NAME)
-
-    # DDL for a generic records table
-    # We drop and recreate for a full refresh pattern
-    create_table_query = sql.SQL("""
-        DROP TABLE IF EXISTS {schema}.records;
-        CREATE TABLE {schema}.records (
-            type VARCHAR(255),
-            source_name VARCHAR(255),
-            source_version VARCHAR(255),
-            unit VARCHAR(50),
-            creation_date TIMESTAMP,
-            start_date TIMESTAMP,
-            end_date TIMESTAMP,
-            value TEXT,
-            device TEXT,
-            metadata JSONB
-        );
-    """).format(schema=sql.Identifier(SCHEMA_NAME))
-
-    with conn.cursor() as cur:
-        print("Recreating table records...")
-        cur.execute(create_table_query)
-    conn.commit()
-
-    # Streaming Parse
-    context = ET.iterparse(xml_file, events=("start", "end"))
-    context = iter(context)
-    event, root = next(context)
-
-    batch_size = 5000
-    batch = []
-    
-    record_count = 0
+    metrics = RunMetrics("apple_health", profile_dir=profile_dir)
+    metrics.add_file(xml_file)
+
+    with metrics.track(conn):
+        if position is None:
+            # We drop and recreate for a full refresh pattern
+            print("Recreating table records...")
+            sink.create_table(table)
+        else:
+            print(f"Resuming after record {record_count:,} (byte offset {start_offset:,})...")
+
+        batch_size = 5000
+        batch = []
     
-    print("Starting ingestion...")
-    with conn.cursor() as cur:
-        for event, elem in tqdm(context):
-            if event == "end" and elem.tag == "Record":
-                # Extract standard attributes
-                attrib = elem.attrib
-                
-                # Metadata is anything not in our standard list
-                # This is a simplification; Apple Health has many attributes. 
-                # We map the most common common ones to columns.
-                
-                # Helper to handle dates
-                def parse_date(d_str):
-                    try:
-                        # Apple uses '2023-10-25 07:12:05 +0200'
-                        return datetime.strptime(d_str, '%Y-%m-%d %H:%M:%S %z')
-                    except:
-                        return None
-
-                creation_date = parse_date(attrib.get('creationDate'))
-                start_date = parse_date(attrib.get('startDate'))
-                end_date = parse_date(attrib.get('endDate'))
-                
-                row = (
-                    attrib.get('type'),
-                    attrib.get('sourceName'),
-                    attrib.get('sourceVersion'),
-                    attrib.get('unit'),
-                    creation_date,
-                    start_date,
-                    end_date,
-                    attrib.get('value'),
-                    attrib.get('device'),
-                    # For now we won't put everything else in JSONB to keep it simple, 
-                    # but normally we would grab remaining attributes
-                    "{}" 
-                )
-                
-                batch.append(row)
-                record_count += 1
-                
-                elem.clear() # Free memory
-                
-                if len(batch) >= batch_size:
-                    execute_values(cur, 
-                        sql.SQL("INSERT INTO {schema}.records VALUES %s").format(schema=sql.Identifier(SCHEMA_NAME)),
-                        batch
-                    )
-                    conn.commit()
+        print("Starting ingestion...")
+        with metrics.stage("transform"):
+            # Records are parsed into rows on a producer thread while batches are written here
+            rows = record_rows(xml_file, start_offset, keep, kept_columns)
+            for row, offset in tqdm(pipelined(rows, metrics), initial=record_count):
+                if row is not None:
+                    batch.append(row)
+                    record_count += 1
+        
+                # Only commit at resumable points, so the checkpoint matches the rows in the table
+                if len(batch) >= batch_size and offset is not None:
+                    flush_batch(sink, table, batch, checkpoint, "records", metrics, record=record_count, offset=offset)
                     batch = []
 
-        # Final batch
-        if batch:
-            execute_values(cur, 
-                sql.SQL("INSERT INTO {schema}.records VALUES %s").format(schema=sql.Identifier(SCHEMA_NAME)),
-                batch
-            )
-            conn.commit()
+            # Final batch, checkpointed as the end of the export: the last record need not be a resume point
+            if batch:
+                flush_batch(sink, table, batch, checkpoint, "records", metrics, done=True, record=record_count)
 
+    checkpoint.finish()
     print(f"Ingestion complete. {record_count} records inserted.")
-    conn.close()
+    if cache is not None:
+        cache.save(conn)
+    sink.close()
+
+def main(argv=None):
+    parser = build_arg_parser("Apple Health Data Ingestion")
+    args = parser.parse_args(argv)
+    if args.append:
+        # Records have no key to upsert on, and an export holds all of them, so appending would load them twice
+        parser.error("--append is not supported: Apple Health rebuilds its table from the full export")
 
-if __name__ == "__main__":
     print(f"Processing Apple Health export from: {XML_PATH}")
-    parse_and_ingest(XML_PATH)
+    parse_and_ingest(XML_PATH, auto_confirm=args.yes, resume=args.resume, profile_dir=args.profile, use_cache=args.cache,
+                     sink=open_sink(args))
+
+if __name__ == "__main__":
+    main()
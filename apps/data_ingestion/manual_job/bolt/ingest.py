@@ -1,17 +1,21 @@
 import os
 import sys
 import csv
-import psycopg2
-from psycopg2 import sql
-from psycopg2.extras import execute_values
 from tqdm import tqdm
 
-# Import common utilities
-sys.path.append(os.path.join(os.path.dirname(__file__), '../../../../utils'))
-from ingestion_utils import load_env, get_db_connection, ensure_schema
+if __name__ == "__main__":
+    # Run as a script: make utils importable and load docker/.env before the settings below are read.
+    # The jimwurst CLI (utils/cli.py) does both itself before importing this module.
+    sys.path.append(os.path.join(os.path.dirname(__file__), '../../../..'))
+    from utils.ingestion_utils import load_env
+    load_env()
 
-# Load env vars
-load_env()
+from utils.ingestion_utils import build_arg_parser, Checkpoint, flush_batch, copy_on_server, copy_in_parallel, skip_rows
+from utils.ingestion_sinks import Table, open_sink
+from utils.ingestion_metrics import RunMetrics
+from utils.ingestion_pipeline import pipelined
+from utils.export_files import walk_files, open_file
+from utils.ingestion_filters import load_filters, project
 
 DEFAULT_DATA_PATH = os.path.expanduser("~/Documents/jimwurst_local_data/bolt")
 DATA_PATH = os.getenv("BOLT_DATA_PATH", DEFAULT_DATA_PATH)
@@ -37,10 +41,15 @@ def sanitize_column_name(col_name):
     """
     return col_name.strip().lower().replace(" ", "_").replace("-", "_").replace(".", "")
 
-def ingest_csv(conn, file_path, table_name):
+def ingest_csv(sink, file_path, table_name, checkpoint, unit, metrics, server_copy=False, append=False):
+    if checkpoint.is_done(unit):
+        print(f"Skipping {unit}: already loaded.")
+        return
+    metrics.add_file(file_path)
+
     print(f"Processing {os.path.basename(file_path)} -> {SCHEMA_NAME}.{table_name}")
     
-    with open(file_path, 'r', encoding='utf-8-sig') as f:
+    with open_file(file_path, 'r', encoding='utf-8-sig') as f:
         reader = csv.reader(f)
         try:
             headers = next(reader)
@@ -49,40 +58,42 @@ def ingest_csv(conn, file_path, table_name):
             return
 
         sanitized_headers = [sanitize_column_name(h) for h in headers]
-        
-        # 1. Create Table (Full Refresh)
+        # Rows and columns the filters drop are never written (see utils/ingestion_filters.py)
+        source_filter = load_filters("bolt")
+        kept_columns = source_filter.kept_columns(table_name, sanitized_headers)
+        keep = source_filter.record_filter(table_name, sanitized_headers)
         # We'll treat everything as TEXT for simplicity in this raw ingestion layer (ODS/Staging logic)
         # unless we want to get fancy with type inference.
+        table = Table(SCHEMA_NAME, table_name, [(col, "TEXT") for col in project(sanitized_headers, kept_columns)])
         
-        cols_ddl = [sql.SQL("{} TEXT").format(sql.Identifier(col)) for col in sanitized_headers]
-        
-        drop_query = sql.SQL("DROP TABLE IF EXISTS {}.{}").format(
-            sql.Identifier(SCHEMA_NAME), sql.Identifier(table_name)
-        )
-        
-        create_query = sql.SQL("CREATE TABLE {}.{} ({})").format(
-            sql.Identifier(SCHEMA_NAME),
-            sql.Identifier(table_name),
-            sql.SQL(", ").join(cols_ddl)
-        )
-        
-        with conn.cursor() as cur:
-            cur.execute(drop_query)
-            cur.execute(create_query)
-        conn.commit()
+        # Rows committed by an interrupted run are kept; we continue right after them
+        count = checkpoint.rows_done(unit)
+        if checkpoint.get(unit) is None:
+            # 1. Create Table (Full Refresh, or add new columns with --append)
+            sink.create_table(table, checkpoint, unit, append=append, row=0)
+            # Postgres reads the file itself, or big files are parsed on every core (unless the rows are filtered)
+            copied = None
+            filtered = kept_columns is not None or keep is not None
+            if server_copy and not filtered:
+                copied = copy_on_server(sink, table, file_path, sanitized_headers, checkpoint=checkpoint, unit=unit,
+                                        metrics=metrics)
+            if copied is None and not filtered:
+                copied = copy_in_parallel(sink, table, file_path, sanitized_headers, encoding="utf-8-sig",
+                                          checkpoint=checkpoint, unit=unit, metrics=metrics)
+            if copied is not None:
+                print(f"  Finished: {copied} rows inserted.")
+                return
+        else:
+            print(f"  Resuming after row {count}.")
+            skip_rows(reader, count)
         
         # 2. Insert Data
         batch_size = 5000
         batch = []
-        count = 0
-        
-        insert_query = sql.SQL("INSERT INTO {}.{} VALUES %s").format(
-            sql.Identifier(SCHEMA_NAME),
-            sql.Identifier(table_name)
-        )
+        dropped = 0
         
-        with conn.cursor() as cur:
-            for row in tqdm(reader, desc=f"  Loading {table_name}", unit="rows"):
+        with metrics.stage("transform"):
+            for row in tqdm(pipelined(reader, metrics), desc=f"  Loading {table_name}", unit="rows", initial=count):
                 # Handle row length mismatch (simple CSVs might be malformed)
                 if len(row) != len(headers):
                     # quick fix: pad or truncate
@@ -91,54 +102,78 @@ def ingest_csv(conn, file_path, table_name):
                     else:
                         row = row[:len(headers)]
                 
-                batch.append(row)
+                # count is the position in the file, filtered rows included, so that --resume skips them too
                 count += 1
+                if keep is not None and not keep(row):
+                    dropped += 1
+                    continue
+                batch.append(project(row, kept_columns))
                 
                 if len(batch) >= batch_size:
-                    execute_values(cur, insert_query, batch)
+                    flush_batch(sink, table, batch, checkpoint, unit, metrics, row=count)
                     batch = []
-                    conn.commit()
             
             if batch:
-                execute_values(cur, insert_query, batch)
-                conn.commit()
+                flush_batch(sink, table, batch, checkpoint, unit, metrics, row=count)
+        checkpoint.mark_done(unit, row=count)
                 
-        print(f"  Finished: {count} rows inserted.")
+        print(f"  Finished: {count - dropped} rows inserted.")
+        if dropped:
+            print(f"  {dropped} rows filtered out.")
+
+def main(argv=None):
+    parser = build_arg_parser("Bolt Data Ingestion")
+    args = parser.parse_args(argv)
 
-def main():
     print(f"Starting Bolt Ingestion from: {DATA_PATH}")
     
     if not os.path.exists(DATA_PATH):
         print(f"Error: Path {DATA_PATH} does not exist.")
         sys.exit(1)
         
-    conn = get_db_connection()
-    ensure_schema(conn, SCHEMA_NAME)
-    
-    # Walk through the directory to find CSVs
-    found_files = 0
-    for root, dirs, files in os.walk(DATA_PATH):
-        for file in files:
-            if file.endswith(".csv"):
-                # Check if we should ingest this file
-                # Strategy: If it's in our specific mapping, OR if we want to ingest ALL csvs dynamically
-                # Let's ingest ALL CSVs found, using filename as table name if not mapped.
-                
-                table_name = SPECIFIC_TABLE_MAPPING.get(file)
-                if not table_name:
-                    # Generic fallback: "some_file.csv" -> "some_file"
-                    table_name = sanitize_column_name(file.replace(".csv", ""))
-                
-                full_path = os.path.join(root, file)
-                ingest_csv(conn, full_path, table_name)
-                found_files += 1
-                
-    if found_files == 0:
+    # Walk through the directory (and any .zip export in it) to find CSVs, sorted, so a resumed run sees the same order
+    source_filter = load_filters("bolt")
+    csv_files = [path for path in walk_files(DATA_PATH)
+                 if path.endswith(".csv") and source_filter.wants_file(path, DATA_PATH)]
+
+    sink = open_sink(args)
+    conn = sink.conn
+    sink.ensure_schema(SCHEMA_NAME)
+    checkpoint = Checkpoint(conn, "bolt", resume=args.resume)
+    metrics = RunMetrics("bolt", profile_dir=args.profile)
+
+    cache = None
+    if args.cache and csv_files:
+        from utils.ingestion_cache import ExportCache
+        cache = ExportCache("bolt", SCHEMA_NAME, csv_files, root=DATA_PATH)
+        if cache.manifest() is not None:
+            with metrics.track(conn):
+                cache.load(conn, metrics)
+            checkpoint.finish()
+            sink.close()
+            return
+
+    with metrics.track(conn):
+        for full_path in csv_files:
+            # Ingest ALL CSVs found, using the filename as table name if not in our specific mapping
+            file = os.path.basename(full_path)
+            table_name = SPECIFIC_TABLE_MAPPING.get(file)
+            if not table_name:
+                # Generic fallback: "some_file.csv" -> "some_file"
+                table_name = sanitize_column_name(file.replace(".csv", ""))
+
+            ingest_csv(sink, full_path, table_name, checkpoint, os.path.relpath(full_path, DATA_PATH), metrics,
+                       server_copy=args.server_copy, append=args.append)
+
+    if not csv_files:
         print("No CSV files found in the specified path.")
     else:
-        print(f"\nAll done! Processed {found_files} files.")
-        
-    conn.close()
+        print(f"\nAll done! Processed {len(csv_files)} files.")
+
+    checkpoint.finish()
+    if cache is not None:
+        cache.save(conn)
+    sink.close()
 
 if __name__ == "__main__":
     main()
@@ -1,25 +1,27 @@
+import io
 import os
 import sys
 import csv
-import psycopg2
-from psycopg2 import sql
-from psycopg2.extras import execute_values
+import importlib.util
 from tqdm import tqdm
-from openpyxl import load_workbook
 
 # Optional dependency for richer Excel parsing; fallback to openpyxl if missing.
-try:
-    import pandas as pd  # type: ignore
-    HAS_PANDAS = True
-except Exception:
-    HAS_PANDAS = False
+# pandas and openpyxl are only imported when a workbook is found, as they dominate start-up time.
+HAS_PANDAS = importlib.util.find_spec("pandas") is not None
 
-# Import common utilities
-sys.path.append(os.path.join(os.path.dirname(__file__), '../../../../utils'))
-from ingestion_utils import load_env, get_db_connection, ensure_schema, clean_header, sanitize_table_name
-
-# Load env vars
-load_env()
+if __name__ == "__main__":
+    # Run as a script: make utils importable and load docker/.env before the settings below are read.
+    # The jimwurst CLI (utils/cli.py) does both itself before importing this module.
+    sys.path.append(os.path.join(os.path.dirname(__file__), '../../../..'))
+    from utils.ingestion_utils import load_env
+    load_env()
+
+from utils.ingestion_utils import clean_header, sanitize_table_name, build_arg_parser, Checkpoint, flush_batch, copy_on_server, copy_in_parallel, skip_rows
+from utils.ingestion_sinks import Table, open_sink
+from utils.ingestion_metrics import RunMetrics, historical_throughput
+from utils.ingestion_pipeline import pipelined
+from utils.export_files import walk_files, open_file, file_size, is_member
+from utils.ingestion_filters import load_filters, project
 
 DB_HOST = os.getenv("DB_HOST", "localhost")
 DB_NAME = os.getenv("POSTGRES_DB", "jimwurst_db")
@@ -34,6 +36,9 @@ COMPLETE_PATH = os.path.join(DATA_PATH, "complete")
 
 SCHEMA_NAME = "s_linkedin"
 
+# Used for the time estimate until a run has been recorded in meta.ingestion_runs
+DEFAULT_BYTES_PER_SECOND = 5.0 * 1024 * 1024
+
 
 def dedupe_columns(columns):
     """Ensure column names are unique by appending suffixes to duplicates."""
@@ -53,11 +58,20 @@ def dedupe_columns(columns):
 class ExcelIngestor:
     """Handles ingestion of .xlsx files from basic creator insights exports"""
     
-    def __init__(self, conn):
-        self.conn = conn
+    def __init__(self, sink, checkpoint, metrics, append=False):
+        self.sink = sink
+        self.checkpoint = checkpoint
+        self.metrics = metrics
+        self.append = append
     
     def ingest(self, file_path, table_name):
         """Ingest Excel file into PostgreSQL"""
+        # Workbooks are small, so they are checkpointed as a whole
+        unit = os.path.relpath(file_path, DATA_PATH)
+        if self.checkpoint.is_done(unit):
+            print(f"Skipping {unit}: already loaded.")
+            return
+
         print(f"Processing Excel file: {table_name}...")
         
         try:
@@ -65,13 +79,24 @@ class ExcelIngestor:
                 self._ingest_with_pandas(file_path, table_name)
             else:
                 self._ingest_with_openpyxl(file_path, table_name)
+            self.checkpoint.mark_done(unit)
         except Exception as e:
             print(f"Error processing Excel file {file_path}: {e}")
 
+    def _workbook(self, file_path):
+        """The path of a workbook, or its contents for one inside a .zip archive (openpyxl seeks around)."""
+        if not is_member(file_path):
+            return file_path
+        with open_file(file_path, 'rb') as f:
+            return io.BytesIO(f.read())
+
     def _ingest_with_pandas(self, file_path, table_name):
-        xls = pd.ExcelFile(file_path, engine="openpyxl")
+        import pandas as pd
+        with self.metrics.stage("parse"):
+            xls = pd.ExcelFile(self._workbook(file_path), engine="openpyxl")
         for sheet_name in xls.sheet_names:
-            df_raw = xls.parse(sheet_name, dtype=str, header=None)
+            with self.metrics.stage("parse"):
+                df_raw = xls.parse(sheet_name, dtype=str, header=None)
             df_raw = df_raw.dropna(how="all")  # drop fully empty rows
             df_raw = df_raw.dropna(axis=1, how="all")  # drop fully empty cols
             if df_raw.empty:
@@ -111,32 +136,17 @@ class ExcelIngestor:
             print(f"  ✓ Ingested sheet '{sheet_name}' into table '{current_table_name}'")
 
     def _write_dataframe(self, df, current_table_name):
-        cols_def = ", ".join([f"{sql.Identifier(c).as_string(self.conn)} TEXT" for c in df.columns])
-        create_query = sql.SQL("CREATE TABLE IF NOT EXISTS {}.{} ({})").format(
-            sql.Identifier(SCHEMA_NAME),
-            sql.Identifier(current_table_name),
-            sql.SQL(cols_def)
-        )
-        drop_query = sql.SQL("DROP TABLE IF EXISTS {}.{} CASCADE").format(
-            sql.Identifier(SCHEMA_NAME),
-            sql.Identifier(current_table_name)
-        )
-        insert_query = sql.SQL("INSERT INTO {}.{} VALUES %s").format(
-            sql.Identifier(SCHEMA_NAME),
-            sql.Identifier(current_table_name)
-        )
-
-        with self.conn.cursor() as cur:
-            cur.execute(drop_query)
-            cur.execute(create_query)
-        batch = df.where(pd.notnull(df), None).values.tolist()
+        table = Table(SCHEMA_NAME, current_table_name, [(c, "TEXT") for c in df.columns])
+        self.sink.create_table(table, append=self.append)
+        batch = df.where(df.notnull(), None).values.tolist()
         if batch:
-            with self.conn.cursor() as cur:
-                execute_values(cur, insert_query, batch, page_size=1000)
-            self.conn.commit()
+            flush_batch(self.sink, table, batch, metrics=self.metrics)
 
     def _ingest_with_openpyxl(self, file_path, table_name):
-        workbook = load_workbook(file_path, data_only=True)
+        from openpyxl import load_workbook
+
+        with self.metrics.stage("parse"):
+            workbook = load_workbook(self._workbook(file_path), data_only=True)
 
         # Process each sheet in the workbook
         for sheet_name in workbook.sheetnames:
@@ -149,7 +159,8 @@ class ExcelIngestor:
                 current_table_name = table_name
 
             # Collect rows
-            rows = list(sheet.iter_rows(values_only=True))
+            with self.metrics.stage("parse"):
+                rows = list(sheet.iter_rows(values_only=True))
             if not rows:
                 print(f"Skipping empty sheet: {sheet_name}")
                 continue
@@ -179,30 +190,11 @@ class ExcelIngestor:
             ]
             columns = dedupe_columns(columns)
 
-            # Create table
-            cols_def = ", ".join([f"{sql.Identifier(c).as_string(self.conn)} TEXT" for c in columns])
-
-            create_query = sql.SQL("CREATE TABLE IF NOT EXISTS {}.{} ({})").format(
-                sql.Identifier(SCHEMA_NAME),
-                sql.Identifier(current_table_name),
-                sql.SQL(cols_def)
-            )
-
-            # Drop and recreate for idempotency
-            drop_query = sql.SQL("DROP TABLE IF EXISTS {}.{} CASCADE").format(
-                sql.Identifier(SCHEMA_NAME),
-                sql.Identifier(current_table_name)
-            )
-
-            with self.conn.cursor() as cur:
-                cur.execute(drop_query)
-                cur.execute(create_query)
+            # Drop and recreate for idempotency (or add new columns with --append)
+            table = Table(SCHEMA_NAME, current_table_name, [(c, "TEXT") for c in columns])
+            self.sink.create_table(table, append=self.append)
 
             # Insert data (rows after header). Skip rows that are entirely empty.
-            insert_query = sql.SQL("INSERT INTO {}.{} VALUES %s").format(
-                sql.Identifier(SCHEMA_NAME),
-                sql.Identifier(current_table_name)
-            )
 
             data_rows = []
             batch_size = 1000
@@ -221,16 +213,12 @@ class ExcelIngestor:
                 data_rows.append(processed_row)
 
                 if len(data_rows) >= batch_size:
-                    with self.conn.cursor() as cur:
-                        execute_values(cur, insert_query, data_rows)
-                    self.conn.commit()
+                    flush_batch(self.sink, table, data_rows, metrics=self.metrics)
                     data_rows = []
 
             # Insert remaining rows
             if data_rows:
-                with self.conn.cursor() as cur:
-                    execute_values(cur, insert_query, data_rows)
-                self.conn.commit()
+                flush_batch(self.sink, table, data_rows, metrics=self.metrics)
 
             print(f"  ✓ Ingested sheet '{sheet_name}' into table '{current_table_name}'")
 
@@ -240,16 +228,27 @@ class ExcelIngestor:
 class CSVIngestor:
     """Handles ingestion of .csv files from full data archive exports"""
     
-    def __init__(self, conn):
-        self.conn = conn
+    def __init__(self, sink, checkpoint, metrics, server_copy=False, append=False):
+        self.sink = sink
+        self.checkpoint = checkpoint
+        self.metrics = metrics
+        # Let Postgres read the files from its /local_data mount when it can (see copy_on_server)
+        self.server_copy = server_copy
+        self.append = append
     
     def ingest(self, file_path, table_name):
         """Ingest CSV file into PostgreSQL"""
+        unit = os.path.relpath(file_path, DATA_PATH)
+        if self.checkpoint.is_done(unit):
+            print(f"Skipping {unit}: already loaded.")
+            return
+
         print(f"Processing CSV file: {table_name}...")
+        count = self.checkpoint.rows_done(unit)
         
         try:
             # Detect encoding - LinkedIn sometimes uses UTF-8 or UTF-16
-            with open(file_path, 'r', encoding='utf-8') as f:
+            with open_file(file_path, 'r', encoding='utf-8') as f:
                 reader = csv.reader(f)
                 headers = next(reader, None)
                 
@@ -265,90 +264,93 @@ class CSVIngestor:
                     else:
                         columns.append(clean_header(h))
                 columns = dedupe_columns(columns)
+                # Rows and columns the filters drop are never written (see utils/ingestion_filters.py)
+                source_filter = load_filters("linkedin")
+                kept_columns = source_filter.kept_columns(table_name, columns)
+                keep = source_filter.record_filter(table_name, columns)
                 
-                # Create table
-                cols_def = ", ".join([f"{sql.Identifier(c).as_string(self.conn)} TEXT" for c in columns])
-                
-                create_query = sql.SQL("CREATE TABLE IF NOT EXISTS {}.{} ({})").format(
-                    sql.Identifier(SCHEMA_NAME),
-                    sql.Identifier(table_name),
-                    sql.SQL(cols_def)
-                )
-                
-                # Drop and recreate for idempotency
-                drop_query = sql.SQL("DROP TABLE IF EXISTS {}.{} CASCADE").format(
-                    sql.Identifier(SCHEMA_NAME),
-                    sql.Identifier(table_name)
-                )
-                
-                with self.conn.cursor() as cur:
-                    cur.execute(drop_query)
-                    cur.execute(create_query)
+                table = Table(SCHEMA_NAME, table_name, [(c, "TEXT") for c in project(columns, kept_columns)])
+                if self.checkpoint.get(unit) is None:
+                    # Drop and recreate for idempotency
+                    self.sink.create_table(table, self.checkpoint, unit, append=self.append, row=0)
+                    # Postgres reads the file itself, or big files are parsed on every core (unless the rows are filtered)
+                    copied = None
+                    filtered = kept_columns is not None or keep is not None
+                    if self.server_copy and not filtered:
+                        copied = copy_on_server(self.sink, table, file_path, columns, checkpoint=self.checkpoint,
+                                                unit=unit, metrics=self.metrics)
+                    if copied is None and not filtered:
+                        copied = copy_in_parallel(self.sink, table, file_path, columns, checkpoint=self.checkpoint,
+                                                  unit=unit, metrics=self.metrics)
+                    if copied is not None:
+                        return
+                else:
+                    print(f"  Resuming after row {count}.")
+                    skip_rows(reader, count)
                 
                 # Insert data
-                insert_query = sql.SQL("INSERT INTO {}.{} VALUES %s").format(
-                    sql.Identifier(SCHEMA_NAME),
-                    sql.Identifier(table_name)
-                )
-                
                 rows = []
                 batch_size = 1000
                 
-                for row in reader:
+                for row in pipelined(reader, self.metrics):
                     # Pad or truncate row to match headers
                     if len(row) < len(columns):
                         row += [None] * (len(columns) - len(row))
                     elif len(row) > len(columns):
                         row = row[:len(columns)]
                     
-                    rows.append(row)
+                    # count is the position in the file, filtered rows included, so that --resume skips them too
+                    count += 1
+                    if keep is not None and not keep(row):
+                        continue
+                    rows.append(project(row, kept_columns))
                     
                     if len(rows) >= batch_size:
-                        with self.conn.cursor() as cur:
-                            execute_values(cur, insert_query, rows)
-                        self.conn.commit()
+                        flush_batch(self.sink, table, rows, self.checkpoint, unit, self.metrics, row=count)
                         rows = []
                 
                 if rows:
-                    with self.conn.cursor() as cur:
-                        execute_values(cur, insert_query, rows)
-                    self.conn.commit()
+                    flush_batch(self.sink, table, rows, self.checkpoint, unit, self.metrics, row=count)
+                self.checkpoint.mark_done(unit, row=count)
                     
         except Exception as e:
-            self.conn.rollback()
+            if self.sink.conn is not None:
+                self.sink.conn.rollback()
             print(f"Error processing CSV file {file_path}: {e}")
 
 
 def scan_for_files():
     """Scan both basic and complete folders for files"""
     files_to_process = []
+    source_filter = load_filters("linkedin")
     
-    # Scan basic folder for .xlsx files
+    # Scan basic folder for .xlsx files (also inside .zip exports)
     if os.path.exists(BASIC_PATH):
-        for root, dirs, files in os.walk(BASIC_PATH):
-            for f in files:
-                if f.lower().endswith('.xlsx'):
-                    files_to_process.append({
-                        'path': os.path.join(root, f),
-                        'type': 'excel',
-                        'source': 'basic'
-                    })
+        for path in walk_files(BASIC_PATH):
+            if path.lower().endswith('.xlsx') and source_filter.wants_file(path, DATA_PATH):
+                files_to_process.append({
+                    'path': path,
+                    'type': 'excel',
+                    'source': 'basic'
+                })
     
-    # Scan complete folder for .csv files
+    # Scan complete folder for .csv files (also inside .zip exports)
     if os.path.exists(COMPLETE_PATH):
-        for root, dirs, files in os.walk(COMPLETE_PATH):
-            for f in files:
-                if f.lower().endswith('.csv'):
-                    files_to_process.append({
-                        'path': os.path.join(root, f),
-                        'type': 'csv',
-                        'source': 'complete'
-                    })
+        for path in walk_files(COMPLETE_PATH):
+            if path.lower().endswith('.csv') and source_filter.wants_file(path, DATA_PATH):
+                files_to_process.append({
+                    'path': path,
+                    'type': 'csv',
+                    'source': 'complete'
+                })
     
     return files_to_process
 
 
-def main():
+def main(argv=None):
+    parser = build_arg_parser("LinkedIn Data Ingestion")
+    args = parser.parse_args(argv)
+
     print(f"LinkedIn Data Ingestion")
     print(f"=" * 50)
     print(f"Base Path: {DATA_PATH}")
@@ -374,9 +376,12 @@ def main():
         sys.exit(0)
 
     # Calculate total size and estimate time
-    total_size_bytes = sum(os.path.getsize(f['path']) for f in files_to_process)
+    total_size_bytes = sum(file_size(f['path']) for f in files_to_process)
     total_size_mb = total_size_bytes / (1024 * 1024)
-    estimated_seconds = total_size_mb / 5.0
+    sink = open_sink(args)
+    conn = sink.conn
+    bytes_per_second = historical_throughput(conn, "linkedin", "bytes")
+    estimated_seconds = total_size_bytes / (bytes_per_second or DEFAULT_BYTES_PER_SECOND)
     
     # Group files by type
     excel_files = [f for f in files_to_process if f['type'] == 'excel']
@@ -402,9 +407,7 @@ def main():
     print(f"Total Size: {total_size_mb:.2f} MB")
     print(f"Estimated Processing Time: ~{estimated_seconds:.1f} seconds")
     
-    auto_confirm = ('--yes' in sys.argv) or ('-y' in sys.argv)
-
-    if not auto_confirm:
+    if not args.yes:
         try:
             response = input("\nDo you want to proceed with LinkedIn data ingestion? (y/N): ").strip().lower()
         except KeyboardInterrupt:
@@ -418,23 +421,41 @@ def main():
     print("\nStarting ingestion...")
     print("=" * 50)
     
-    conn = get_db_connection()
-    ensure_schema(conn, SCHEMA_NAME)
+    sink.ensure_schema(SCHEMA_NAME)
+    checkpoint = Checkpoint(conn, "linkedin", resume=args.resume)
+    metrics = RunMetrics("linkedin", profile_dir=args.profile)
+
+    cache = None
+    if args.cache:
+        from utils.ingestion_cache import ExportCache
+        cache = ExportCache("linkedin", SCHEMA_NAME, [f['path'] for f in files_to_process])
+        if cache.manifest() is not None:
+            with metrics.track(conn):
+                cache.load(conn, metrics)
+            checkpoint.finish()
+            sink.close()
+            return
     
-    excel_ingestor = ExcelIngestor(conn)
-    csv_ingestor = CSVIngestor(conn)
+    excel_ingestor = ExcelIngestor(sink, checkpoint, metrics, append=args.append)
+    csv_ingestor = CSVIngestor(sink, checkpoint, metrics, server_copy=args.server_copy, append=args.append)
     
-    for file_info in tqdm(files_to_process, desc="Ingesting Files"):
-        file_path = file_info['path']
-        filename = os.path.basename(file_path)
-        table_name = f"{file_info['source']}_{sanitize_table_name(filename)}"
-        
-        if file_info['type'] == 'excel':
-            excel_ingestor.ingest(file_path, table_name)
-        elif file_info['type'] == 'csv':
-            csv_ingestor.ingest(file_path, table_name)
-        
-    conn.close()
+    with metrics.track(conn):
+        for file_info in tqdm(files_to_process, desc="Ingesting Files"):
+            file_path = file_info['path']
+            filename = os.path.basename(file_path)
+            table_name = f"{file_info['source']}_{sanitize_table_name(filename)}"
+            metrics.add_file(file_path)
+            
+            with metrics.stage("transform"):
+                if file_info['type'] == 'excel':
+                    excel_ingestor.ingest(file_path, table_name)
+                elif file_info['type'] == 'csv':
+                    csv_ingestor.ingest(file_path, table_name)
+            
+        checkpoint.finish()
+    if cache is not None:
+        cache.save(conn)
+    sink.close()
     print("\n" + "=" * 50)
     print("✅ Ingestion complete!")
 
@@ -1,8 +1,23 @@
+import io
 import csv
 import os
+import sys
+import hashlib
+import argparse
 import holidays
-from datetime import date
-import inspect
+
+if __name__ == "__main__":
+    # Run as a script: make utils importable and load docker/.env (the database and LOCAL_DATA_PATH, for the cache).
+    # The jimwurst CLI (utils/cli.py) does both itself before importing this module.
+    sys.path.append(os.path.join(os.path.dirname(__file__), '../../../..'))
+    from utils.ingestion_utils import load_env
+    load_env()
+
+from psycopg2 import sql
+from utils.holiday_cache import HolidayCache
+from utils.ingestion_utils import get_db_connection
+from utils.ingestion_metrics import ensure_meta_tables
+from utils.source_changes import record_changes
 
 # Configuration
 # Subdivisions to include for specific countries
@@ -16,9 +31,10 @@ START_YEAR = 2020
 END_YEAR = 2030
 YEARS = range(START_YEAR, END_YEAR + 1)
 
-# Output path (dbt seeds)
-OUTPUT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../../data_transformation/dbt/seeds"))
-OUTPUT_FILE = os.path.join(OUTPUT_DIR, "public_holidays.csv")
+# Output table, a dbt source (models/staging/public_holidays/_public_holidays__sources.yml)
+SCHEMA_NAME = "marts"
+TABLE_NAME = "dim_public_holidays_raw"
+FIELDNAMES = ['date', 'country_code', 'subdivision_code', 'holiday_name']
 
 def get_all_supported_countries():
     """Dynamically fetch all supported country codes from the holidays library."""
@@ -33,78 +49,152 @@ def get_all_supported_countries():
                 
     return sorted(list(set(supported_countries)))
 
-def generate_holidays():
+def generate_holidays(years=YEARS, workers=None, csv_path=None):
+    """
+    Loads the holidays of all countries (and the SUBDIVISIONS_CONFIG subdivisions) over the
+    years into marts.dim_public_holidays_raw, or writes them to csv_path. Country-years
+    computed before come from the holiday cache (see utils/holiday_cache.py), the others are
+    computed in a process pool. The rows are sorted, and neither the table nor the file is
+    touched when their contents would not change.
+    """
     # 1. Identify all target countries
     target_countries = get_all_supported_countries()
-    print(f"Generating holidays for {len(target_countries)} countries from {START_YEAR} to {END_YEAR}...")
+    print(f"Generating holidays for {len(target_countries)} countries from {years[0]} to {years[-1]}...")
+
+    # 2. Compute the country-years that are not cached yet
+    cache = HolidayCache()
+    tasks = [(country_code, None, cache.missing_years(country_code, None, years)) for country_code in target_countries]
+    tasks += [
+        (country_code, subdiv_code, cache.missing_years(country_code, subdiv_code, years))
+        for country_code in target_countries
+        for subdiv_code in SUBDIVISIONS_CONFIG.get(country_code, [])
+    ]
+    errors = cache.fill(tasks, workers)
     
     # List to store all holiday records
     holiday_records = []
 
     for country_code in target_countries:
-        try:
-            # --- A. National Holidays ---
-            # Fetch national holidays (subdiv=None)
-            national_holidays_obj = holidays.country_holidays(country_code, years=YEARS)
-            
-            # Convert to a dict for easy lookup later (date -> name)
-            # This handles the "observed" logic implicitly if the library supports it, 
-            # usually the keys are the actual holiday dates.
-            national_holidays_map = {d: name for d, name in national_holidays_obj.items()}
-
-            for h_date, h_name in national_holidays_map.items():
-                holiday_records.append({
-                    'date': h_date,
-                    'country_code': country_code,
-                    'subdivision_code': '', # Empty for National
-                    'holiday_name': h_name
-                })
-
-            # --- B. Subdivision Holidays ---
-            # Check if we have specific subdivisions requested for this country
-            if country_code in SUBDIVISIONS_CONFIG:
-                for subdiv_code in SUBDIVISIONS_CONFIG[country_code]:
-                    try:
-                        subdiv_holidays_obj = holidays.country_holidays(country_code, subdiv=subdiv_code, years=YEARS)
-                        
-                        for h_date, h_name in subdiv_holidays_obj.items():
-                            # Deduplication: Only add if NOT in national holidays for this date
-                            # Or if the name is significantly different? 
-                            # Usually strict date exclusion is safer to avoid duplicates.
-                            # Determining if a holiday is "state specific" usually means it exists in state but not national.
-                            
-                            if h_date not in national_holidays_map:
-                                holiday_records.append({
-                                    'date': h_date,
-                                    'country_code': country_code,
-                                    'subdivision_code': subdiv_code,
-                                    'holiday_name': h_name
-                                })
-                    except NotImplementedError:
-                         print(f"Warning: Subdivisions not implemented for {country_code}")
-                    except Exception as e:
-                        print(f"Error fetching subdivision {subdiv_code} for {country_code}: {e}")
-
-        except Exception as e:
-            print(f"Skipping {country_code} due to error: {e}")
-    
-    # Sort by date, country, subdivision
-    holiday_records.sort(key=lambda x: (x['date'], x['country_code'], x['subdivision_code']))
+        if (country_code, None) in errors:
+            print(f"Skipping {country_code} due to error: {errors[country_code, None]}")
+            continue
+
+        # --- A. National Holidays ---
+        # date -> name; the keys are the actual holiday dates
+        national_holidays_map = cache.holidays(country_code, None, years)
+
+        for h_date, h_name in national_holidays_map.items():
+            holiday_records.append({
+                'date': h_date,
+                'country_code': country_code,
+                'subdivision_code': '', # Empty for National
+                'holiday_name': h_name
+            })
+
+        # --- B. Subdivision Holidays ---
+        # Check if we have specific subdivisions requested for this country
+        for subdiv_code in SUBDIVISIONS_CONFIG.get(country_code, []):
+            error = errors.get((country_code, subdiv_code))
+            if isinstance(error, NotImplementedError):
+                print(f"Warning: Subdivisions not implemented for {country_code}")
+                continue
+            if error is not None:
+                print(f"Error fetching subdivision {subdiv_code} for {country_code}: {error}")
+                continue
+
+            for h_date, h_name in cache.holidays(country_code, subdiv_code, years).items():
+                # Deduplication: Only add if NOT in national holidays for this date.
+                # Determining if a holiday is "state specific" usually means it exists in state but not national.
+                if h_date not in national_holidays_map:
+                    holiday_records.append({
+                        'date': h_date,
+                        'country_code': country_code,
+                        'subdivision_code': subdiv_code,
+                        'holiday_name': h_name
+                    })
     
-    # Ensure output directory exists
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    # Sort by date, country, subdivision (and name, so the order never depends on the computation)
+    holiday_records.sort(key=lambda x: (x['date'], x['country_code'], x['subdivision_code'], x['holiday_name']))
     
-    # Write to CSV
-    print(f"Writing to {OUTPUT_FILE}...")
-    with open(OUTPUT_FILE, 'w', newline='', encoding='utf-8') as csvfile:
-        fieldnames = ['date', 'country_code', 'subdivision_code', 'holiday_name']
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        
-        writer.writeheader()
-        for record in holiday_records:
-            writer.writerow(record)
-            
-    print(f"Successfully generated {len(holiday_records)} holiday records.")
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=FIELDNAMES, lineterminator='\n')
+    writer.writeheader()
+    writer.writerows(holiday_records)
+    content = out.getvalue()
+
+    if csv_path:
+        write_csv(content, csv_path, len(holiday_records))
+    else:
+        load_table(content, len(holiday_records))
+
+def write_csv(content, path, count):
+    """Writes the holidays CSV to path, unless it already has this content."""
+    try:
+        with open(path, encoding='utf-8', newline='') as f:
+            unchanged = f.read() == content
+    except OSError:
+        unchanged = False
+    if unchanged:
+        print(f"{path} is up to date ({count} holiday records).")
+        return
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    print(f"Writing to {path}...")
+    with open(path, 'w', newline='', encoding='utf-8') as csvfile:
+        csvfile.write(content)
+    print(f"Successfully generated {count} holiday records.")
+
+def load_table(content, count):
+    """
+    Replaces the rows of marts.dim_public_holidays_raw with the holidays CSV through COPY, in
+    one transaction. The table comment holds the hash of what was loaded, so an unchanged
+    table is left alone (and dbt sees no change). A load is recorded in meta.source_changes
+    for `jimwurst transform`.
+    """
+    table = sql.Identifier(SCHEMA_NAME, TABLE_NAME)
+    digest = "sha256:" + hashlib.sha256(content.encode('utf-8')).hexdigest()
+    conn = get_db_connection()
+    try:
+        ensure_meta_tables(conn)
+        with conn.cursor() as cur:
+            cur.execute(sql.SQL("CREATE SCHEMA IF NOT EXISTS {}").format(sql.Identifier(SCHEMA_NAME)))
+            # National holidays have an empty subdivision_code rather than NULL, so the unique index covers them
+            cur.execute(sql.SQL("""
+                CREATE TABLE IF NOT EXISTS {} (
+                    date DATE NOT NULL,
+                    country_code TEXT NOT NULL,
+                    subdivision_code TEXT NOT NULL DEFAULT '',
+                    holiday_name TEXT NOT NULL
+                )
+            """).format(table))
+            cur.execute(sql.SQL("CREATE UNIQUE INDEX IF NOT EXISTS {} ON {} (date, country_code, subdivision_code)").format(
+                sql.Identifier(f"{TABLE_NAME}_key"), table))
+            cur.execute("SELECT obj_description(%s::regclass, 'pg_class')", (f"{SCHEMA_NAME}.{TABLE_NAME}",))
+            if cur.fetchone()[0] == digest:
+                print(f"{SCHEMA_NAME}.{TABLE_NAME} is up to date ({count} holiday records).")
+                conn.rollback()
+                return
+
+            print(f"Loading {count} holiday records into {SCHEMA_NAME}.{TABLE_NAME}...")
+            cur.execute(sql.SQL("TRUNCATE {}").format(table))
+            cur.copy_expert(sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv, HEADER true, FORCE_NOT_NULL ({}))").format(
+                table, sql.SQL(", ").join(map(sql.Identifier, FIELDNAMES)), sql.Identifier("subdivision_code")
+            ).as_string(conn), io.StringIO(content))
+            cur.execute(sql.SQL("COMMENT ON TABLE {} IS {}").format(table, sql.Literal(digest)))
+            cur.execute(sql.SQL("ANALYZE {}").format(table))
+            record_changes(cur, [(SCHEMA_NAME, TABLE_NAME)])
+        conn.commit()
+    finally:
+        conn.close()
+    print(f"Successfully loaded {count} holiday records.")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Public holidays for marts.dim_public_holidays_raw")
+    parser.add_argument('--workers', type=int,
+                        help='Processes computing the holidays missing from the cache (default: one per core)')
+    parser.add_argument('--csv', metavar='PATH', help='Write the holidays to a CSV file instead of the table')
+    args = parser.parse_args(argv)
+    generate_holidays(workers=args.workers, csv_path=args.csv)
 
 if __name__ == "__main__":
-    generate_holidays()
+    main()
@@ -2,18 +2,21 @@ import os
 import sys
 import csv
 import json
-import argparse
-import psycopg2
-from psycopg2 import sql
-from psycopg2.extras import execute_values
 from tqdm import tqdm
 
-# Import common utilities
-sys.path.append(os.path.join(os.path.dirname(__file__), '../../../../utils'))
-from ingestion_utils import load_env, get_db_connection, ensure_schema, clean_header, sanitize_table_name
+if __name__ == "__main__":
+    # Run as a script: make utils importable and load docker/.env before the settings below are read.
+    # The jimwurst CLI (utils/cli.py) does both itself before importing this module.
+    sys.path.append(os.path.join(os.path.dirname(__file__), '../../../..'))
+    from utils.ingestion_utils import load_env
+    load_env()
 
-# Load env vars
-load_env()
+from utils.ingestion_utils import clean_header, sanitize_table_name, build_arg_parser, Checkpoint, flush_batch, skip_rows
+from utils.ingestion_sinks import Table, open_sink
+from utils.ingestion_metrics import RunMetrics, historical_throughput
+from utils.ingestion_pipeline import pipelined
+from utils.export_files import walk_files, open_file, file_size
+from utils.ingestion_filters import load_filters, project
 
 DB_HOST = os.getenv("DB_HOST", "localhost")
 DB_NAME = os.getenv("POSTGRES_DB", "jimwurst_db")
@@ -26,12 +29,18 @@ DATA_PATH = os.getenv("SPOTIFY_DATA_PATH", DEFAULT_DATA_PATH)
 
 SCHEMA_NAME = "s_spotify"
 
+# Used for the time estimate until a run has been recorded in meta.ingestion_runs
+DEFAULT_BYTES_PER_SECOND = 5.0 * 1024 * 1024
+
 
 class JSONIngestor:
     """Handles ingestion of .json files from Spotify exports"""
     
-    def __init__(self, conn):
-        self.conn = conn
+    def __init__(self, sink, checkpoint, metrics, append=False):
+        self.sink = sink
+        self.checkpoint = checkpoint
+        self.metrics = metrics
+        self.append = append
     
     def flatten_json(self, data, parent_key='', sep='_'):
         """Flatten nested JSON structure"""
@@ -54,10 +63,16 @@ class JSONIngestor:
     
     def ingest(self, file_path, table_name):
         """Ingest JSON file into PostgreSQL"""
+        unit = os.path.relpath(file_path, DATA_PATH)
+        if self.checkpoint.is_done(unit):
+            print(f"Skipping {unit}: already loaded.")
+            return
+
         print(f"Processing JSON file: {table_name}...")
+        count = self.checkpoint.rows_done(unit)
         
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
+            with self.metrics.stage("parse"), open_file(file_path, 'r', encoding='utf-8') as f:
                 data = json.load(f)
             
             # Handle different JSON structures
@@ -79,19 +94,32 @@ class JSONIngestor:
                 print(f"No records found in {file_path}")
                 return
             
-            # Flatten all records and collect all unique keys
+            # Handle primitive values in list
+            records = [record if isinstance(record, dict) else {'value': str(record)} for record in records]
+
+            # Records the filters drop are never flattened (see utils/ingestion_filters.py) when the
+            # filters read top-level fields only; a filter on a nested field sees flattened records
+            source_filter = load_filters("spotify")
+            top_level_keys = set()
+            for record in records:
+                top_level_keys.update(record)
+            fields = {clean_header(k): k for k in top_level_keys}
+            flattened_first = not source_filter.reads_only(table_name, list(fields))
+            if flattened_first:
+                records = [self.flatten_json(record) for record in records]
+                fields = {clean_header(k): k for record in records for k in record}
+            keep = source_filter.record_filter(table_name, fields)
+
+            # Flatten the kept records and collect their unique keys, with their position in the file
             flattened_records = []
             all_keys = set()
             
-            for record in records:
-                if isinstance(record, dict):
-                    flattened = self.flatten_json(record)
-                    flattened_records.append(flattened)
-                    all_keys.update(flattened.keys())
-                else:
-                    # Handle primitive values in list
-                    flattened_records.append({'value': str(record)})
-                    all_keys.add('value')
+            for position, record in enumerate(records, 1):
+                if keep is not None and not keep(record):
+                    continue
+                flattened = record if flattened_first else self.flatten_json(record)
+                flattened_records.append((position, flattened))
+                all_keys.update(flattened.keys())
             
             if not all_keys:
                 print(f"No data to ingest from {file_path}")
@@ -99,39 +127,30 @@ class JSONIngestor:
             
             # Clean column names
             columns = [clean_header(k) for k in sorted(all_keys)]
+            # Map cleaned keys back to original for lookup
+            key_mapping = {clean_header(k): k for k in all_keys}
+
+            # Columns the filters drop are never written
+            columns = project(columns, source_filter.kept_columns(table_name, columns))
             
-            # Create table
-            cols_def = ", ".join([f"{sql.Identifier(c).as_string(self.conn)} TEXT" for c in columns])
-            
-            create_query = sql.SQL("CREATE TABLE IF NOT EXISTS {}.{} ({})").format(
-                sql.Identifier(SCHEMA_NAME),
-                sql.Identifier(table_name),
-                sql.SQL(cols_def)
-            )
-            
-            # Drop and recreate for idempotency
-            drop_query = sql.SQL("DROP TABLE IF EXISTS {}.{} CASCADE").format(
-                sql.Identifier(SCHEMA_NAME),
-                sql.Identifier(table_name)
-            )
-            
-            with self.conn.cursor() as cur:
-                cur.execute(drop_query)
-                cur.execute(create_query)
+            table = Table(SCHEMA_NAME, table_name, [(c, "TEXT") for c in columns])
+            if self.checkpoint.get(unit) is None:
+                # Drop and recreate for idempotency
+                self.sink.create_table(table, self.checkpoint, unit, append=self.append, row=0)
+            else:
+                print(f"  Resuming after record {count}.")
             
             # Insert data
-            insert_query = sql.SQL("INSERT INTO {}.{} VALUES %s").format(
-                sql.Identifier(SCHEMA_NAME),
-                sql.Identifier(table_name)
-            )
-            
             data_rows = []
             batch_size = 1000
+            kept = 0
             
-            # Map cleaned keys back to original for lookup
-            key_mapping = {clean_header(k): k for k in all_keys}
-            
-            for record in flattened_records:
+            for position, record in flattened_records:
+                # position is in the file, filtered records included, so that --resume skips them too
+                if position <= count:
+                    continue
+                count = position
+                kept += 1
                 row = []
                 for col in columns:
                     original_key = key_mapping[col]
@@ -140,18 +159,16 @@ class JSONIngestor:
                 data_rows.append(row)
                 
                 if len(data_rows) >= batch_size:
-                    with self.conn.cursor() as cur:
-                        execute_values(cur, insert_query, data_rows)
-                    self.conn.commit()
+                    flush_batch(self.sink, table, data_rows, self.checkpoint, unit, self.metrics, row=count)
                     data_rows = []
             
             # Insert remaining rows
+            count = len(records)
             if data_rows:
-                with self.conn.cursor() as cur:
-                    execute_values(cur, insert_query, data_rows)
-                self.conn.commit()
+                flush_batch(self.sink, table, data_rows, self.checkpoint, unit, self.metrics, row=count)
+            self.checkpoint.mark_done(unit, row=count)
             
-            print(f"  ✓ Ingested {len(flattened_records)} records into table '{table_name}'")
+            print(f"  ✓ Ingested {kept} records into table '{table_name}'")
             
         except Exception as e:
             print(f"Error processing JSON file {file_path}: {e}")
@@ -160,12 +177,21 @@ class JSONIngestor:
 class CSVIngestor:
     """Handles ingestion of .csv files from Spotify exports"""
     
-    def __init__(self, conn):
-        self.conn = conn
+    def __init__(self, sink, checkpoint, metrics, append=False):
+        self.sink = sink
+        self.checkpoint = checkpoint
+        self.metrics = metrics
+        self.append = append
     
     def ingest(self, file_path, table_name):
         """Ingest CSV file into PostgreSQL"""
+        unit = os.path.relpath(file_path, DATA_PATH)
+        if self.checkpoint.is_done(unit):
+            print(f"Skipping {unit}: already loaded.")
+            return
+
         print(f"Processing CSV file: {table_name}...")
+        count = self.checkpoint.rows_done(unit)
         
         try:
             # Try UTF-8 first, fallback to other encodings if needed
@@ -173,14 +199,15 @@ class CSVIngestor:
             file_content = None
             used_encoding = None
             
-            for encoding in encodings:
-                try:
-                    with open(file_path, 'r', encoding=encoding) as f:
-                        file_content = f.read()
-                        used_encoding = encoding
-                        break
-                except UnicodeDecodeError:
-                    continue
+            with self.metrics.stage("parse"):
+                for encoding in encodings:
+                    try:
+                        with open_file(file_path, 'r', encoding=encoding) as f:
+                            file_content = f.read()
+                            used_encoding = encoding
+                            break
+                    except UnicodeDecodeError:
+                        continue
             
             if file_content is None:
                 print(f"Could not decode file {file_path} with any supported encoding")
@@ -197,54 +224,43 @@ class CSVIngestor:
 
             # Sanitize column names
             columns = [clean_header(h) for h in headers]
+            # Rows and columns the filters drop are never written (see utils/ingestion_filters.py)
+            source_filter = load_filters("spotify")
+            kept_columns = source_filter.kept_columns(table_name, columns)
+            keep = source_filter.record_filter(table_name, columns)
             
-            # Create table
-            cols_def = ", ".join([f"{sql.Identifier(c).as_string(self.conn)} TEXT" for c in columns])
-            
-            create_query = sql.SQL("CREATE TABLE IF NOT EXISTS {}.{} ({})").format(
-                sql.Identifier(SCHEMA_NAME),
-                sql.Identifier(table_name),
-                sql.SQL(cols_def)
-            )
-            
-            # Drop and recreate for idempotency
-            drop_query = sql.SQL("DROP TABLE IF EXISTS {}.{} CASCADE").format(
-                sql.Identifier(SCHEMA_NAME),
-                sql.Identifier(table_name)
-            )
-            
-            with self.conn.cursor() as cur:
-                cur.execute(drop_query)
-                cur.execute(create_query)
+            table = Table(SCHEMA_NAME, table_name, [(c, "TEXT") for c in project(columns, kept_columns)])
+            if self.checkpoint.get(unit) is None:
+                # Drop and recreate for idempotency
+                self.sink.create_table(table, self.checkpoint, unit, append=self.append, row=0)
+            else:
+                print(f"  Resuming after row {count}.")
+                skip_rows(csv_reader, count)
             
             # Insert data
-            insert_query = sql.SQL("INSERT INTO {}.{} VALUES %s").format(
-                sql.Identifier(SCHEMA_NAME),
-                sql.Identifier(table_name)
-            )
-            
             rows = []
             batch_size = 1000
             
-            for row in csv_reader:
+            for row in pipelined(csv_reader, self.metrics):
                 # Pad or truncate row to match headers
                 if len(row) < len(columns):
                     row += [None] * (len(columns) - len(row))
                 elif len(row) > len(columns):
                     row = row[:len(columns)]
                 
-                rows.append(row)
+                # count is the position in the file, filtered rows included, so that --resume skips them too
+                count += 1
+                if keep is not None and not keep(row):
+                    continue
+                rows.append(project(row, kept_columns))
                 
                 if len(rows) >= batch_size:
-                    with self.conn.cursor() as cur:
-                        execute_values(cur, insert_query, rows)
-                    self.conn.commit()
+                    flush_batch(self.sink, table, rows, self.checkpoint, unit, self.metrics, row=count)
                     rows = []
             
             if rows:
-                with self.conn.cursor() as cur:
-                    execute_values(cur, insert_query, rows)
-                self.conn.commit()
+                flush_batch(self.sink, table, rows, self.checkpoint, unit, self.metrics, row=count)
+            self.checkpoint.mark_done(unit, row=count)
                 
         except Exception as e:
             print(f"Error processing CSV file {file_path}: {e}")
@@ -256,31 +272,36 @@ def scan_for_files():
     
     if not os.path.exists(DATA_PATH):
         return files_to_process
+
+    # Files the filters leave out are not even listed (see utils/ingestion_filters.py)
+    source_filter = load_filters("spotify")
     
-    for root, dirs, files in os.walk(DATA_PATH):
-        for f in files:
-            file_lower = f.lower()
-            if file_lower.endswith('.json'):
-                files_to_process.append({
-                    'path': os.path.join(root, f),
-                    'type': 'json',
-                    'name': f
-                })
-            elif file_lower.endswith('.csv'):
-                files_to_process.append({
-                    'path': os.path.join(root, f),
-                    'type': 'csv',
-                    'name': f
-                })
+    # my_spotify_data.zip and the like are read without extracting them
+    for path in walk_files(DATA_PATH):
+        f = os.path.basename(path)
+        file_lower = f.lower()
+        if not source_filter.wants_file(path, DATA_PATH):
+            continue
+        if file_lower.endswith('.json'):
+            files_to_process.append({
+                'path': path,
+                'type': 'json',
+                'name': f
+            })
+        elif file_lower.endswith('.csv'):
+            files_to_process.append({
+                'path': path,
+                'type': 'csv',
+                'name': f
+            })
     
     return files_to_process
 
 
-def main():
-    parser = argparse.ArgumentParser(description="Spotify Data Ingestion")
-    parser.add_argument('--yes', '-y', action='store_true', help='Skip confirmation prompt')
+def main(argv=None):
+    parser = build_arg_parser("Spotify Data Ingestion")
     parser.add_argument('--dry-run', action='store_true', help='Show what would be ingested without actually doing it')
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     
     print(f"Spotify Data Ingestion")
     print(f"=" * 50)
@@ -305,9 +326,13 @@ def main():
         sys.exit(0)
 
     # Calculate total size and estimate time
-    total_size_bytes = sum(os.path.getsize(f['path']) for f in files_to_process)
+    total_size_bytes = sum(file_size(f['path']) for f in files_to_process)
     total_size_mb = total_size_bytes / (1024 * 1024)
-    estimated_seconds = total_size_mb / 5.0
+    # A dry run does not need the database, so it always uses the default rate
+    sink = None if args.dry_run else open_sink(args)
+    conn = sink.conn if sink else None
+    bytes_per_second = historical_throughput(conn, "spotify", "bytes") if conn else None
+    estimated_seconds = total_size_bytes / (bytes_per_second or DEFAULT_BYTES_PER_SECOND)
     
     # Group files by type
     json_files = [f for f in files_to_process if f['type'] == 'json']
@@ -351,23 +376,41 @@ def main():
     print("\nStarting ingestion...")
     print("=" * 50)
     
-    conn = get_db_connection()
-    ensure_schema(conn, SCHEMA_NAME)
+    sink.ensure_schema(SCHEMA_NAME)
+    checkpoint = Checkpoint(conn, "spotify", resume=args.resume)
+    metrics = RunMetrics("spotify", profile_dir=args.profile)
+
+    cache = None
+    if args.cache:
+        from utils.ingestion_cache import ExportCache
+        cache = ExportCache("spotify", SCHEMA_NAME, [f['path'] for f in files_to_process])
+        if cache.manifest() is not None:
+            with metrics.track(conn):
+                cache.load(conn, metrics)
+            checkpoint.finish()
+            sink.close()
+            return
     
-    json_ingestor = JSONIngestor(conn)
-    csv_ingestor = CSVIngestor(conn)
+    json_ingestor = JSONIngestor(sink, checkpoint, metrics, append=args.append)
+    csv_ingestor = CSVIngestor(sink, checkpoint, metrics, append=args.append)
     
-    for file_info in tqdm(files_to_process, desc="Ingesting Files"):
-        file_path = file_info['path']
-        filename = os.path.basename(file_path)
-        table_name = sanitize_table_name(filename)
-        
-        if file_info['type'] == 'json':
-            json_ingestor.ingest(file_path, table_name)
-        elif file_info['type'] == 'csv':
-            csv_ingestor.ingest(file_path, table_name)
-        
-    conn.close()
+    with metrics.track(conn):
+        for file_info in tqdm(files_to_process, desc="Ingesting Files"):
+            file_path = file_info['path']
+            filename = os.path.basename(file_path)
+            table_name = sanitize_table_name(filename)
+            metrics.add_file(file_path)
+            
+            with metrics.stage("transform"):
+                if file_info['type'] == 'json':
+                    json_ingestor.ingest(file_path, table_name)
+                elif file_info['type'] == 'csv':
+                    csv_ingestor.ingest(file_path, table_name)
+            
+        checkpoint.finish()
+    if cache is not None:
+        cache.save(conn)
+    sink.close()
     print("\n" + "=" * 50)
     print("✅ Ingestion complete!")
 
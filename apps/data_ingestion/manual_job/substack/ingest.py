@@ -1,27 +1,119 @@
 import os
+import re
 import sys
 import csv
-import psycopg2
-from psycopg2 import sql
-from psycopg2.extras import execute_values
-from tqdm import tqdm
+import hashlib
+from datetime import datetime
 
-# Import common utilities
-sys.path.append(os.path.join(os.path.dirname(__file__), '../../../../utils'))
-from ingestion_utils import load_env, get_db_connection, ensure_schema, clean_header
+if __name__ == "__main__":
+    # Run as a script: make utils importable and load docker/.env before the settings below are read.
+    # The jimwurst CLI (utils/cli.py) does both itself before importing this module.
+    sys.path.append(os.path.join(os.path.dirname(__file__), '../../../..'))
+    from utils.ingestion_utils import load_env
+    load_env()
 
-# Load env vars
-load_env()
+from psycopg2 import sql
+from utils.ingestion_utils import clean_header, build_arg_parser, Checkpoint, flush_batch, copy_on_server, copy_in_parallel, skip_rows
+from utils.ingestion_sinks import Table, open_sink
+from utils.ingestion_metrics import RunMetrics
+from utils.ingestion_pipeline import pipelined
+from utils.export_files import export_folders, folder_name, list_files, open_file
+from utils.ingestion_filters import load_filters, project
 
 DEFAULT_DATA_PATH = os.path.expanduser("~/Documents/jimwurst_local_data/substack")
 DATA_PATH = os.getenv("SUBSTACK_DATA_PATH", DEFAULT_DATA_PATH)
 
 SCHEMA_NAME = "s_substack"
 
-def ingest_csv(conn, file_path, table_name, source_folder, append=False):
-    """Ingest a CSV file into a table, including a _source_folder column."""
+# Event tables are deduplicated while loading: overlapping export folders contain the
+# same events, so we keep one row per (post_id, email, event_at, event_type) and prefer
+# the copy from the newest folder (same heuristic fct_substack__post_events used to apply).
+EVENT_TABLES = {
+    "post_delivers": "delivery",
+    "post_opens": "open",
+}
+EVENT_KEY_COLUMNS = ["post_id", "email", "timestamp"]
+# ISO timestamps (2024-01-02T10:00:00.000Z), which the key holds the way Postgres prints them
+# cast to timestamp, as fct_substack__post_events hashes event_at::text: exports that format
+# the same instant differently then agree, here and in the mart
+TIMESTAMP_PATTERN = (r"^(\d{4}-(?:0[1-9]|1[0-2])-(?:0[1-9]|[12]\d|3[01]))[ T]((?:[01]\d|2[0-3]):[0-5]\d:[0-5]\d)"
+                     r"(?:\.(\d{1,6}))?(?:Z|[+-]\d{2}(?::?\d{2})?)?$")
+TIMESTAMP_RE = re.compile(TIMESTAMP_PATTERN)
+
+
+def event_timestamp(value):
+    """A timestamp as Postgres prints value::timestamp::text (the offset is dropped), or value if it is none."""
+    match = TIMESTAMP_RE.match(value or '')
+    if not match:
+        return value
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
+        datetime.strptime(f"{match[1]} {match[2]}", "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return value
+    fraction = (match[3] or '').rstrip('0')
+    return f"{match[1]} {match[2]}" + (f".{fraction}" if fraction else "")
+
+
+def event_key(row, key_indexes, event_type):
+    """Builds the dedup key for an event row: md5 of post_id|email|event_at|event_type."""
+    parts = [(row[i] or '') if i is not None else '' for i in key_indexes]
+    parts[EVENT_KEY_COLUMNS.index("timestamp")] = event_timestamp(parts[EVENT_KEY_COLUMNS.index("timestamp")])
+    parts.append(event_type)
+    return hashlib.md5("|".join(parts).encode('utf-8')).hexdigest()
+
+
+def event_key_sql(columns, event_type):
+    """event_key as a SQL expression over the CSV columns, for a server-side COPY."""
+    def part(column):
+        if column not in columns:
+            return sql.Literal("")
+        value = sql.Identifier(column)
+        if column == "timestamp":
+            # Like event_timestamp(): other values, and days a month does not have, stay as they are
+            value = sql.SQL("""CASE WHEN {0} !~ {1} THEN {0}
+                WHEN substr({0}, 9, 2)::int > extract(day FROM (left({0}, 7) || '-01')::date
+                                                         + interval '1 month - 1 day') THEN {0}
+                ELSE {0}::timestamp::text END""").format(value, sql.Literal(TIMESTAMP_PATTERN))
+        return sql.SQL("coalesce({}, '')").format(value)
+
+    parts = [part(c) for c in EVENT_KEY_COLUMNS]
+    parts.append(sql.Literal(event_type))
+    return sql.SQL("md5({})").format(sql.SQL(" || '|' || ").join(parts))
+
+
+def dedupe_events(rows):
+    """
+    Collapses duplicate event keys within one batch (last column is the key).
+    An upsert (ON CONFLICT DO UPDATE) cannot touch the same row twice in a single statement.
+    """
+    unique = {}
+    for row in rows:
+        existing = unique.get(row[-1])
+        if existing is None or existing[-2] <= row[-2]:
+            unique[row[-1]] = row
+    return list(unique.values())
+
+
+def ingest_csv(sink, file_path, table_name, source_folder, checkpoint, unit, metrics, append=False, event_type=None,
+               server_copy=False):
+    """
+    Ingest a CSV file into a table, including a _source_folder column.
+    If event_type is given, an _event_key column is added and duplicates are resolved
+    on insert through a unique index, keeping the row from the newest source folder.
+    With server_copy, Postgres reads the file itself when it can (see copy_on_server).
+    """
+    if checkpoint.is_done(unit):
+        print(f"Skipping {unit}: already loaded.")
+        return
+
+    metrics.add_file(file_path)
+    count = checkpoint.rows_done(unit)
+    if checkpoint.get(unit) is not None:
+        # The table was set up by the interrupted run
+        print(f"Resuming {unit} after row {count}.")
+
+    try:
+        with open_file(file_path, 'r', encoding='utf-8') as f:
             reader = csv.reader(f)
             headers = next(reader, None)
             
@@ -30,130 +122,181 @@ def ingest_csv(conn, file_path, table_name, source_folder, append=False):
 
             # Sanitize column names and add metadata columns
             columns = [clean_header(h) for h in headers]
+            # Rows and columns the filters drop are never written (see utils/ingestion_filters.py)
+            source_filter = load_filters("substack")
+            kept_columns = source_filter.kept_columns(table_name, columns)
+            keep = source_filter.record_filter(table_name, columns)
             # Ensure unique columns (sometimes Substack might have duplicate headers or we add metadata)
-            final_columns = columns + ["_source_folder"]
+            final_columns = project(columns, kept_columns) + ["_source_folder"]
+            if event_type:
+                final_columns.append("_event_key")
+                key_indexes = [columns.index(c) if c in columns else None for c in EVENT_KEY_COLUMNS]
             
-            # Create table if not exists or if we are not appending
-            if not append:
-                # Drop and recreate for idempotency in this manual job context
-                drop_query = sql.SQL("DROP TABLE IF EXISTS {}.{} CASCADE").format(
-                    sql.Identifier(SCHEMA_NAME),
-                    sql.Identifier(table_name)
-                )
-                with conn.cursor() as cur:
-                    cur.execute(drop_query)
-                
-                cols_def = ", ".join([f"{sql.Identifier(c).as_string(conn)} TEXT" for c in final_columns])
-                create_query = sql.SQL("CREATE TABLE {}.{} ({})").format(
-                    sql.Identifier(SCHEMA_NAME),
-                    sql.Identifier(table_name),
-                    sql.SQL(cols_def)
-                )
-                with conn.cursor() as cur:
-                    cur.execute(create_query)
+            # Overwrite an existing event only if the incoming copy comes from a newer folder
+            table = Table(SCHEMA_NAME, table_name, [(c, "TEXT") for c in final_columns],
+                          unique_key="_event_key" if event_type else None, newer_column="_source_folder")
             
-            # Insert data
-            insert_query = sql.SQL("INSERT INTO {}.{} VALUES %s").format(
-                sql.Identifier(SCHEMA_NAME),
-                sql.Identifier(table_name)
-            )
+            if checkpoint.get(unit) is None:
+                # Drop and recreate for idempotency in this manual job context, or, for a table
+                # this file is appended to, add the columns it brings (newer exports add fields)
+                sink.create_table(table, checkpoint, unit, append=append, table=table_name, row=0)
+
+            if count == 0 and kept_columns is None and keep is None:
+                # Postgres reads the file itself, or big files are parsed on every core
+                extra_columns = {"_source_folder": sql.Literal(source_folder)}
+                if event_type:
+                    extra_columns["_event_key"] = event_key_sql(columns, event_type)
+                copied = None
+                if server_copy:
+                    copied = copy_on_server(sink, table, file_path, columns, extra_columns=extra_columns,
+                                            checkpoint=checkpoint, unit=unit, metrics=metrics, table=table_name)
+                if copied is None:
+                    copied = copy_in_parallel(sink, table, file_path, columns, extra_columns=extra_columns,
+                                              checkpoint=checkpoint, unit=unit, metrics=metrics, table=table_name)
+                if copied is not None:
+                    return
             
             rows = []
             batch_size = 1000
+            dropped = 0
+            skip_rows(reader, count)
             
-            for row in reader:
-                # Pad/truncate row to match original header length
-                if len(row) < len(columns):
-                    row += [None] * (len(columns) - len(row))
-                elif len(row) > len(columns):
-                    row = row[:len(columns)]
+            with metrics.stage("transform"):
+                for row in pipelined(reader, metrics):
+                    # Pad/truncate row to match original header length
+                    if len(row) < len(columns):
+                        row += [None] * (len(columns) - len(row))
+                    elif len(row) > len(columns):
+                        row = row[:len(columns)]
+
+                    # count is the position in the file, filtered rows included, so that --resume skips them too
+                    count += 1
+                    if keep is not None and not keep(row):
+                        dropped += 1
+                        continue
                 
-                # Append metadata
-                row.append(source_folder)
-                rows.append(row)
+                    # Append metadata (the event key is built from all columns, kept or not)
+                    key = event_key(row, key_indexes, event_type) if event_type else None
+                    row = project(row, kept_columns)
+                    row.append(source_folder)
+                    if event_type:
+                        row.append(key)
+                    rows.append(row)
                 
-                if len(rows) >= batch_size:
-                    with conn.cursor() as cur:
-                        execute_values(cur, insert_query, rows)
-                    conn.commit()
-                    rows = []
+                    if len(rows) >= batch_size:
+                        flush_batch(sink, table, dedupe_events(rows) if event_type else rows,
+                                    checkpoint, unit, metrics, table=table_name, row=count)
+                        rows = []
             
-            if rows:
-                with conn.cursor() as cur:
-                    execute_values(cur, insert_query, rows)
-                conn.commit()
+                if rows:
+                    flush_batch(sink, table, dedupe_events(rows) if event_type else rows,
+                                checkpoint, unit, metrics, table=table_name, row=count)
+            checkpoint.mark_done(unit, table=table_name, row=count)
+            if dropped:
+                print(f"  {dropped} rows of {unit} filtered out.")
                 
     except Exception as e:
         print(f"Error processing {file_path}: {e}")
 
-def main():
+def main(argv=None):
+    parser = build_arg_parser("Substack Data Ingestion")
+    args = parser.parse_args(argv)
+
     print(f"Target Data Path: {DATA_PATH}")
     
     if not os.path.exists(DATA_PATH):
         print(f"Error: Path {DATA_PATH} does not exist.")
         sys.exit(1)
 
-    # Substack folders are usually the subdirs of DATA_PATH
-    folders = [d for d in os.listdir(DATA_PATH) if os.path.isdir(os.path.join(DATA_PATH, d))]
+    # Substack folders are usually the subdirs of DATA_PATH, or the export .zip files themselves
+    folder_paths = export_folders(DATA_PATH)
     
-    if not folders:
+    if not folder_paths:
         print(f"No folders found in {DATA_PATH}")
         sys.exit(0)
 
-    print(f"Found folders: {', '.join(folders)}")
+    print(f"Found folders: {', '.join(folder_name(p) for p in folder_paths)}")
+
+    sink = open_sink(args)
+    conn = sink.conn
+    sink.ensure_schema(SCHEMA_NAME)
+    checkpoint = Checkpoint(conn, "substack", resume=args.resume)
+    metrics = RunMetrics("substack", profile_dir=args.profile)
+    source_filter = load_filters("substack")
 
-    # We'll maintain a set of tables we've already "Created" (dropped/created) to handle appending
-    created_tables = set()
+    cache = None
+    if args.cache:
+        from utils.ingestion_cache import ExportCache
+        csv_files = [
+            os.path.join(folder_dir, f)
+            for folder_path in folder_paths
+            for folder_dir in (folder_path, os.path.join(folder_path, "posts"))
+            for f in list_files(folder_dir) if f.lower().endswith('.csv')
+            and source_filter.wants_file(os.path.join(folder_dir, f), DATA_PATH)
+        ]
+        cache = ExportCache("substack", SCHEMA_NAME, csv_files, root=DATA_PATH)
+        if cache.manifest() is not None:
+            with metrics.track(conn):
+                cache.load(conn, metrics)
+            checkpoint.finish()
+            sink.close()
+            return
 
-    conn = get_db_connection()
-    ensure_schema(conn, SCHEMA_NAME)
+    # We'll maintain a set of tables we've already "Created" (dropped/created) to handle appending.
+    # A resumed run starts with the tables the interrupted run had already set up.
+    created_tables = {position['table'] for position in checkpoint.positions.values()}
 
-    for folder in folders:
-        folder_path = os.path.join(DATA_PATH, folder)
-        print(f"\nProcessing folder: {folder}")
+    with metrics.track(conn):
+        for folder_path in folder_paths:
+            folder = folder_name(folder_path)
+            print(f"\nProcessing folder: {folder}")
         
-        # 1. Main CSVs
-        mappings = {
-            "posts.csv": "posts",
-            "email_list": "emails" # Matches email_list.*.csv
-        }
+            # 1. Main CSVs
+            mappings = {
+                "posts.csv": "posts",
+                "email_list": "emails" # Matches email_list.*.csv
+            }
         
-        for f in os.listdir(folder_path):
-            file_path = os.path.join(folder_path, f)
-            if not f.lower().endswith('.csv'):
-                continue
+            for f in list_files(folder_path):
+                file_path = os.path.join(folder_path, f)
+                if not f.lower().endswith('.csv'):
+                    continue
             
-            target_table = None
-            if f == "posts.csv":
-                target_table = "posts"
-            elif f.startswith("email_list"):
-                target_table = "emails"
+                target_table = None
+                if f == "posts.csv":
+                    target_table = "posts"
+                elif f.startswith("email_list"):
+                    target_table = "emails"
             
-            if target_table:
-                append = target_table in created_tables
-                ingest_csv(conn, file_path, target_table, folder, append=append)
-                created_tables.add(target_table)
-
-        # 2. Nested Posts CSVs
-        posts_dir = os.path.join(folder_path, "posts")
-        if os.path.exists(posts_dir):
-            for f in os.listdir(posts_dir):
+                if target_table and source_filter.wants_file(file_path, DATA_PATH):
+                    append = args.append or target_table in created_tables
+                    ingest_csv(sink, file_path, target_table, folder, checkpoint, f"{folder}/{f}", metrics, append=append,
+                               server_copy=args.server_copy)
+                    created_tables.add(target_table)
+
+            # 2. Nested Posts CSVs
+            posts_dir = os.path.join(folder_path, "posts")
+            for f in list_files(posts_dir):
                 if not f.lower().endswith('.csv'):
                     continue
-                
+            
                 file_path = os.path.join(posts_dir, f)
                 target_table = None
                 if ".delivers.csv" in f:
                     target_table = "post_delivers"
                 elif ".opens.csv" in f:
                     target_table = "post_opens"
-                
-                if target_table:
-                    append = target_table in created_tables
-                    ingest_csv(conn, file_path, target_table, folder, append=append)
+            
+                if target_table and source_filter.wants_file(file_path, DATA_PATH):
+                    append = args.append or target_table in created_tables
+                    ingest_csv(sink, file_path, target_table, folder, checkpoint, f"{folder}/posts/{f}", metrics,
+                               append=append, event_type=EVENT_TABLES[target_table], server_copy=args.server_copy)
                     created_tables.add(target_table)
 
-    conn.close()
+    checkpoint.finish()
+    if cache is not None:
+        cache.save(conn)
+    sink.close()
     print("\nIngestion complete.")
 
 if __name__ == "__main__":
@@ -1,44 +1,92 @@
 import os
 import sys
 import json
-import psycopg2
-from psycopg2 import sql
-from psycopg2.extras import execute_values, Json
+from psycopg2.extras import Json
 from tqdm import tqdm
 from datetime import datetime
 
-# Import common utilities
-sys.path.append(os.path.join(os.path.dirname(__file__), '../../../../utils'))
-from ingestion_utils import load_env, get_db_connection, ensure_schema
+if __name__ == "__main__":
+    # Run as a script: make utils importable and load docker/.env before the settings below are read.
+    # The jimwurst CLI (utils/cli.py) does both itself before importing this module.
+    sys.path.append(os.path.join(os.path.dirname(__file__), '../../../..'))
+    from utils.ingestion_utils import load_env
+    load_env()
 
-# Load env vars
-load_env()
+from utils.ingestion_utils import build_arg_parser, Checkpoint
+from utils.ingestion_sinks import Table, open_sink
+from utils.ingestion_metrics import RunMetrics, historical_throughput
+from utils.export_files import walk_files, open_file, file_size
+from utils.ingestion_filters import load_filters, project
 
 DEFAULT_DATA_PATH = os.path.expanduser("~/Documents/jimwurst_local_data/telegram")
 DATA_PATH = os.getenv("TELEGRAM_DATA_PATH", DEFAULT_DATA_PATH)
 
 SCHEMA_NAME = "s_telegram"
 
-def recreate_table(conn, table_name, schema_sql):
-    with conn.cursor() as cur:
-        cur.execute(sql.SQL("DROP TABLE IF EXISTS {}.{} CASCADE").format(
-            sql.Identifier(SCHEMA_NAME), sql.Identifier(table_name)
-        ))
-        cur.execute(sql.SQL("CREATE TABLE {}.{} {}").format(
-            sql.Identifier(SCHEMA_NAME), sql.Identifier(table_name), sql.SQL(schema_sql)
-        ))
-    conn.commit()
-    print(f"Table {SCHEMA_NAME}.{table_name} recreated.")
-
-def ingest_telegram_data(conn, file_path):
+# Chats are committed together with their messages once this many messages are pending
+COMMIT_EVERY_MESSAGES = 5000
+
+# ~7 MB/s (154MB in 20s); used for the time estimate until a run has been recorded in meta.ingestion_runs
+DEFAULT_BYTES_PER_SECOND = 7.0 * 1024 * 1024
+
+CONTACTS = Table(SCHEMA_NAME, "contacts", [
+    ("first_name", "TEXT"),
+    ("last_name", "TEXT"),
+    ("phone_number", "TEXT"),
+    ("date_unixtime", "TEXT"),
+])
+
+CHATS = Table(SCHEMA_NAME, "chats", [
+    ("id", "BIGINT"),
+    ("name", "TEXT"),
+    ("type", "TEXT"),
+    ("raw_data", "JSONB"),
+], primary_key="id")
+
+MESSAGES = Table(SCHEMA_NAME, "messages", [
+    ("id", "BIGINT"),
+    ("chat_id", "BIGINT"),
+    ("date", "TEXT"),
+    ("date_unixtime", "TEXT"),
+    ("sender", "TEXT"),
+    ("sender_id", "TEXT"),
+    ("text", "TEXT"),
+    ("type", "TEXT"),
+    ("reply_to_message_id", "BIGINT"),
+    ("raw_data", "JSONB"),
+])
+
+# The key of the contact, chat and message objects behind each column, for the record filters
+# (see utils/ingestion_filters.py). A chat that is filtered out takes its messages with it.
+CONTACT_FIELDS = {"first_name": "first_name", "last_name": "last_name", "phone_number": "phone_number",
+                  "date_unixtime": "date_unixtime"}
+CHAT_FIELDS = {"id": "id", "name": "name", "type": "type"}
+MESSAGE_FIELDS = {"id": "id", "date": "date", "date_unixtime": "date_unixtime", "sender": "from", "sender_id": "from_id",
+                  "text": "text", "type": "type", "reply_to_message_id": "reply_to_message_id"}
+
+def recreate_table(sink, table):
+    sink.create_table(table)
+    print(f"Table {table} recreated.")
+
+def ingest_telegram_data(sink, file_path, checkpoint, metrics):
     print(f"Reading JSON from {file_path}...")
+    metrics.add_file(file_path)
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
+        with metrics.stage("parse"), open_file(file_path, 'r', encoding='utf-8') as f:
             data = json.load(f)
     except Exception as e:
         print(f"Failed to read file: {e}")
         return
 
+    # Only the records and columns the filters keep are converted and written
+    source_filter = load_filters("telegram")
+    contacts_table, contact_columns = source_filter.filtered_table(CONTACTS)
+    chats_table, chat_columns = source_filter.filtered_table(CHATS)
+    messages_table, message_columns = source_filter.filtered_table(MESSAGES)
+    keep_contact = source_filter.record_filter(CONTACTS.name, CONTACT_FIELDS)
+    keep_chat = source_filter.record_filter(CHATS.name, CHAT_FIELDS)
+    keep_message = source_filter.record_filter(MESSAGES.name, MESSAGE_FIELDS)
+
     # 1. Personal Information
     # Usually in data['personal_information'] or top level fields
     # We'll just create a simple KV table or strict table if we know fields.
@@ -50,120 +98,113 @@ def ingest_telegram_data(conn, file_path):
         # newer exports might just have 'contacts': [...]
         contacts = data.get('contacts')
     
-    if contacts:
-        recreate_table(conn, "contacts", "(first_name TEXT, last_name TEXT, phone_number TEXT, date_unixtime TEXT)")
-        
-        insert_query = sql.SQL("INSERT INTO {}.contacts (first_name, last_name, phone_number, date_unixtime) VALUES %s").format(
-            sql.Identifier(SCHEMA_NAME)
-        )
+    if contacts and checkpoint.is_done("contacts"):
+        print("Skipping contacts: already loaded.")
+    elif contacts:
+        recreate_table(sink, contacts_table)
         
         rows = []
         for c in contacts:
-            rows.append((
+            if keep_contact is not None and not keep_contact(c):
+                continue
+            rows.append(project((
                 c.get('first_name'),
                 c.get('last_name'),
                 c.get('phone_number'),
                 c.get('date_unixtime') # Keep as text/unixtime for raw layer, cast downstream
-            ))
+            ), contact_columns))
             
-        if rows:
-            with conn.cursor() as cur:
-                execute_values(cur, insert_query, rows)
-            conn.commit()
-            print(f"Inserted {len(rows)} contacts.")
+        with metrics.stage("write"):
+            sink.write([(contacts_table, rows)], checkpoint, "contacts", done=True)
+        metrics.add_commit(len(rows))
+        print(f"Inserted {len(rows)} contacts.")
 
     # 3. Chats and Messages
     # typical structure: data['chats']['list'] -> list of chat objects
     chats_list = data.get('chats', {}).get('list', [])
     
-    if chats_list:
-        # Create chats table
-        recreate_table(conn, "chats", """(
-            id BIGINT PRIMARY KEY,
-            name TEXT,
-            type TEXT,
-            raw_data JSONB
-        )""")
-        
-        # Create messages table
-        recreate_table(conn, "messages", """(
-            id BIGINT, 
-            chat_id BIGINT,
-            date TEXT,
-            date_unixtime TEXT,
-            sender TEXT,
-            sender_id TEXT,
-            text TEXT,
-            type TEXT,
-            reply_to_message_id BIGINT,
-            raw_data JSONB
-        )""")
-
-        chat_query = sql.SQL("INSERT INTO {}.chats (id, name, type, raw_data) VALUES %s").format(sql.Identifier(SCHEMA_NAME))
-        msg_query = sql.SQL("INSERT INTO {}.messages (id, chat_id, date, date_unixtime, sender, sender_id, text, type, reply_to_message_id, raw_data) VALUES %s").format(sql.Identifier(SCHEMA_NAME))
-        
+    # The chat index is the resume point: chats before it are committed with all their messages
+    start_chat = (checkpoint.get("chats") or {}).get('chat', 0)
+
+    if chats_list and checkpoint.is_done("chats"):
+        print("Skipping chats: already loaded.")
+    elif chats_list:
+        if checkpoint.get("chats") is None:
+            recreate_table(sink, chats_table)
+            recreate_table(sink, messages_table)
+        else:
+            print(f"Resuming after chat {start_chat} of {len(chats_list)}.")
+
         chat_rows = []
+        msg_batch = []
+        total_chats = 0
         total_messages = 0
+
+        def flush(next_chat):
+            # Chats and their messages go in one transaction with the checkpoint
+            nonlocal chat_rows, msg_batch, total_chats, total_messages
+            with metrics.stage("write"):
+                # remove messages from the raw_data in chat_rows to avoid duplication? 
+                # For now let's keep it simple, though distinct is better.
+                sink.write([(chats_table, chat_rows), (messages_table, msg_batch)], checkpoint, "chats", chat=next_chat)
+            metrics.add_commit(len(chat_rows) + len(msg_batch))
+            total_chats += len(chat_rows)
+            total_messages += len(msg_batch)
+            chat_rows = []
+            msg_batch = []
         
         print(f"Processing {len(chats_list)} chats...")
         
-        with conn.cursor() as cur:
-            for chat in tqdm(chats_list, unit="chat"):
+        with metrics.stage("transform"):
+            for index in tqdm(range(start_chat, len(chats_list)), unit="chat", initial=start_chat, total=len(chats_list)):
+                chat = chats_list[index]
                 chat_id = chat.get('id')
                 # Some exports allow duplicate Chat IDs (? maybe not, but safety first)
-                if not chat_id:
+                if not chat_id or (keep_chat is not None and not keep_chat(chat)):
                     continue
-                    
-                chat_rows.append((
+                
+                chat_rows.append(project((
                     chat_id,
                     chat.get('name'),
                     chat.get('type'),
                     Json(chat) # Dump full chat object (minus messages usually? No, messages are inside. We might want to pop messages to save space in chats table)
-                ))
-                
+                ), chat_columns))
+            
                 # Check messages
                 messages = chat.get('messages', [])
-                if messages:
-                    msg_batch = []
-                    for m in messages:
-                        # 'text' field can be a list of entities (strings + dicts) in Telegram JSON
-                        # We should stringify it for the text column
-                        text_content = m.get('text', '')
-                        if isinstance(text_content, list):
-                            # Join parts: strings are kept, dicts (links/entries) usually have a 'text' property or just represent formatting
-                            # Simple approach: json dumps or just extract string parts.
-                            # Let's just dumps for now to preserve info, or join strings. 
-                            # If we join strings:
-                            text_content = "".join([x if isinstance(x, str) else x.get('text', '') for x in text_content])
-                        
-                        msg_batch.append((
-                            m.get('id'),
-                            chat_id,
-                            m.get('date'),
-                            m.get('date_unixtime'),
-                            m.get('from'),
-                            m.get('from_id'),
-                            text_content,
-                            m.get('type'),
-                            m.get('reply_to_message_id'),
-                            Json(m)
-                        ))
-                    
-                    if msg_batch:
-                        execute_values(cur, msg_query, msg_batch)
-                        total_messages += len(msg_batch)
-
-            # Insert chats
-            if chat_rows:
-                # remove messages from the raw_data in chat_rows to avoid duplication? 
-                # For now let's keep it simple, though distinct is better.
-                # Actually, pop messages before appending to chat_rows would be better but I already appended.
-                # Let's just insert.
-                 execute_values(cur, chat_query, chat_rows)
-            
-            conn.commit()
+                for m in messages:
+                    if keep_message is not None and not keep_message(m):
+                        continue
+                    # 'text' field can be a list of entities (strings + dicts) in Telegram JSON
+                    # We should stringify it for the text column
+                    text_content = m.get('text', '')
+                    if isinstance(text_content, list):
+                        # Join parts: strings are kept, dicts (links/entries) usually have a 'text' property or just represent formatting
+                        # Simple approach: json dumps or just extract string parts.
+                        # Let's just dumps for now to preserve info, or join strings. 
+                        # If we join strings:
+                        text_content = "".join([x if isinstance(x, str) else x.get('text', '') for x in text_content])
+                
+                    msg_batch.append(project((
+                        m.get('id'),
+                        chat_id,
+                        m.get('date'),
+                        m.get('date_unixtime'),
+                        m.get('from'),
+                        m.get('from_id'),
+                        text_content,
+                        m.get('type'),
+                        m.get('reply_to_message_id'),
+                        Json(m)
+                    ), message_columns))
+
+                if len(msg_batch) >= COMMIT_EVERY_MESSAGES:
+                    flush(index + 1)
+
+            flush(len(chats_list))
+        checkpoint.mark_done("chats", chat=len(chats_list))
             
-        print(f"Inserted {len(chat_rows)} chats and {total_messages} messages.")
+        print(f"Inserted {total_chats} chats and {total_messages} messages.")
 
 def find_result_json(search_path):
     """
@@ -178,14 +219,20 @@ def find_result_json(search_path):
     if os.path.exists(potential):
         return potential
 
-    # 3. Recursive search
-    for root, dirs, files in os.walk(search_path):
-        if "result.json" in files:
-            return os.path.join(root, "result.json")
+    # 3. Recursive search, also inside .zip exports
+    for path in walk_files(search_path):
+        if os.path.basename(path) == "result.json":
+            return path
     
     return None
 
-def main():
+def main(argv=None):
+    parser = build_arg_parser("Telegram Data Ingestion")
+    args = parser.parse_args(argv)
+    if args.append:
+        # Messages have no key to upsert on, and an export holds the full history, so appending would load it twice
+        parser.error("--append is not supported: Telegram rebuilds its tables from the full export")
+
     print(f"Starting Telegram Ingestion from: {DATA_PATH}")
     
     if not os.path.exists(DATA_PATH):
@@ -202,20 +249,38 @@ def main():
     print(f"Found data file: {file_path}")
     
     # Estimate time
-    file_size_bytes = os.path.getsize(file_path)
+    file_size_bytes = file_size(file_path)
     file_size_mb = file_size_bytes / (1024 * 1024)
-    # Heuristic: ~7 MB/s based on previous run (154MB in 20s)
-    estimated_seconds = file_size_mb / 7.0 
+    sink = open_sink(args)
+    conn = sink.conn
+    bytes_per_second = historical_throughput(conn, "telegram", "bytes")
+    estimated_seconds = file_size_bytes / (bytes_per_second or DEFAULT_BYTES_PER_SECOND)
     
     print(f"File size: {file_size_mb:.2f} MB")
     print(f"Estimated processing time: ~{estimated_seconds:.0f} seconds (depending on machine speed)")
         
-    conn = get_db_connection()
-    ensure_schema(conn, SCHEMA_NAME)
+    sink.ensure_schema(SCHEMA_NAME)
+    checkpoint = Checkpoint(conn, "telegram", resume=args.resume)
+    metrics = RunMetrics("telegram", profile_dir=args.profile)
+
+    cache = None
+    if args.cache:
+        from utils.ingestion_cache import ExportCache
+        cache = ExportCache("telegram", SCHEMA_NAME, [file_path])
+        if cache.manifest() is not None:
+            with metrics.track(conn):
+                cache.load(conn, metrics)
+            checkpoint.finish()
+            sink.close()
+            return
     
-    ingest_telegram_data(conn, file_path)
+    with metrics.track(conn):
+        ingest_telegram_data(sink, file_path, checkpoint, metrics)
                 
-    conn.close()
+    checkpoint.finish()
+    if cache is not None:
+        cache.save(conn)
+    sink.close()
     print("Done.")
 
 if __name__ == "__main__":
@@ -0,0 +1,59 @@
+{#
+    The Apple Health records aggregated per record type, unit and period (hour or day of
+    started_at in Europe/Berlin, like the other daily marts), for the incremental rollup marts:
+
+        {{ apple_health_rollup('day', 'date') }}
+
+    An incremental build recomputes the periods that hold a record created since the latest
+    created_at already rolled up (minus apple_health_lookback_days), from all of their records,
+    and replaces them on (record_type, unit, period); the other periods are left alone. A
+    record without a created_at counts as created when it started, so it is rolled up too.
+#}
+
+{% macro apple_health_rollup(grain, period_column) %}
+{%- set period -%}
+    date_trunc('{{ grain }}', started_at AT TIME ZONE 'UTC' AT TIME ZONE 'Europe/Berlin'){{ '::date' if grain == 'day' }}
+{%- endset -%}
+
+WITH records AS (
+    SELECT *, {{ period }} AS period, coalesce(created_at, started_at) AS watermark_at
+    FROM {{ ref('stg_apple_health__records') }}
+),
+
+{% if is_incremental() %}
+changed_periods AS (
+    SELECT DISTINCT record_type, period
+    FROM records
+    WHERE watermark_at >= (
+        SELECT coalesce(max(last_created_at) - interval '{{ var("apple_health_lookback_days") }} days', '-infinity')
+        FROM {{ this }}
+    )
+),
+
+{% endif %}
+rolled_up AS (
+    SELECT
+        r.record_type,
+        r.unit,
+        r.period AS {{ period_column }},
+        count(*) AS record_count,
+        count(r.value) AS value_count,
+        sum(r.value) AS value_sum,
+        min(r.value) AS value_min,
+        max(r.value) AS value_max,
+        avg(r.value) AS value_avg,
+        percentile_cont(0.1) WITHIN GROUP (ORDER BY r.value) AS value_p10,
+        percentile_cont(0.5) WITHIN GROUP (ORDER BY r.value) AS value_p50,
+        percentile_cont(0.9) WITHIN GROUP (ORDER BY r.value) AS value_p90,
+        sum(extract(epoch FROM r.ended_at - r.started_at)) AS duration_seconds,
+        max(r.watermark_at) AS last_created_at
+    FROM records r
+    {% if is_incremental() %}
+    JOIN changed_periods c ON c.record_type = r.record_type AND c.period = r.period
+    {% endif %}
+    WHERE r.started_at IS NOT NULL
+    GROUP BY 1, 2, 3
+)
+
+SELECT * FROM rolled_up
+{%- endmacro %}
@@ -0,0 +1,17 @@
+{#
+    True if the day is a public holiday in a country ('DE') or subdivision ('DE-BE'), for a
+    model joined to dim_calendar; column is its holiday_regions. The holidays of a subdivision
+    are stored without its country's, so a subdivision matches either, and a country matches
+    the holidays of any of its subdivisions too:
+
+        {{ is_public_holiday('DE-BE', 'c.holiday_regions') }} as is_public_holiday_berlin
+#}
+
+{% macro is_public_holiday(region, column='holiday_regions') %}
+    {%- set region = region | upper -%}
+    {%- if '-' in region -%}
+        ({{ column }} && array['{{ region }}', '{{ region.split('-')[0] }}']::text[])
+    {%- else -%}
+        exists (select 1 from unnest({{ column }}) as r where r = '{{ region }}' or r like '{{ region }}-%')
+    {%- endif -%}
+{%- endmacro %}
@@ -0,0 +1,48 @@
+{#
+    Post-hook of the marts (dbt_project.yml): orders the table physically by its cluster_by
+    columns and refreshes the planner statistics.
+
+    A model lists its indexes in the indexes config of dbt-postgres, and a time-series mart
+    names the columns to order its rows by in cluster_by, one of those indexes:
+
+        {{ config(indexes=[{'columns': ['event_at']}], cluster_by=['event_at']) }}
+
+    CLUSTER rewrites the table, so it runs when the table was just built in full: every build
+    of a table model, and the first or --full-refresh build of an incremental one (or with the
+    var cluster_marts, when the appended rows have spread out). ANALYZE runs after every build.
+    is_incremental() tells them apart: the relation cache learns of a new table only after its
+    hooks have run, so it is still false in the post-hook of a first build.
+#}
+
+{% macro optimize_mart() %}
+    {%- set cluster_by = config.get('cluster_by') -%}
+    {%- if cluster_by and execute
+          and (not is_incremental() or var('cluster_marts', false)) -%}
+        cluster {{ this }} using {{ adapter.quote(index_on(this, cluster_by)) }};
+    {%- endif %}
+    analyze {{ this }}
+{% endmacro %}
+
+
+{% macro index_on(relation, columns) %}
+    {%- set columns = [columns] if columns is string else columns -%}
+    {%- set query -%}
+        select i.relname
+        from pg_index x
+        join pg_class i on i.oid = x.indexrelid
+        where x.indrelid = '{{ relation }}'::regclass
+          and array(
+              select a.attname::text
+              from unnest(x.indkey) with ordinality k(attnum, n)
+              join pg_attribute a on a.attrelid = x.indrelid and a.attnum = k.attnum
+              order by k.n
+          ) = array[{% for column in columns %}'{{ column }}'{{ ", " if not loop.last }}{% endfor %}]::text[]
+        order by x.indisunique desc
+        limit 1
+    {%- endset -%}
+    {%- set result = run_query(query) -%}
+    {%- if result.rows | length == 0 -%}
+        {{ exceptions.raise_compiler_error(relation ~ ": cluster_by " ~ columns | join(", ") ~ " needs an index on these columns") }}
+    {%- endif -%}
+    {{ return(result.rows[0][0]) }}
+{% endmacro %}
@@ -0,0 +1,9 @@
+{{ config(
+    materialized='incremental',
+    unique_key=['record_type', 'unit', 'date'],
+    tags=['marts', 'apple_health'],
+    indexes=[{'columns': ['record_type', 'date']}],
+    cluster_by=['record_type', 'date']
+) }}
+
+{{ apple_health_rollup('day', 'date') }}
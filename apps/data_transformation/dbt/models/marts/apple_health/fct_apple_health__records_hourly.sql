@@ -0,0 +1,9 @@
+{{ config(
+    materialized='incremental',
+    unique_key=['record_type', 'unit', 'hour_start'],
+    tags=['marts', 'apple_health'],
+    indexes=[{'columns': ['record_type', 'hour_start']}],
+    cluster_by=['record_type', 'hour_start']
+) }}
+
+{{ apple_health_rollup('hour', 'hour_start') }}
@@ -0,0 +1,43 @@
+{{ config(
+    tags=['marts', 'calendar'],
+    indexes=[{'columns': ['date'], 'unique': True}],
+    cluster_by=['date']
+) }}
+
+-- One row per day of the years dim_public_holidays covers. holiday_regions holds the countries
+-- (DE) and subdivisions (DE-BE) the day is a public holiday in, a subdivision only on the
+-- holidays its country does not have; test it with is_public_holiday().
+
+with bounds as (
+    select
+        date_trunc('year', min(date))::date as first_date,
+        (date_trunc('year', max(date)) + interval '1 year - 1 day')::date as last_date
+    from {{ ref('dim_public_holidays') }}
+),
+
+spine as (
+    select day::date as date
+    from bounds, generate_series(bounds.first_date, bounds.last_date, interval '1 day') as day
+),
+
+holiday_regions as (
+    select
+        date,
+        array_agg(distinct region order by region) as holiday_regions
+    from (
+        select date, country_code || coalesce('-' || subdivision_code, '') as region
+        from {{ ref('dim_public_holidays') }}
+    ) regions
+    group by 1
+)
+
+select
+    s.date,
+    extract(dow from s.date)::int as day_of_week,
+    extract(day from s.date)::int as day_of_month,
+    extract(month from s.date)::int as month,
+    extract(year from s.date)::int as year,
+    (extract(dow from s.date) in (0, 6)) as is_weekend,
+    coalesce(h.holiday_regions, '{}') as holiday_regions
+from spine s
+left join holiday_regions h on s.date = h.date
@@ -1,6 +1,6 @@
 select
-    date::date as date,
+    date,
     country_code,
-    subdivision_code,
+    nullif(subdivision_code, '') as subdivision_code,
     holiday_name
-from {{ ref('public_holidays') }}
+from {{ source('public_holidays', 'dim_public_holidays_raw') }}
@@ -1,6 +1,8 @@
 {{ config(
     enabled=var('enable_linkedin_models', false),
-    tags=['marts', 'linkedin', 'posts']
+    tags=['marts', 'linkedin', 'posts'],
+    indexes=[{'columns': ['posted_date']}],
+    cluster_by=['posted_date']
 ) }}
 
 with source as (
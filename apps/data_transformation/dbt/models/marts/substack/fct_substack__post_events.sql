@@ -1,3 +1,29 @@
+{{
+    config(
+        materialized='incremental',
+        unique_key='event_key',
+        on_schema_change='append_new_columns',
+        indexes=[
+            {'columns': ['event_key'], 'unique': True},
+            {'columns': ['post_id']},
+            {'columns': ['event_at']},
+            {'columns': ['email']},
+        ],
+        cluster_by=['event_at']
+    )
+}}
+
+-- Incremental: a run only reads the events from the watermark on, the latest event_at already
+-- loaded minus substack_events_lookback_days (events of the days just before it can still
+-- arrive with a later export), and upserts them on event_key. A --full-refresh rebuilds it all,
+-- picking up post titles that changed since and events removed from the raw tables.
+{% if is_incremental() %}
+{% set watermark %}
+    (SELECT coalesce(max(event_at) - interval '{{ var("substack_events_lookback_days") }} days', '-infinity')
+     FROM {{ this }})
+{% endset %}
+{% endif %}
+
 WITH delivers AS (
     SELECT
         post_id,
@@ -16,6 +42,9 @@ WITH delivers AS (
         NULL AS user_agent,
         _source_folder
     FROM {{ ref('stg_substack__post_delivers') }}
+    {% if is_incremental() %}
+    WHERE delivered_at >= {{ watermark }} OR delivered_at IS NULL
+    {% endif %}
 ),
 
 opens AS (
@@ -36,25 +65,19 @@ opens AS (
         user_agent,
         _source_folder
     FROM {{ ref('stg_substack__post_opens') }}
+    {% if is_incremental() %}
+    WHERE opened_at >= {{ watermark }} OR opened_at IS NULL
+    {% endif %}
 ),
 
+-- Overlapping export folders are deduplicated at ingestion time: the raw event tables
+-- hold one row per (post_id, email, event_at, event_type), from the newest folder.
 unified AS (
     SELECT * FROM delivers
     UNION ALL
     SELECT * FROM opens
 ),
 
-deduplicated AS (
-    -- Deduplicate overlapping events across different export folders
-    SELECT 
-        *,
-        ROW_NUMBER() OVER (
-            PARTITION BY post_id, email, event_at, event_type 
-            ORDER BY _source_folder DESC -- Heuristic: take newest export folder
-        ) as row_num
-    FROM unified
-),
-
 final AS (
     SELECT
         md5(
@@ -81,9 +104,8 @@ final AS (
         p.title AS post_title,
         p.subtitle AS post_subtitle,
         p.post_at AS post_published_at
-    FROM deduplicated d
+    FROM unified d
     LEFT JOIN {{ ref('dim_substack__posts') }} p ON d.post_id = p.post_id
-    WHERE d.row_num = 1
 )
 
 SELECT * FROM final
@@ -1,5 +1,7 @@
 {{ config(
-    tags=['marts', 'growth', 'content']
+    tags=['marts', 'growth', 'content'],
+    indexes=[{'columns': ['date_berlin'], 'unique': True}],
+    cluster_by=['date_berlin']
 ) }}
 
 with linkedin_daily as (
@@ -28,28 +30,31 @@ final as (
     full outer join substack_daily s on l.activity_date = s.activity_date
 ),
 
-daily_holidays as (
-    select
-        date,
-        max(case when country_code = 'US' then 1 else 0 end) = 1 as is_public_holiday_us,
-        max(case when country_code = 'DE' then 1 else 0 end) = 1 as is_public_holiday_de,
-        max(case when country_code = 'FR' then 1 else 0 end) = 1 as is_public_holiday_fr
-    from {{ ref('dim_public_holidays') }}
-    group by 1
+bounds as (
+    select min(date_berlin) as first_date, max(date_berlin) as last_date
+    from final
+),
+
+spine as (
+    select day::date as date_berlin
+    from bounds, generate_series(bounds.first_date, bounds.last_date, interval '1 day') as day
 )
 
+-- Every day from the first to the last post, with or without posts. The spine comes from the
+-- posts, not dim_calendar, so days outside the years it covers are kept, as no holiday.
 select
-    f.date_berlin,
-    extract(dow from f.date_berlin) as day_of_week,
-    extract(day from f.date_berlin) as day_of_month,
-    extract(month from f.date_berlin) as month,
-    extract(year from f.date_berlin) as year,
-    (extract(dow from f.date_berlin) in (0, 6)) as is_weekend,
-    coalesce(h.is_public_holiday_us, false) as is_public_holiday_us,
-    coalesce(h.is_public_holiday_de, false) as is_public_holiday_de,
-    coalesce(h.is_public_holiday_fr, false) as is_public_holiday_fr,
-    f.linkedin_posts_published,
-    f.substack_posts_published
-from final f
-left join daily_holidays h on f.date_berlin = h.date
-order by f.date_berlin desc
+    s.date_berlin,
+    extract(dow from s.date_berlin)::int as day_of_week,
+    extract(day from s.date_berlin)::int as day_of_month,
+    extract(month from s.date_berlin)::int as month,
+    extract(year from s.date_berlin)::int as year,
+    (extract(dow from s.date_berlin) in (0, 6)) as is_weekend,
+    {{ is_public_holiday('US', "coalesce(c.holiday_regions, '{}')") }} as is_public_holiday_us,
+    {{ is_public_holiday('DE', "coalesce(c.holiday_regions, '{}')") }} as is_public_holiday_de,
+    {{ is_public_holiday('FR', "coalesce(c.holiday_regions, '{}')") }} as is_public_holiday_fr,
+    coalesce(f.linkedin_posts_published, 0) as linkedin_posts_published,
+    coalesce(f.substack_posts_published, 0) as substack_posts_published
+from spine s
+left join {{ ref('dim_calendar') }} c on c.date = s.date_berlin
+left join final f on s.date_berlin = f.date_berlin
+order by s.date_berlin desc
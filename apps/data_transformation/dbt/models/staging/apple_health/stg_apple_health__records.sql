@@ -0,0 +1,19 @@
+WITH source AS (
+    SELECT * FROM {{ source('apple_health', 'records') }}
+),
+
+renamed AS (
+    SELECT
+        type AS record_type,
+        coalesce(unit, '') AS unit,
+        source_name,
+        creation_date AS created_at,
+        start_date AS started_at,
+        end_date AS ended_at,
+        -- Quantity types hold numbers, category types (e.g. sleep analysis) a category name
+        CASE WHEN value ~ '^[-+]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][-+]?[0-9]+)?$' THEN value::double precision END AS value,
+        value AS value_text
+    FROM source
+)
+
+SELECT * FROM renamed
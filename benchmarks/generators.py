@@ -0,0 +1,285 @@
+"""
+Deterministic synthetic export generators for the ingestion benchmarks.
+
+Each generator writes a folder laid out like the real export of that app, with
+`rows` controlling the size of its biggest table. The same (rows, seed) pair always
+produces byte-identical files, so results from different runs stay comparable.
+"""
+
+import os
+import csv
+import json
+import random
+from datetime import datetime, timedelta, timezone
+
+BASE_DATE = datetime(2019, 1, 1, tzinfo=timezone.utc)
+
+HEALTH_TYPES = [
+    ("HKQuantityTypeIdentifierHeartRate", "count/min", 50, 180),
+    ("HKQuantityTypeIdentifierStepCount", "count", 1, 2000),
+    ("HKQuantityTypeIdentifierActiveEnergyBurned", "kcal", 1, 50),
+    ("HKQuantityTypeIdentifierDistanceWalkingRunning", "km", 0, 2),
+    ("HKQuantityTypeIdentifierBodyMass", "kg", 60, 90),
+    ("HKCategoryTypeIdentifierSleepAnalysis", "", 0, 0),
+]
+
+WORDS = [
+    "data", "warehouse", "wurst", "berlin", "coffee", "run", "release", "model", "pipeline",
+    "dbt", "postgres", "insight", "weekend", "holiday", "export", "metric", "sausage", "ship",
+]
+
+
+def _timestamp(rng, span_days=365 * 5):
+    return BASE_DATE + timedelta(seconds=rng.randrange(span_days * 86400))
+
+
+def _sentence(rng, words=8):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, words)))
+
+
+def generate_apple_health(path, rows, seed=42):
+    """Writes apple_health/export.xml with `rows` Record elements, some nested in Correlations."""
+    rng = random.Random(seed)
+    os.makedirs(path, exist_ok=True)
+    xml_path = os.path.join(path, "export.xml")
+    fmt = '%Y-%m-%d %H:%M:%S +0000'
+
+    def record(indent=" "):
+        type_, unit, low, high = rng.choice(HEALTH_TYPES)
+        start = _timestamp(rng)
+        end = start + timedelta(seconds=rng.randint(1, 600))
+        value = "HKCategoryValueSleepAnalysisAsleepCore" if not unit else f"{rng.uniform(low, high):.2f}"
+        return (
+            f'{indent}<Record type="{type_}" sourceName="Apple Watch" sourceVersion="10.1" '
+            f'device="&lt;&lt;HKDevice: 0x1&gt;, name:Apple Watch&gt;" unit="{unit}" '
+            f'creationDate="{end.strftime(fmt)}" startDate="{start.strftime(fmt)}" '
+            f'endDate="{end.strftime(fmt)}" value="{value}"/>\n'
+        )
+
+    with open(xml_path, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write('<!DOCTYPE HealthData [\n<!ELEMENT HealthData (ExportDate,Me,(Record|Correlation|Workout)*)>\n]>\n')
+        f.write('<HealthData locale="en_DE">\n')
+        f.write(' <ExportDate value="2025-01-01 00:00:00 +0000"/>\n')
+        f.write(' <Me HKCharacteristicTypeIdentifierDateOfBirth="1990-01-01"/>\n')
+        written = 0
+        while written < rows:
+            if rng.random() < 0.01 and rows - written >= 2:
+                # Blood pressure style correlation wrapping two records
+                f.write(' <Correlation type="HKCorrelationTypeIdentifierBloodPressure" sourceName="Omron">\n')
+                f.write(record("  "))
+                f.write(record("  "))
+                f.write(' </Correlation>\n')
+                written += 2
+                continue
+            if rng.random() < 0.005:
+                start = _timestamp(rng)
+                f.write(f' <Workout workoutActivityType="HKWorkoutActivityTypeRunning" duration="30" '
+                        f'startDate="{start.strftime(fmt)}" endDate="{(start + timedelta(minutes=30)).strftime(fmt)}"/>\n')
+            f.write(record())
+            written += 1
+        f.write('</HealthData>\n')
+    return xml_path
+
+
+def generate_telegram(path, rows, seed=42, messages_per_chat=500):
+    """Writes telegram/result.json with `rows` messages spread over chats."""
+    rng = random.Random(seed)
+    os.makedirs(path, exist_ok=True)
+    chat_count = max(1, rows // messages_per_chat)
+    chats = []
+    message_id = 0
+    for c in range(chat_count):
+        count = rows // chat_count + (1 if c < rows % chat_count else 0)
+        messages = []
+        for _ in range(count):
+            message_id += 1
+            sent = _timestamp(rng)
+            text = _sentence(rng, 20)
+            if rng.random() < 0.2:
+                text = [text, {"type": "link", "text": "https://example.com"}, " ok"]
+            messages.append({
+                "id": message_id,
+                "type": "message",
+                "date": sent.strftime('%Y-%m-%dT%H:%M:%S'),
+                "date_unixtime": str(int(sent.timestamp())),
+                "from": rng.choice(["Jim", "Wurst", "Anna"]),
+                "from_id": f"user{rng.randint(1, 50)}",
+                "reply_to_message_id": message_id - 1 if rng.random() < 0.1 and message_id > 1 else None,
+                "text": text,
+            })
+        chats.append({"id": 1000 + c, "name": f"Chat {c}", "type": "personal_chat", "messages": messages})
+
+    data = {
+        "about": "Synthetic Telegram export for benchmarks",
+        "contacts": {"list": [
+            {"first_name": f"First{i}", "last_name": f"Last{i}", "phone_number": f"+49{i:09d}",
+             "date_unixtime": str(1600000000 + i)}
+            for i in range(max(1, rows // 100))
+        ]},
+        "chats": {"list": chats},
+    }
+    json_path = os.path.join(path, "result.json")
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+    return json_path
+
+
+def generate_substack(path, rows, seed=42, folders=2, posts=20):
+    """
+    Writes substack/<export folder>/... with `rows` delivery events per folder.
+    Consecutive folders overlap by half, like repeated exports of the same newsletter.
+    """
+    rng = random.Random(seed)
+    subscribers = [f"reader{i}@example.com" for i in range(max(1, rows // posts))]
+    per_post = max(1, rows // posts)
+    for folder_index in range(folders):
+        folder = os.path.join(path, f"export_{2024 + folder_index}_01_01")
+        os.makedirs(os.path.join(folder, "posts"), exist_ok=True)
+        first_post = folder_index * posts // 2
+
+        with open(os.path.join(folder, "posts.csv"), "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["post_id", "post_date", "is_published", "email_sent_at", "inbox_sent_at",
+                             "type", "audience", "title", "subtitle", "podcast_url"])
+            for p in range(first_post, first_post + posts):
+                sent = (BASE_DATE + timedelta(days=7 * p)).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+                writer.writerow([f"{100000 + p}.post-{p}", sent, "true", sent, sent, "newsletter",
+                                 "everyone", _sentence(rng).title(), _sentence(rng, 12), ""])
+
+        with open(os.path.join(folder, f"email_list.export_{folder_index}.csv"), "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["email", "active_subscription", "expiry", "plan", "email_disabled",
+                             "created_at", "first_payment_at"])
+            for email in subscribers:
+                writer.writerow([email, "true", "", "free", "false",
+                                 _timestamp(rng).strftime('%Y-%m-%dT%H:%M:%S.000Z'), ""])
+
+        for p in range(first_post, first_post + posts):
+            post_id = str(100000 + p)
+            post_rng = random.Random(seed * 100003 + p)  # same events for a post in every folder
+            sent = BASE_DATE + timedelta(days=7 * p)
+            with open(os.path.join(folder, "posts", f"{post_id}.delivers.csv"), "w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                writer.writerow(["post_id", "timestamp", "email", "post_type", "post_audience", "active_subscription"])
+                for email in subscribers[:per_post]:
+                    at = sent + timedelta(seconds=post_rng.randint(0, 600))
+                    writer.writerow([post_id, at.strftime('%Y-%m-%dT%H:%M:%S.000Z'), email,
+                                     "newsletter", "everyone", "true"])
+            with open(os.path.join(folder, "posts", f"{post_id}.opens.csv"), "w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                writer.writerow(["post_id", "timestamp", "email", "post_type", "post_audience", "active_subscription",
+                                 "country", "city", "region", "device_type", "client_os", "client_type", "user_agent"])
+                for email in subscribers[:per_post // 2]:
+                    at = sent + timedelta(seconds=post_rng.randint(600, 86400 * 3))
+                    writer.writerow([post_id, at.strftime('%Y-%m-%dT%H:%M:%S.000Z'), email, "newsletter",
+                                     "everyone", "true", "DE", "Berlin", "BE", "phone", "iOS", "app",
+                                     "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X)"])
+    return path
+
+
+def generate_spotify(path, rows, seed=42, per_file=10000):
+    """Writes Spotify extended streaming history JSON files with `rows` streams in total."""
+    rng = random.Random(seed)
+    history = os.path.join(path, "Spotify Extended Streaming History")
+    os.makedirs(history, exist_ok=True)
+    for file_index, start in enumerate(range(0, rows, per_file)):
+        streams = []
+        for _ in range(start, min(rows, start + per_file)):
+            streams.append({
+                "ts": _timestamp(rng).strftime('%Y-%m-%dT%H:%M:%SZ'),
+                "platform": rng.choice(["ios", "osx", "web_player"]),
+                "ms_played": rng.randint(0, 300000),
+                "conn_country": "DE",
+                "master_metadata_track_name": _sentence(rng, 4).title(),
+                "master_metadata_album_artist_name": rng.choice(["Kraftwerk", "Rammstein", "Nena", "Bilderbuch"]),
+                "master_metadata_album_album_name": _sentence(rng, 3).title(),
+                "spotify_track_uri": f"spotify:track:{rng.getrandbits(64):016x}",
+                "reason_start": rng.choice(["trackdone", "clickrow", "fwdbtn"]),
+                "reason_end": rng.choice(["trackdone", "endplay", "fwdbtn"]),
+                "shuffle": rng.random() < 0.5,
+                "skipped": rng.random() < 0.2,
+                "offline": False,
+                "incognito_mode": False,
+            })
+        with open(os.path.join(history, f"Streaming_History_Audio_{file_index}.json"), "w", encoding="utf-8") as f:
+            json.dump(streams, f, ensure_ascii=False, indent=2)
+    return path
+
+
+def generate_linkedin(path, rows, seed=42):
+    """Writes a LinkedIn complete/ archive (CSV) with `rows` messages plus a basic/ insights workbook."""
+    from openpyxl import Workbook
+
+    rng = random.Random(seed)
+    complete = os.path.join(path, "complete")
+    basic = os.path.join(path, "basic")
+    os.makedirs(complete, exist_ok=True)
+    os.makedirs(basic, exist_ok=True)
+
+    with open(os.path.join(complete, "Connections.csv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["First Name", "Last Name", "URL", "Email Address", "Company", "Position", "Connected On"])
+        for i in range(max(1, rows // 10)):
+            writer.writerow([f"First{i}", f"Last{i}", f"https://www.linkedin.com/in/person-{i}", "",
+                             rng.choice(["Acme", "Wurst GmbH", "DataCorp"]), _sentence(rng, 3).title(),
+                             _timestamp(rng).strftime('%d %b %Y')])
+
+    with open(os.path.join(complete, "messages.csv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["CONVERSATION ID", "CONVERSATION TITLE", "FROM", "SENDER PROFILE URL", "TO",
+                         "RECIPIENT PROFILE URLS", "DATE", "SUBJECT", "CONTENT", "FOLDER"])
+        for i in range(rows):
+            writer.writerow([f"conv-{i // 20}", "", f"Person {i % 97}", f"https://www.linkedin.com/in/p-{i % 97}",
+                             "Jim", "https://www.linkedin.com/in/jim", _timestamp(rng).strftime('%Y-%m-%d %H:%M:%S UTC'),
+                             "", _sentence(rng, 30) + "\n" + _sentence(rng, 10), "INBOX"])
+
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.title = "TOP POSTS"
+    sheet.append(["Maximum of 50 posts available to include in this list"])
+    sheet.append(["Post URL", "Post publish date", "Engagements", "Post URL", "Post publish date", "Impressions"])
+    for i in range(50):
+        published = _timestamp(rng).strftime('%m/%d/%Y')
+        sheet.append([f"https://www.linkedin.com/feed/update/urn:li:activity:{i}", published, rng.randint(0, 500),
+                      f"https://www.linkedin.com/feed/update/urn:li:activity:{i}", published, rng.randint(100, 50000)])
+    followers = workbook.create_sheet("FOLLOWERS")
+    followers.append(["Total followers on 12/23/2025:", 1234])
+    followers.append(["Date", "New followers"])
+    for d in range(365):
+        followers.append([(BASE_DATE + timedelta(days=d)).strftime('%m/%d/%Y'), rng.randint(0, 20)])
+    workbook.save(os.path.join(basic, "Content_2025-12-17_2025-12-23_Benchmark.xlsx"))
+    return path
+
+
+def generate_bolt(path, rows, seed=42):
+    """Writes Bolt rides.csv (`rows` rides) and transactions.csv."""
+    rng = random.Random(seed)
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, "rides.csv"), "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Ride ID", "Pick-up Address", "Drop-off Address", "Created", "Price", "Currency",
+                         "Payment Method", "Distance (km)", "Category"])
+        for i in range(rows):
+            writer.writerow([i, f"{rng.choice(WORDS).title()}str. {rng.randint(1, 200)}, Berlin",
+                             f"{rng.choice(WORDS).title()}platz {rng.randint(1, 50)}, Berlin",
+                             _timestamp(rng).strftime('%Y-%m-%d %H:%M:%S'), f"{rng.uniform(5, 40):.2f}", "EUR",
+                             "Card", f"{rng.uniform(1, 25):.1f}", rng.choice(["Bolt", "Comfort", "XL"])])
+    with open(os.path.join(path, "transactions.csv"), "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Transaction ID", "Date", "Amount", "Currency", "Description"])
+        for i in range(max(1, rows // 2)):
+            writer.writerow([i, _timestamp(rng).strftime('%Y-%m-%d %H:%M:%S'), f"{rng.uniform(-40, 0):.2f}",
+                             "EUR", "Ride payment"])
+    return path
+
+
+# Source name -> (generator, environment variable the ingestor reads, whether it points at a file)
+GENERATORS = {
+    "apple_health": (generate_apple_health, "EXPORT_XML_PATH", True),
+    "telegram": (generate_telegram, "TELEGRAM_DATA_PATH", False),
+    "substack": (generate_substack, "SUBSTACK_DATA_PATH", False),
+    "spotify": (generate_spotify, "SPOTIFY_DATA_PATH", False),
+    "linkedin": (generate_linkedin, "LINKEDIN_DATA_PATH", False),
+    "bolt": (generate_bolt, "BOLT_DATA_PATH", False),
+}
@@ -0,0 +1,220 @@
+"""
+Ingestion throughput benchmark.
+
+Generates a synthetic export per source (see generators.py), runs the real manual
+ingestion job against the local Postgres, and records rows/s, MB/s and peak RSS.
+Results are written as JSON so runs on different commits or machines can be compared.
+With --sink parquet/duckdb/sqlite, the jobs write to a file instead (see
+utils/ingestion_sinks.py), which times parsing without Postgres writes.
+
+    python benchmarks/run.py --rows 100000
+    python benchmarks/run.py --sink parquet
+    python benchmarks/run.py --sources apple_health telegram --rows 500000 --baseline benchmarks/results/<old>.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if PROJECT_ROOT not in sys.path:
+    sys.path.append(PROJECT_ROOT)
+
+from psycopg2 import sql
+from benchmarks.generators import GENERATORS
+from utils.ingestion_utils import load_env, get_db_connection
+
+JOBS_DIR = os.path.join(PROJECT_ROOT, "apps/data_ingestion/manual_job")
+RESULTS_DIR = os.path.join(PROJECT_ROOT, "benchmarks/results")
+
+
+def directory_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(
+        os.path.getsize(os.path.join(root, f))
+        for root, _, files in os.walk(path)
+        for f in files
+    )
+
+
+def count_loaded_rows(source, sink="postgres", sink_path=None):
+    """Total rows across all tables of the source's s_<source> schema, in Postgres or in a file sink."""
+    schema = f"s_{source}"
+    if sink == "parquet":
+        import pyarrow.dataset as ds
+        schema_dir = os.path.join(sink_path, schema)
+        return sum(ds.dataset(os.path.join(schema_dir, table)).count_rows() for table in os.listdir(schema_dir))
+    if sink == "duckdb":
+        import duckdb
+        with duckdb.connect(sink_path, read_only=True) as duck:
+            tables = [r[0] for r in duck.execute(
+                "SELECT table_name FROM information_schema.tables WHERE table_schema = ?", [schema]).fetchall()]
+            return sum(duck.execute(f'SELECT count(*) FROM "{schema}"."{table}"').fetchone()[0] for table in tables)
+    if sink == "sqlite":
+        import sqlite3
+        with sqlite3.connect(sink_path) as db:
+            tables = [r[0] for r in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+                      if r[0].startswith(f"{schema}__")]
+            return sum(db.execute(f'SELECT count(*) FROM "{table}"').fetchone()[0] for table in tables)
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT table_name FROM information_schema.tables WHERE table_schema = %s",
+                (schema,)
+            )
+            tables = [r[0] for r in cur.fetchall()]
+            total = 0
+            for table in tables:
+                cur.execute(sql.SQL("SELECT count(*) FROM {}.{}").format(
+                    sql.Identifier(schema), sql.Identifier(table)))
+                total += cur.fetchone()[0]
+        return total
+    finally:
+        conn.close()
+
+
+def run_ingestor(source, data_path, env_var, sink_args=()):
+    """Runs a manual job in a child process; returns (exit_code, seconds, peak_rss_mb)."""
+    env = dict(os.environ)
+    env[env_var] = data_path
+    script = os.path.join(JOBS_DIR, source, "ingest.py")
+
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, script, "--yes", *sink_args],
+        env=env,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+    # wait4 gives the resource usage of this child alone
+    stderr = proc.stderr.read()
+    _, status, usage = os.wait4(proc.pid, 0)
+    elapsed = time.perf_counter() - started
+    proc.returncode = os.waitstatus_to_exitcode(status)
+
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    peak_rss_mb = usage.ru_maxrss / 1024 if sys.platform != "darwin" else usage.ru_maxrss / (1024 * 1024)
+    if proc.returncode != 0:
+        print(stderr.decode('utf-8', errors='replace')[-2000:])
+    return proc.returncode, elapsed, peak_rss_mb
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def print_results(results, baseline=None):
+    previous = {r["source"]: r for r in (baseline or {}).get("results", [])}
+    print()
+    print(f"{'source':<14}{'rows':>12}{'MB':>10}{'seconds':>10}{'rows/s':>12}{'MB/s':>8}{'peak RSS MB':>13}{'vs baseline':>13}")
+    print("-" * 92)
+    for r in results:
+        change = ""
+        if r["source"] in previous and previous[r["source"]]["rows_per_second"]:
+            delta = r["rows_per_second"] / previous[r["source"]]["rows_per_second"] - 1
+            change = f"{delta:+.1%}"
+        print(f"{r['source']:<14}{r['rows']:>12,}{r['input_mb']:>10.1f}{r['seconds']:>10.2f}"
+              f"{r['rows_per_second']:>12,.0f}{r['mb_per_second']:>8.2f}{r['peak_rss_mb']:>13.1f}{change:>13}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the manual ingestion jobs on synthetic exports")
+    parser.add_argument('--sources', nargs='+', default=list(GENERATORS), choices=list(GENERATORS),
+                        help='Sources to benchmark (default: all)')
+    parser.add_argument('--rows', type=int, default=100000, help='Size of the biggest table of each export')
+    parser.add_argument('--seed', type=int, default=42, help='Seed of the synthetic data generators')
+    parser.add_argument('--data-dir', help='Where to generate exports (default: a temporary directory)')
+    parser.add_argument('--keep-data', action='store_true', help='Do not delete generated exports afterwards')
+    parser.add_argument('--output', help='Results file (default: benchmarks/results/<timestamp>.json)')
+    parser.add_argument('--baseline', help='Previous results file to compare rows/s against')
+    parser.add_argument('--sink', choices=("postgres", "parquet", "duckdb", "sqlite"), default="postgres",
+                        help='Where the jobs write (default: postgres); the file sinks go to the data directory')
+    args = parser.parse_args()
+
+    load_env()
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="jimwurst_bench_")
+    started_at = datetime.now(timezone.utc)
+
+    results = []
+    try:
+        for source in args.sources:
+            generator, env_var, points_at_file = GENERATORS[source]
+            source_dir = os.path.join(data_dir, source)
+            print(f"[{source}] generating {args.rows:,} rows...")
+            data_path = generator(source_dir, args.rows, seed=args.seed)
+            if not points_at_file:
+                data_path = source_dir
+            input_bytes = directory_size(source_dir)
+
+            sink_path = None
+            sink_args = []
+            if args.sink != "postgres":
+                extension = {"parquet": "", "duckdb": ".duckdb", "sqlite": ".sqlite"}[args.sink]
+                sink_path = os.path.join(data_dir, "sinks", f"{source}{extension}")
+                sink_args = ["--sink", args.sink, "--sink-path", sink_path]
+
+            print(f"[{source}] ingesting {input_bytes / (1024 * 1024):.1f} MB...")
+            exit_code, seconds, peak_rss_mb = run_ingestor(source, data_path, env_var, sink_args)
+            rows = count_loaded_rows(source, args.sink, sink_path) if exit_code == 0 else 0
+
+            results.append({
+                "source": source,
+                "exit_code": exit_code,
+                "rows": rows,
+                "input_mb": input_bytes / (1024 * 1024),
+                "seconds": seconds,
+                "rows_per_second": rows / seconds if seconds else 0,
+                "mb_per_second": input_bytes / (1024 * 1024) / seconds if seconds else 0,
+                "peak_rss_mb": peak_rss_mb,
+            })
+    finally:
+        if not args.keep_data and not args.data_dir:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    report = {
+        "started_at": started_at.isoformat(),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "rows": args.rows,
+        "seed": args.seed,
+        "sink": args.sink,
+        "results": results,
+    }
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{started_at.strftime('%Y%m%dT%H%M%SZ')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    print(f"\nResults written to {output}")
+
+    if any(r["exit_code"] != 0 for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Cold-start benchmark for the jimwurst CLI.
+
+Times, in fresh interpreters, `jimwurst --help` and importing each source's ingest module
+the way `jimwurst ingest <source>` does, and fails if the median is over budget. For the
+offenders, the slowest imports from `python -X importtime` are listed.
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --repeat 10
+"""
+
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if PROJECT_ROOT not in sys.path:
+    sys.path.append(PROJECT_ROOT)
+
+from utils.cli import SOURCES
+
+# Seconds, median of the runs. Python itself starts in ~20 ms; a source pays for psycopg2,
+# tqdm and python-dotenv, but not for pandas or openpyxl until it reads a workbook.
+CLI_BUDGET_SECONDS = 0.15
+SOURCE_BUDGET_SECONDS = 0.4
+
+TIMER = "import time, subprocess, sys; t = time.perf_counter(); subprocess.run(sys.argv[1:], check=True); print(time.perf_counter() - t)"
+
+
+def commands():
+    """(name, argv, budget) of everything that is timed."""
+    yield "jimwurst --help", [sys.executable, "-m", "utils.cli", "--help"], CLI_BUDGET_SECONDS
+    for source in SOURCES:
+        code = f"from utils.cli import load_job; load_job({source!r})"
+        yield f"import {source}", [sys.executable, "-c", code], SOURCE_BUDGET_SECONDS
+
+
+def time_command(argv, repeat):
+    env = dict(os.environ, PYTHONPATH=PROJECT_ROOT)
+    timings = []
+    for _ in range(repeat):
+        started = subprocess.run(
+            [sys.executable, "-c", TIMER, *argv], env=env, cwd=PROJECT_ROOT,
+            capture_output=True, text=True, check=True
+        )
+        timings.append(float(started.stdout.strip().splitlines()[-1]))
+    return statistics.median(timings)
+
+
+def slowest_imports(argv, top=5):
+    """Top-level imports by cumulative time, from -X importtime."""
+    env = dict(os.environ, PYTHONPATH=PROJECT_ROOT)
+    result = subprocess.run(
+        [argv[0], "-X", "importtime", *argv[1:]], env=env, cwd=PROJECT_ROOT,
+        capture_output=True, text=True
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        # "import time:  <self us> | <cumulative us> | <module, indented by nesting level>"
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        if cumulative_us.strip().isdigit() and not name[1:].startswith(" "):
+            imports.append((int(cumulative_us), name.strip()))
+    return sorted(imports, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the cold-start time of the jimwurst CLI against its budget")
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per command (the median is used)')
+    args = parser.parse_args()
+
+    over_budget = []
+    print(f"{'command':<24}{'median ms':>10}{'budget ms':>10}")
+    print("-" * 44)
+    for name, argv, budget in commands():
+        seconds = time_command(argv, args.repeat)
+        flag = "" if seconds <= budget else "  OVER BUDGET"
+        print(f"{name:<24}{seconds * 1000:>10.0f}{budget * 1000:>10.0f}{flag}")
+        if flag:
+            over_budget.append((name, argv))
+
+    for name, argv in over_budget:
+        print(f"\nSlowest imports of '{name}':")
+        for cumulative_us, module in slowest_imports(argv):
+            print(f"  {cumulative_us / 1000:>8.1f} ms  {module}")
+
+    if over_budget:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+import json
+
+from utils.generic_ingestor import read_batches, read_ndjson_as_text
+
+
+def test_plain_json_keeps_keys_missing_from_the_first_record(tmp_path):
+    path = tmp_path / "export.json"
+    path.write_text(json.dumps([{"a": 1}, {"a": 2, "b": 3}]))
+
+    schema, batches = read_batches(str(path))
+
+    assert schema.names == ["a", "b"]
+    assert [row for batch in batches for row in batch.to_pylist()] == [{"a": 1, "b": None}, {"a": 2, "b": 3}]
+
+
+def test_ndjson_as_text_has_the_fields_of_every_line(tmp_path):
+    path = tmp_path / "export.ndjson"
+    path.write_text('{"a": 1}\n\n{"a": "x", "b": {"c": true}}\n')
+
+    schema, batches = read_ndjson_as_text(str(path))
+
+    assert schema.names == ["a", "b"]
+    assert [row for batch in batches for row in batch.to_pylist()] == [
+        {"a": "1", "b": None},
+        {"a": "x", "b": '{"c": true}'},
+    ]
@@ -0,0 +1,306 @@
+"""
+Columnar DuckDB snapshot of the warehouse for heavy analytical queries (optional).
+
+Postgres answers "average heart rate per week over 8 years" with a full scan of row storage.
+With ANALYTICS_SNAPSHOT=1 (and `pip install duckdb`), the marts and the large raw tables are
+copied into a DuckDB file after each ingestion and dbt build, and JimwurstAgent runs read-only
+aggregations against it while it is fresh. Everything else, and any query DuckDB cannot run,
+still goes to Postgres. The snapshot answers as Postgres would: numeric columns stay exact
+decimals, and / on integers truncates (DuckDB's integer_division).
+
+The snapshot remembers a fingerprint of the warehouse (the oid and insert/update/delete
+counters of every table outside meta) taken when it was refreshed. Any load, rebuild or
+dropped table changes the fingerprint, and the snapshot counts as stale until the next refresh.
+
+    jimwurst snapshot            # refresh now
+"""
+
+import os
+import re
+import json
+import hashlib
+import tempfile
+import importlib.util
+from datetime import datetime, timezone
+from psycopg2 import sql
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+from utils.ingestion_utils import get_db_connection, get_local_data_path
+
+HAS_DUCKDB = importlib.util.find_spec("duckdb") is not None
+
+# Always snapshotted; from the s_* schemas, only tables with at least LARGE_TABLE_ROWS rows
+SNAPSHOT_SCHEMAS = ("marts",)
+LARGE_TABLE_ROWS = 100_000
+BLOCK_BYTES = 16 * 1024 * 1024
+# Widest decimal DuckDB stores; wider numeric columns stay text
+MAX_DECIMAL_PRECISION = 38
+# Where the snapshot keeps its fingerprint, next to the copied schemas
+INFO_SCHEMA = "snapshot_info"
+
+# Postgres types that Arrow parses from COPY's CSV output (numeric: see _arrow_types); everything else stays text
+ARROW_TYPES = {
+    "smallint": pa.int64(),
+    "integer": pa.int64(),
+    "bigint": pa.int64(),
+    "real": pa.float64(),
+    "double precision": pa.float64(),
+    "boolean": pa.bool_(),
+    "date": pa.date32(),
+    "timestamp without time zone": pa.timestamp("us"),
+    "timestamp with time zone": pa.timestamp("us", tz="UTC"),
+}
+
+AGGREGATE_PATTERN = re.compile(
+    r"\bgroup\s+by\b|\b(count|sum|avg|min|max|stddev|variance|percentile_cont|percentile_disc|median)\s*\(",
+    re.IGNORECASE,
+)
+CATALOG_PATTERN = re.compile(r"\b(information_schema|pg_catalog|pg_\w+)\b", re.IGNORECASE)
+
+
+def snapshot_enabled():
+    return HAS_DUCKDB and os.getenv("ANALYTICS_SNAPSHOT", "0") == "1"
+
+
+def get_snapshot_path():
+    return os.path.expanduser(os.getenv(
+        "ANALYTICS_SNAPSHOT_PATH", os.path.join(get_local_data_path(), ".analytics", "jimwurst.duckdb")
+    ))
+
+
+def is_analytical_query(query):
+    """True for a single read-only SELECT that aggregates and does not look at the Postgres catalog."""
+    statement = query.strip().rstrip(";")
+    if ";" in statement or not re.match(r"(select|with)\b", statement, re.IGNORECASE):
+        return False
+    return bool(AGGREGATE_PATTERN.search(statement)) and not CATALOG_PATTERN.search(statement)
+
+
+def warehouse_fingerprint(conn):
+    """Hash of the oid and write counters of every table outside meta (which every run writes to)."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT schemaname, relname, relid, n_tup_ins, n_tup_upd, n_tup_del
+            FROM pg_stat_user_tables
+            WHERE schemaname <> 'meta'
+            ORDER BY schemaname, relname
+        """)
+        rows = cur.fetchall()
+    conn.commit()
+    return hashlib.sha256(json.dumps(rows).encode()).hexdigest()
+
+
+class AnalyticsSnapshot:
+    """The DuckDB snapshot file: refreshing it from Postgres, checking freshness, querying it."""
+
+    def __init__(self, path=None):
+        self.path = path or get_snapshot_path()
+
+    def _tables(self, conn):
+        """(schema, table) of every marts relation and of the large s_* tables."""
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT n.nspname, c.relname
+                FROM pg_class c
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+                WHERE c.relkind IN ('r', 'v', 'm', 'p')
+                  AND (n.nspname = ANY(%s)
+                       OR (n.nspname LIKE 's\\_%%' AND GREATEST(c.reltuples, s.n_live_tup) >= %s))
+                ORDER BY n.nspname, c.relname
+            """, (list(SNAPSHOT_SCHEMAS), LARGE_TABLE_ROWS))
+            return cur.fetchall()
+
+    def _columns(self, cur, schema, table):
+        """(name, type, typmod) of the relation's columns."""
+        cur.execute("""
+            SELECT a.attname, format_type(a.atttypid, NULL), a.atttypmod
+            FROM pg_attribute a
+            WHERE a.attrelid = %s::regclass AND a.attnum > 0 AND NOT a.attisdropped
+            ORDER BY a.attnum
+        """, (sql.SQL("{}.{}").format(sql.Identifier(schema), sql.Identifier(table)).as_string(cur),))
+        return cur.fetchall()
+
+    def _arrow_types(self, cur, relation, columns):
+        """
+        {column: Arrow type} of the relation. A numeric column becomes a decimal (float64 would
+        round it), of its declared precision and scale or, if it has none, of the widest value.
+        """
+        # numeric(p, s) keeps p and s in its typmod, after the 4 bytes of the varlena header
+        # (a negative scale, possible since Postgres 15, is read from the values instead)
+        declared = {name: ((typmod - 4) >> 16, (typmod - 4) & 0xFFFF)
+                    for name, pg_type, typmod in columns if pg_type == "numeric" and typmod >= 4}
+        declared = {name: (precision, scale) for name, (precision, scale) in declared.items() if scale <= precision}
+        undeclared = [name for name, pg_type, _ in columns if pg_type == "numeric" and name not in declared]
+        if undeclared:
+            cur.execute(sql.SQL("SELECT {} FROM {}").format(sql.SQL(", ").join(
+                sql.SQL("max(length(trunc(abs({0}))::text)), max(scale({0}))").format(sql.Identifier(name))
+                for name in undeclared
+            ), relation))
+            widths = cur.fetchone()
+            for i, name in enumerate(undeclared):
+                digits, scale = widths[2 * i] or 1, widths[2 * i + 1] or 0
+                declared[name] = (digits + scale, scale)
+
+        types = {}
+        for name, pg_type, _ in columns:
+            if name in declared:
+                precision, scale = declared[name]
+                types[name] = pa.decimal128(precision, scale) if precision <= MAX_DECIMAL_PRECISION else pa.string()
+            else:
+                types[name] = ARROW_TYPES.get(pg_type, pa.string())
+        return types
+
+    def refresh(self, conn):
+        """
+        Rebuilds the snapshot from one consistent (repeatable read) view of Postgres, in a new
+        file that replaces the old one when it is complete. Returns the number of tables copied.
+        """
+        import duckdb
+
+        # Taken before the copy, so writes that race with it leave the snapshot stale, not wrong
+        fingerprint = warehouse_fingerprint(conn)
+        tables = self._tables(conn)
+        conn.commit()
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        staging_path = f"{self.path}.tmp"
+        if os.path.exists(staging_path):
+            os.remove(staging_path)
+
+        print(f"Refreshing analytics snapshot {self.path}...")
+        started = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        duck = duckdb.connect(staging_path)
+        try:
+            conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+            with conn.cursor() as cur:
+                cur.execute("SET LOCAL DateStyle TO ISO, YMD")
+                cur.execute("SET LOCAL TIME ZONE 'UTC'")
+                for schema, table in tables:
+                    rows = self._copy_table(cur, duck, schema, table)
+                    print(f"  {schema}.{table}: {rows:,} rows")
+            conn.commit()
+
+            duck.execute(f"CREATE SCHEMA {INFO_SCHEMA}")
+            duck.execute(f"CREATE TABLE {INFO_SCHEMA}.refresh (refreshed_at VARCHAR, fingerprint VARCHAR, tables VARCHAR[])")
+            duck.execute(f"INSERT INTO {INFO_SCHEMA}.refresh VALUES (?, ?, ?)",
+                         [started, fingerprint, [f"{schema}.{table}" for schema, table in tables]])
+            duck.close()
+            os.replace(staging_path, self.path)
+        except BaseException:
+            conn.rollback()
+            duck.close()
+            if os.path.exists(staging_path):
+                os.remove(staging_path)
+            raise
+        finally:
+            conn.set_session(isolation_level="DEFAULT", readonly=False)
+        print(f"Analytics snapshot refreshed: {len(tables)} table(s)")
+        return len(tables)
+
+    def _copy_table(self, cur, duck, schema, table):
+        """Copies one relation out of Postgres as CSV and into DuckDB as Arrow record batches."""
+        columns = self._columns(cur, schema, table)
+        relation = sql.SQL("{}.{}").format(sql.Identifier(schema), sql.Identifier(table))
+
+        fd, csv_path = tempfile.mkstemp(suffix=".csv", dir=os.path.dirname(self.path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                cur.copy_expert(
+                    sql.SQL("COPY (SELECT * FROM {}) TO STDOUT WITH (FORMAT csv)").format(relation).as_string(cur), f
+                )
+            duck.execute(f'CREATE SCHEMA IF NOT EXISTS "{schema}"')
+            try:
+                self._load_csv(duck, csv_path, schema, table, self._arrow_types(cur, relation, columns))
+            except pa.ArrowInvalid:
+                # A value Arrow cannot parse (e.g. an 'infinity' timestamp or a NaN numeric): keep the table as text
+                duck.execute(f'DROP TABLE IF EXISTS "{schema}"."{table}"')
+                self._load_csv(duck, csv_path, schema, table, {name: pa.string() for name, _, _ in columns})
+        finally:
+            os.remove(csv_path)
+        return duck.execute(f'SELECT count(*) FROM "{schema}"."{table}"').fetchone()[0]
+
+    def _load_csv(self, duck, csv_path, schema, table, column_types):
+        reader = pa_csv.open_csv(
+            csv_path,
+            read_options=pa_csv.ReadOptions(column_names=list(column_types), block_size=BLOCK_BYTES),
+            parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+            # COPY writes NULL as an unquoted empty field, '' as "" and booleans as t/f
+            convert_options=pa_csv.ConvertOptions(
+                column_types=column_types, null_values=[""], strings_can_be_null=True,
+                quoted_strings_can_be_null=False, true_values=["t"], false_values=["f"],
+            ),
+        )
+        duck.register("incoming", reader)
+        try:
+            duck.execute(f'CREATE TABLE "{schema}"."{table}" AS SELECT * FROM incoming')
+        finally:
+            duck.unregister("incoming")
+
+    def info(self):
+        """(refreshed_at, fingerprint, tables) of the current snapshot, or None if there is none."""
+        if not HAS_DUCKDB or not os.path.exists(self.path):
+            return None
+        import duckdb
+        try:
+            with duckdb.connect(self.path, read_only=True) as duck:
+                return duck.execute(f"SELECT refreshed_at, fingerprint, tables FROM {INFO_SCHEMA}.refresh").fetchone()
+        except duckdb.Error:
+            return None
+
+    def is_fresh(self, conn):
+        """True if nothing was loaded, rebuilt or dropped in Postgres since the snapshot was taken."""
+        info = self.info()
+        return info is not None and info[1] == warehouse_fingerprint(conn)
+
+    def query(self, query):
+        """
+        Runs a query on the snapshot, with the snapshot's schemas in the search path and / on
+        integers truncating as in Postgres (DuckDB returns a double). Returns the rows.
+        """
+        import duckdb
+        with duckdb.connect(self.path, read_only=True) as duck:
+            duck.execute("SET integer_division = true")
+            schemas = [row[0] for row in duck.execute(
+                "SELECT DISTINCT schema_name FROM duckdb_tables() WHERE schema_name <> ? ORDER BY 1", [INFO_SCHEMA]
+            ).fetchall()]
+            # marts first, like the agent's Postgres search path
+            schemas.sort(key=lambda s: s != "marts")
+            duck.execute(f"SET search_path = '{','.join(schemas)}'")
+            return duck.execute(query).fetchall()
+
+    def try_query(self, query):
+        """
+        The rows of an analytical query answered from the snapshot, or None when the query should
+        go to Postgres: not an aggregation, snapshot stale or missing, or DuckDB cannot run it
+        (a Postgres-only function, a table that is not in the snapshot, ...).
+        """
+        if not is_analytical_query(query):
+            return None
+        import duckdb
+        conn = get_db_connection()
+        try:
+            if not self.is_fresh(conn):
+                return None
+        finally:
+            conn.close()
+        try:
+            return self.query(query)
+        except duckdb.Error:
+            return None
+
+
+def refresh_if_enabled():
+    """Refreshes the snapshot after an ingestion or dbt build when ANALYTICS_SNAPSHOT=1; never raises."""
+    if not snapshot_enabled():
+        return
+    conn = None
+    try:
+        conn = get_db_connection()
+        AnalyticsSnapshot().refresh(conn)
+    except Exception as e:
+        print(f"Analytics snapshot not refreshed: {e}")
+    finally:
+        if conn is not None:
+            conn.close()
@@ -0,0 +1,325 @@
+"""
+The jimwurst command line.
+
+    jimwurst ingest apple_health spotify --yes
+    jimwurst ingest all --yes --jobs 3
+    jimwurst ingest bolt --yes --sink parquet
+    jimwurst ingest spotify --yes --append
+    jimwurst holidays
+    jimwurst transform
+    jimwurst snapshot
+
+Only the standard library is imported at start-up. A source's ingest module (and with it
+psycopg2, tqdm, pandas, ...) is imported when that source runs, so `jimwurst --help` and
+single-source runs do not pay for the others.
+
+One source runs in this process, exactly like its ingest.py would. Several sources run
+concurrently, one process each, with their output in <tmp>/jimwurst/<source>.log and a
+progress bar per source fed by RunMetrics over a pipe (see JIMWURST_PROGRESS_FD).
+"""
+
+import os
+import sys
+import shlex
+import argparse
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+MANUAL_JOBS_DIR = os.path.join(PROJECT_ROOT, "apps/data_ingestion/manual_job")
+
+SOURCES = ("apple_health", "bolt", "linkedin", "spotify", "substack", "telegram")
+
+# Keep in sync with utils.ingestion_metrics.PROGRESS_FD_ENV (not imported here, it pulls in psycopg2)
+PROGRESS_FD_ENV = "JIMWURST_PROGRESS_FD"
+# Keep in sync with utils.ingestion_sinks.SINKS
+SINKS = ("postgres", "parquet", "duckdb", "sqlite")
+# Sources whose plain CSV files Postgres can load itself with --server-copy
+SERVER_COPY_SOURCES = ("bolt", "linkedin", "substack")
+# Sources that can add an export to their existing tables with --append
+APPEND_SOURCES = ("bolt", "linkedin", "spotify", "substack")
+
+
+def load_job(name):
+    """Imports apps/data_ingestion/manual_job/<name>/ingest.py as a module."""
+    import importlib.util
+
+    path = os.path.join(MANUAL_JOBS_DIR, name, "ingest.py")
+    spec = importlib.util.spec_from_file_location(f"jimwurst_ingest_{name}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def run_source(source, job_args):
+    """Runs one source's ingestion in this process."""
+    from utils.ingestion_utils import load_env
+
+    if source not in APPEND_SOURCES:
+        # The other jobs reject --append (ingest() says they are rebuilt)
+        job_args = [arg for arg in job_args if arg != "--append"]
+
+    # Sources read their settings (DATA_PATH, ...) at import, so load docker/.env first
+    load_env()
+    load_job(source).main(job_args)
+
+
+def run_concurrently(sources, job_args, jobs):
+    """Runs each source in its own process, at most `jobs` at a time. Returns the failed sources."""
+    import time
+    import tempfile
+    import threading
+    import subprocess
+    from tqdm import tqdm
+
+    log_dir = os.path.join(tempfile.gettempdir(), "jimwurst")
+    os.makedirs(log_dir, exist_ok=True)
+
+    width = max(len(s) for s in sources)
+    bars = {
+        source: tqdm(desc=source.ljust(width), unit=" rows", position=i, leave=True,
+                     bar_format="{desc}  {n_fmt}{unit} [{elapsed}, {rate_fmt}{postfix}]")
+        for i, source in enumerate(sources)
+    }
+    for bar in bars.values():
+        bar.set_postfix_str("waiting")
+
+    def follow(read_fd, bar):
+        with os.fdopen(read_fd) as progress:
+            for line in progress:
+                bar.n = int(line)
+                bar.refresh()
+
+    def start(source):
+        read_fd, write_fd = os.pipe()
+        env = dict(os.environ, TQDM_DISABLE="1", **{PROGRESS_FD_ENV: str(write_fd)})
+        log_path = os.path.join(log_dir, f"{source}.log")
+        with open(log_path, "w") as log:
+            proc = subprocess.Popen(
+                [sys.executable, "-m", "utils.cli", "ingest", source, *job_args],
+                stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT,
+                env=env, pass_fds=(write_fd,),
+            )
+        os.close(write_fd)
+        follower = threading.Thread(target=follow, args=(read_fd, bars[source]), daemon=True)
+        follower.start()
+        bars[source].reset()
+        bars[source].set_postfix_str("running")
+        return proc, follower, log_path
+
+    pending = list(sources)
+    running = {}
+    failed = []
+    while pending or running:
+        while pending and len(running) < jobs:
+            source = pending.pop(0)
+            running[source] = start(source)
+        for source, (proc, follower, log_path) in list(running.items()):
+            if proc.poll() is None:
+                continue
+            follower.join()
+            del running[source]
+            if proc.returncode == 0:
+                bars[source].set_postfix_str("done")
+            else:
+                failed.append(source)
+                bars[source].set_postfix_str(f"failed (exit {proc.returncode}), see {log_path}")
+        time.sleep(0.1)
+
+    for bar in bars.values():
+        bar.close()
+    return failed
+
+
+def confirm(sources, sink):
+    target = "Postgres" if sink == "postgres" else f"the {sink} sink"
+    try:
+        response = input(f"Ingest {', '.join(sources)} into {target}? (y/N): ").strip().lower()
+    except (KeyboardInterrupt, EOFError):
+        response = ""
+    return response == "y"
+
+
+def ingest(args):
+    sources = list(SOURCES) if "all" in args.sources else list(dict.fromkeys(args.sources))
+
+    job_args = []
+    if args.yes or len(sources) > 1:
+        job_args.append("--yes")
+    if args.resume:
+        job_args.append("--resume")
+    if args.cache:
+        job_args.append("--cache")
+    if args.profile is not None:
+        job_args += ["--profile", args.profile] if args.profile else ["--profile"]
+    if args.sink != "postgres":
+        job_args += ["--sink", args.sink]
+    if args.sink_path:
+        job_args += ["--sink-path", args.sink_path]
+    if args.server_copy:
+        if set(sources) - set(SERVER_COPY_SOURCES):
+            print(f"--server-copy applies to {', '.join(SERVER_COPY_SOURCES)}; the other sources stream as usual.")
+        job_args += ["--server-copy"]
+    if args.append:
+        if set(sources) - set(APPEND_SOURCES):
+            print(f"--append applies to {', '.join(APPEND_SOURCES)}; the other sources are rebuilt as usual.")
+        job_args += ["--append"]
+
+    if len(sources) == 1:
+        run_source(sources[0], job_args)
+        if args.sink == "postgres":
+            refresh_snapshot_if_enabled()
+        return 0
+
+    # The sources run without a terminal, so confirm once for all of them
+    if not args.yes and not confirm(sources, args.sink):
+        print("Operation cancelled.")
+        return 0
+    jobs = args.jobs or len(sources)
+    if args.sink == "duckdb" and jobs > 1:
+        # A DuckDB file has a single writer
+        print("--sink duckdb: running the sources one at a time.")
+        jobs = 1
+    failed = run_concurrently(sources, job_args, jobs)
+    if len(failed) < len(sources) and args.sink == "postgres":
+        refresh_snapshot_if_enabled()
+    if failed:
+        print(f"Failed: {', '.join(failed)}")
+        return 1
+    return 0
+
+
+def refresh_snapshot_if_enabled():
+    """Keeps the DuckDB analytics snapshot in step with Postgres after a load (when ANALYTICS_SNAPSHOT=1)."""
+    from utils.ingestion_utils import load_env
+    from utils.analytics_snapshot import refresh_if_enabled
+
+    load_env()
+    refresh_if_enabled()
+
+
+def snapshot(args):
+    if args.if_enabled:
+        refresh_snapshot_if_enabled()
+        return 0
+
+    from utils.analytics_snapshot import HAS_DUCKDB, AnalyticsSnapshot
+    from utils.ingestion_utils import load_env, get_db_connection
+
+    load_env()
+    if not HAS_DUCKDB:
+        print("The analytics snapshot needs DuckDB: pip install duckdb")
+        return 1
+    conn = get_db_connection()
+    try:
+        AnalyticsSnapshot().refresh(conn)
+    finally:
+        conn.close()
+    return 0
+
+
+def holidays(args):
+    from utils.ingestion_utils import load_env
+
+    # The database settings, and LOCAL_DATA_PATH with the holiday cache
+    load_env()
+    load_job("public_holidays").generate_holidays(workers=args.workers, csv_path=args.csv)
+    return 0
+
+
+def transform(args):
+    """dbt build of what depends on the source tables changed since the last one (see utils/source_changes.py)."""
+    from utils.ingestion_utils import load_env, get_db_connection
+    from utils.ingestion_metrics import ensure_meta_tables
+    from utils.source_changes import pending_changes, selectors, mark_built
+    from utils.dbt_runner import DBT_DIR, execute
+
+    load_env()
+    conn = get_db_connection()
+    try:
+        ensure_meta_tables(conn)
+        tables, last_change_id = pending_changes(conn)
+        if args.all:
+            select = []
+        else:
+            print(f"Changed since the last build: {', '.join(f'{s}.{t}' for s, t in tables) or 'nothing'}")
+            select = selectors(tables, DBT_DIR)
+            if not select:
+                print("No dbt source changed, nothing to build.")
+                if not args.dry_run:
+                    mark_built(conn, last_change_id)
+                return 0
+
+        command = " ".join(["build", *(["--select", *select] if select else []),
+                            *(["--full-refresh"] if args.full_refresh else []),
+                            *(["--vars", shlex.quote(args.vars)] if args.vars else [])])
+        print(f"dbt {command}")
+        if args.dry_run:
+            return 0
+        success, error = execute(command)
+        if not success:
+            print(f"dbt build failed{f': {error}' if error else ''}; the changes stay pending.")
+            return 1
+        mark_built(conn, last_change_id)
+    finally:
+        conn.close()
+    refresh_snapshot_if_enabled()
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="jimwurst", description="jimwurst data warehouse tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ingest_parser = commands.add_parser("ingest", help="Run manual ingestion jobs")
+    ingest_parser.add_argument("sources", nargs="+", choices=SOURCES + ("all",), metavar="SOURCE",
+                               help=f"Sources to ingest: {', '.join(SOURCES)} or all")
+    ingest_parser.add_argument("--yes", "-y", action="store_true", help="Skip confirmation prompts")
+    ingest_parser.add_argument("--resume", action="store_true",
+                               help="Continue from the last committed checkpoint instead of starting from scratch")
+    ingest_parser.add_argument("--cache", action="store_true",
+                               help="Load unchanged exports from their Parquet cache (see utils/ingestion_cache.py)")
+    ingest_parser.add_argument("--profile", nargs="?", const="", default=None, metavar="DIR",
+                               help="Profile each run (see utils/ingestion_profiler.py)")
+    ingest_parser.add_argument("--sink", choices=SINKS, default="postgres",
+                               help="Where to write the tables (default: postgres; see utils/ingestion_sinks.py)")
+    ingest_parser.add_argument("--sink-path", metavar="PATH",
+                               help="Output directory (parquet) or database file (duckdb, sqlite) of a file sink "
+                                    "(default: LOCAL_DATA_PATH/.sinks/)")
+    ingest_parser.add_argument("--server-copy", action="store_true",
+                               help="Let Postgres read plain CSV files itself from its /local_data mount "
+                                    f"({', '.join(SERVER_COPY_SOURCES)}; falls back to streaming them)")
+    ingest_parser.add_argument("--append", action="store_true",
+                               help="Add the export to the existing tables instead of rebuilding them, adding new "
+                                    f"columns ({', '.join(APPEND_SOURCES)})")
+    ingest_parser.add_argument("--jobs", "-j", type=int,
+                               help="Maximum number of sources running at once (default: all of them)")
+    ingest_parser.set_defaults(func=ingest)
+
+    holidays_parser = commands.add_parser("holidays", help="Load the public holidays into marts.dim_public_holidays_raw")
+    holidays_parser.add_argument("--workers", type=int,
+                                 help="Processes computing the holidays missing from the cache (default: one per core)")
+    holidays_parser.add_argument("--csv", metavar="PATH", help="Write the holidays to a CSV file instead of the table")
+    holidays_parser.set_defaults(func=holidays)
+
+    transform_parser = commands.add_parser("transform",
+                                           help="dbt build of the models depending on the source tables "
+                                                "changed since the last one")
+    transform_parser.add_argument("--all", action="store_true", help="Build every model")
+    transform_parser.add_argument("--full-refresh", action="store_true", help="Rebuild incremental models from scratch")
+    transform_parser.add_argument("--vars", metavar="YAML", help="dbt --vars, e.g. '{\"enable_linkedin_models\": true}'")
+    transform_parser.add_argument("--dry-run", action="store_true", help="Print the dbt command without running it")
+    transform_parser.set_defaults(func=transform)
+
+    snapshot_parser = commands.add_parser("snapshot", help="Refresh the DuckDB analytics snapshot (see utils/analytics_snapshot.py)")
+    snapshot_parser.add_argument("--if-enabled", action="store_true",
+                                 help="Only refresh when ANALYTICS_SNAPSHOT=1, and never fail (for hooks)")
+    snapshot_parser.set_defaults(func=snapshot)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    sys.exit(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,211 @@
+"""
+dbt for the agent, run inside this process.
+
+    run_dbt_command("build --select source:substack+ --threads 4")
+
+A command is a dbt verb with a few options (--select/-s, --exclude, --threads, --defer,
+--state, --full-refresh, --vars). It runs through dbt's Python API (dbtRunner) instead of a
+`dbt` subprocess, so Python and dbt are started once. The parsed project (the manifest) is kept
+in memory and handed to later runs, which then skip parsing; it is parsed again when a file of
+the project changes (by path, size and modification time) or with other --vars.
+
+dbt's log events go to the listeners of streaming() as they happen, e.g. the agent's Streamlit
+callback, and the info, warning and error messages are returned as the command's output.
+Without dbt installed in this environment, the `dbt` executable is run and its output
+streamed line by line.
+"""
 
-import subprocess
 import os
+import re
+import shlex
+import hashlib
+import argparse
+import threading
+import subprocess
+import importlib.util
+from contextlib import contextmanager
+
+DBT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../apps/data_transformation/dbt'))
+
+HAS_DBT = importlib.util.find_spec("dbt") is not None
+
+COMMANDS = ("build", "run", "test", "seed", "snapshot", "compile", "ls", "parse")
+# What the manifest is parsed from
+PROJECT_FILES = ("dbt_project.yml", "packages.yml", "dependencies.yml")
+PROJECT_DIRS = ("models", "macros", "seeds", "snapshots", "tests", "analyses")
+LOG_LEVELS = ("info", "warn", "error")
+
+ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;]*m")
+
+# dbt keeps global state (flags, adapters): one invocation at a time
+_lock = threading.Lock()
+# (project fingerprint, vars) -> parsed Manifest; only the latest is kept
+_manifests = {}
+_local = threading.local()
+
+
+@contextmanager
+def streaming(*listeners):
+    """Sends every dbt log message of the runs started on this thread to the listeners."""
+    previous = getattr(_local, "listeners", ())
+    _local.listeners = previous + tuple(listeners)
+    try:
+        yield
+    finally:
+        _local.listeners = previous
+
+
+def parse_command(command):
+    """The dbt arguments of a command string such as 'build -s my_model+ --threads 4'."""
+    parser = argparse.ArgumentParser(prog="dbt", add_help=False, exit_on_error=False)
+    parser.add_argument("verb", nargs="?", default="build", choices=COMMANDS)
+    parser.add_argument("--select", "-s", nargs="+")
+    parser.add_argument("--exclude", nargs="+")
+    parser.add_argument("--threads", type=int)
+    parser.add_argument("--defer", action="store_true")
+    parser.add_argument("--state")
+    parser.add_argument("--full-refresh", action="store_true")
+    parser.add_argument("--vars")
+    try:
+        options, unknown = parser.parse_known_args(shlex.split(command or ""))
+    except (argparse.ArgumentError, ValueError) as e:
+        raise ValueError(f"{e}. Commands look like: build --select <models> --threads 4") from e
+    if unknown:
+        raise ValueError(f"Unsupported dbt arguments: {' '.join(unknown)}")
+
+    args = [options.verb]
+    if options.select:
+        args += ["--select", *options.select]
+    if options.exclude:
+        args += ["--exclude", *options.exclude]
+    if options.threads:
+        args += ["--threads", str(options.threads)]
+    if options.full_refresh:
+        args.append("--full-refresh")
+    if options.defer or options.state:
+        # State is a folder with the manifest.json of the run to compare with or defer to
+        state = options.state or os.getenv("DBT_STATE_PATH")
+        if not state:
+            raise ValueError("--defer needs --state <folder with a manifest.json> (or DBT_STATE_PATH)")
+        if options.defer:
+            args.append("--defer")
+        args += ["--state", os.path.join(DBT_DIR, os.path.expanduser(state))]
+    return args, options.vars
+
+
+def project_fingerprint():
+    """Hash of the paths, sizes and modification times of the files the manifest is parsed from."""
+    digest = hashlib.sha256()
+    paths = [os.path.join(DBT_DIR, name) for name in PROJECT_FILES]
+    for folder in PROJECT_DIRS:
+        for root, dirs, files in os.walk(os.path.join(DBT_DIR, folder)):
+            dirs.sort()
+            paths += [os.path.join(root, name) for name in sorted(files)]
+    for path in paths:
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            digest.update(f"{os.path.relpath(path, DBT_DIR)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+def _project_args(dbt_vars):
+    args = ["--project-dir", DBT_DIR, "--no-use-colors"]
+    return args + ["--vars", dbt_vars] if dbt_vars else args
+
+
+def _manifest(dbt_vars, callbacks):
+    """The parsed project, from memory when nothing changed. Returns (manifest, failed result)."""
+    from dbt.cli.main import dbtRunner
+
+    key = (project_fingerprint(), dbt_vars or "")
+    if key in _manifests:
+        return _manifests[key], None
+    result = dbtRunner(callbacks=callbacks).invoke(["parse", *_project_args(dbt_vars)])
+    if not result.success:
+        return None, result
+    _manifests.clear()
+    _manifests[key] = result.result
+    return result.result, None
+
+
+def _run_in_process(args, dbt_vars, emit):
+    """Runs dbt through dbtRunner. Returns (success, error message or None)."""
+    from dbt.cli.main import dbtRunner
+
+    def on_event(event):
+        # Called from dbt's worker threads too
+        if event.info.level in LOG_LEVELS and event.info.msg:
+            emit(event.info.msg)
+
+    with _lock:
+        manifest, failed = _manifest(dbt_vars, [on_event])
+        if failed is None:
+            if args[0] == "parse":
+                return True, None
+            result = dbtRunner(manifest=manifest, callbacks=[on_event]).invoke([*args, *_project_args(dbt_vars)])
+        else:
+            result = failed
+    return result.success, str(result.exception) if result.exception else None
+
+
+def _run_subprocess(args, dbt_vars, emit):
+    """Runs the dbt executable, streaming its output. Returns (success, error message or None)."""
+    process = subprocess.Popen(
+        ["dbt", *args, *_project_args(dbt_vars)],
+        cwd=DBT_DIR,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+    )
+    for line in process.stdout:
+        emit(line.rstrip("\n"))
+    return process.wait() == 0, None
+
+
+def execute(command, emit=None):
+    """
+    Runs a dbt command, handing each log message to emit as it comes (by default, dbt's log
+    goes to stdout). Returns (success, error message or None); raises ValueError for a
+    command it does not take.
+    """
+    args, dbt_vars = parse_command(command)
+    run = _run_in_process if HAS_DBT else _run_subprocess
+    if emit is None:
+        # dbtRunner prints its log itself
+        emit = (lambda message: None) if HAS_DBT else print
+    return run(args, dbt_vars, lambda message: emit(ANSI_ESCAPE.sub("", message)))
+
 
 def run_dbt_command(command: str = "build") -> str:
     """
-    Runs a dbt command in the data_transformation app.
-    Default command is 'build'.
+    Runs a dbt command in the data_transformation app (see the module docstring).
+    Default command is 'build'. Returns dbt's log messages, and the error if it failed.
     """
-    dbt_dir = os.path.join(os.path.dirname(__file__), '../apps/data_transformation/dbt')
-    
     try:
-        # Ensure we capture stdout and stderr
-        result = subprocess.run(
-            ["dbt", command],
-            cwd=dbt_dir,
-            capture_output=True,
-            text=True,
-            check=False # Don't raise exception on non-zero exit, just return output
-        )
-        
-        output = result.stdout
-        if result.stderr:
-            output += "\nErrors:\n" + result.stderr
-            
-        return output
+        args, _ = parse_command(command)
+    except ValueError as e:
+        return f"Error running dbt: {e}"
+
+    lines = []
+    listeners = getattr(_local, "listeners", ())
 
+    def emit(message):
+        lines.append(message)
+        for listener in listeners:
+            listener(message)
+
+    try:
+        success, error = execute(command, emit)
     except Exception as e:
         return f"Error running dbt: {str(e)}"
+
+    output = "\n".join(lines)
+    if error:
+        output += "\nErrors:\n" + error
+
+    # Rebuilt marts make the DuckDB analytics snapshot stale
+    if success and args[0] in ("run", "build"):
+        from utils.analytics_snapshot import refresh_if_enabled
+        refresh_if_enabled()
+
+    return output
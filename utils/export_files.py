@@ -0,0 +1,129 @@
+"""
+Files of an export, in folders or still inside the .zip archive the service delivered.
+
+walk_files() lists the files under a folder like os.walk, and treats every .zip archive in it
+as a folder of its own: the member "Spotify Account Data/StreamingHistory0.json" of
+my_spotify_data.zip is the path
+
+    <DATA_PATH>/my_spotify_data.zip/Spotify Account Data/StreamingHistory0.json
+
+Such paths are plain strings, so units, table names and relative paths work as for extracted
+files, and open_file() streams the member straight out of the archive instead of from a
+temporary copy. An archive next to a folder of the same name (export.zip and export/) is taken
+to be extracted already and skipped.
+
+Members cannot be memory-mapped or read by the Postgres server, so --server-copy and parallel
+CSV parsing stream them like any small file.
+"""
+
+import io
+import os
+import zipfile
+
+ARCHIVE_SUFFIX = ".zip"
+
+
+def is_archive(path):
+    return path.lower().endswith(ARCHIVE_SUFFIX) and os.path.isfile(path) and zipfile.is_zipfile(path)
+
+
+def split_member(path):
+    """(archive, member) for a path inside a .zip archive, or None for a file on disk."""
+    if os.path.exists(path):
+        return None
+    parts = path.replace(os.sep, "/").split("/")
+    for i in range(1, len(parts)):
+        archive = os.sep.join(parts[:i])
+        if archive.lower().endswith(ARCHIVE_SUFFIX) and os.path.isfile(archive):
+            return archive, "/".join(parts[i:])
+    return None
+
+
+def is_member(path):
+    return split_member(path) is not None
+
+
+def archive_of(path):
+    """The file on disk holding path: the archive of a member, the path itself otherwise."""
+    member = split_member(path)
+    return member[0] if member else path
+
+
+def _members(archive):
+    """Paths of the files in an archive, without folders and macOS metadata."""
+    with zipfile.ZipFile(archive) as zf:
+        names = [info.filename for info in zf.infolist() if not info.is_dir()]
+    return [
+        os.path.join(archive, *name.split("/")) for name in sorted(names)
+        if not name.startswith("__MACOSX/") and not os.path.basename(name).startswith("._")
+    ]
+
+
+def walk_files(root):
+    """
+    Every file under root (a folder or a .zip archive), in sorted order, with the members of
+    the archives found along the way in place of the archives themselves.
+    """
+    if is_archive(root):
+        yield from _members(root)
+        return
+    for folder, dirs, files in os.walk(root):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(folder, name)
+            if not is_archive(path):
+                yield path
+            elif name[:-len(ARCHIVE_SUFFIX)] not in dirs:
+                yield from _members(path)
+
+
+def list_files(folder):
+    """Names of the files directly in a folder, a .zip archive or a folder inside one ([] if there is none)."""
+    if os.path.isdir(folder):
+        return sorted(name for name in os.listdir(folder) if os.path.isfile(os.path.join(folder, name)))
+    archive = folder if is_archive(folder) else (split_member(folder) or (None,))[0]
+    if archive is None:
+        return []
+    return [os.path.basename(path) for path in _members(archive) if os.path.dirname(path) == folder]
+
+
+def export_folders(root):
+    """
+    The folders and .zip archives directly in root, by folder_name (skipping archives that were
+    extracted there).
+    """
+    entries = os.listdir(root)
+    folders = [
+        os.path.join(root, name) for name in entries
+        if os.path.isdir(os.path.join(root, name))
+        or (is_archive(os.path.join(root, name)) and name[:-len(ARCHIVE_SUFFIX)] not in entries)
+    ]
+    return sorted(folders, key=folder_name)
+
+
+def folder_name(path):
+    """Name of an export folder, the same for export/ and export.zip."""
+    name = os.path.basename(path)
+    return name[:-len(ARCHIVE_SUFFIX)] if name.lower().endswith(ARCHIVE_SUFFIX) else name
+
+
+def file_size(path):
+    """Size in bytes of a file on disk, or the uncompressed size of an archive member."""
+    member = split_member(path)
+    if member is None:
+        return os.path.getsize(path)
+    with zipfile.ZipFile(member[0]) as zf:
+        return zf.getinfo(member[1]).file_size
+
+
+def open_file(path, mode="r", encoding=None, newline=None):
+    """open() for files on disk and archive members alike (mode "r" or "rb")."""
+    member = split_member(path)
+    if member is None:
+        return open(path, mode, encoding=encoding, newline=newline)
+    # The member keeps the archive's file open after the ZipFile itself is closed
+    with zipfile.ZipFile(member[0]) as zf:
+        raw = zf.open(member[1])
+    if "b" in mode:
+        return raw
+    return io.TextIOWrapper(raw, encoding=encoding or "utf-8", newline=newline)
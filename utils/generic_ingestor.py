@@ -1,50 +1,359 @@
-
+import io
 import os
-import pandas as pd
-from sqlalchemy import create_engine
+import json
+import time
+import zipfile
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.json as pa_json
+import pyarrow.parquet as pq
+from psycopg2 import sql, errors
 from utils.ingestion_utils import get_db_connection, ensure_schema, sanitize_table_name, clean_header
 
+# Rows per record batch for Parquet and Excel
+BATCH_ROWS = 100_000
+# Bytes per record batch for CSV and NDJSON (Arrow reads these in blocks); types are inferred from the first one
+BLOCK_BYTES = 16 * 1024 * 1024
+
+SUPPORTED_EXTENSIONS = (".csv", ".csv.gz", ".zip", ".parquet", ".json", ".ndjson", ".jsonl", ".ndjson.gz", ".jsonl.gz", ".xlsx")
+
+# Arrow writes each record batch as CSV in C++; quoting every value keeps "" and NULL apart for COPY
+COPY_WRITE_OPTIONS = pa_csv.WriteOptions(include_header=False, quoting_style="all_valid")
+
+
+def file_format(file_path):
+    """csv, ndjson, json, parquet, xlsx or zip (a zipped CSV/NDJSON), from the file name."""
+    name = file_path.lower()
+    if name.endswith(".gz"):
+        name = name[:-3]
+    for extension, fmt in ((".csv", "csv"), (".ndjson", "ndjson"), (".jsonl", "ndjson"), (".json", "json"),
+                           (".parquet", "parquet"), (".xlsx", "xlsx"), (".zip", "zip")):
+        if name.endswith(extension):
+            return fmt
+    raise ValueError(f"Unsupported file type: {os.path.basename(file_path)} (supported: {', '.join(SUPPORTED_EXTENSIONS)})")
+
+
+def table_name_for(file_path):
+    """Table name from the file name, without compression extensions (export.csv.gz -> export)."""
+    filename = os.path.basename(file_path)
+    if filename.lower().endswith(".gz"):
+        filename = filename[:-3]
+    return sanitize_table_name(filename)
+
+
+def postgres_type(arrow_type):
+    """Postgres column type for an Arrow type."""
+    types = pa.types
+    if types.is_boolean(arrow_type):
+        return "BOOLEAN"
+    if types.is_uint64(arrow_type) or types.is_decimal(arrow_type):
+        return "NUMERIC"
+    if types.is_integer(arrow_type):
+        return "BIGINT"
+    if types.is_floating(arrow_type):
+        return "DOUBLE PRECISION"
+    if types.is_timestamp(arrow_type):
+        return "TIMESTAMPTZ" if arrow_type.tz else "TIMESTAMP"
+    if types.is_date(arrow_type):
+        return "DATE"
+    if types.is_time(arrow_type):
+        return "TIME"
+    if is_nested(arrow_type):
+        return "JSONB"
+    return "TEXT"
+
+
+def is_nested(arrow_type):
+    types = pa.types
+    return types.is_struct(arrow_type) or types.is_map(arrow_type) or types.is_list(arrow_type) or types.is_large_list(arrow_type)
+
+
+def nested_to_json(batch):
+    """Arrow cannot write nested columns as CSV, so those (only) are turned into JSON text."""
+    if not any(is_nested(field.type) for field in batch.schema):
+        return batch
+    columns = [
+        pa.array([None if v is None else json.dumps(v, default=str) for v in column.to_pylist()], pa.string())
+        if is_nested(column.type) else column
+        for column in batch.columns
+    ]
+    return pa.RecordBatch.from_arrays(columns, names=batch.schema.names)
+
+
+def batch_to_csv(batch):
+    """A record batch as COPY ... WITH (FORMAT csv) input, written by Arrow without going through Python objects."""
+    sink = pa.BufferOutputStream()
+    pa_csv.write_csv(nested_to_json(batch), sink, write_options=COPY_WRITE_OPTIONS)
+    return pa.BufferReader(sink.getvalue())
+
+
+def zip_member(archive):
+    """The first CSV/NDJSON file of a zip archive (skipping folders and macOS metadata)."""
+    for member in sorted(archive.namelist()):
+        name = os.path.basename(member)
+        if name and not name.startswith(".") and name.lower().endswith((".csv", ".ndjson", ".jsonl")):
+            return member
+    raise ValueError(f"No CSV or NDJSON file found in {os.path.basename(archive.filename)}")
+
+
+def open_input(file_path):
+    """Binary stream of a CSV/NDJSON file, decompressing .gz and opening the data file of a .zip."""
+    if file_format(file_path) != "zip":
+        return pa.input_stream(file_path, compression="detect")
+    # The member keeps the archive's file open after the ZipFile itself is closed, until it is closed too
+    with zipfile.ZipFile(file_path) as archive:
+        return archive.open(zip_member(archive))
+
+
+def inner_format(file_path):
+    """Format of the data itself, looking inside .zip archives."""
+    fmt = file_format(file_path)
+    if fmt != "zip":
+        return fmt
+    with zipfile.ZipFile(file_path) as archive:
+        return file_format(zip_member(archive))
+
+
+def data_format(file_path):
+    """inner_format(), telling NDJSON from plain JSON by the first lines of a .json file."""
+    fmt = inner_format(file_path)
+    if fmt == "json" and is_ndjson(file_path):
+        return "ndjson"  # many ".json" exports are one object per line
+    return fmt
+
+
+def json_text(value):
+    """A JSON value as text: strings as they are, anything else as JSON."""
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value, default=str)
+
+
+def records_table(records):
+    """
+    Table of a list of JSON objects, with a column for every key any of them has (from_pylist
+    would only take the keys of the first). A column whose values have no common Arrow type
+    (e.g. 1 and "1") is loaded as text.
+    """
+    columns = {}
+    for name in dict.fromkeys(key for record in records for key in record):
+        values = [record.get(name) for record in records]
+        try:
+            columns[name] = pa.array(values)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            columns[name] = pa.array([json_text(v) for v in values], pa.string())
+    return pa.table(columns)
+
+
+def read_ndjson_as_text(file_path):
+    """
+    Returns (schema, record batches) of an NDJSON file with every field as text, for a file whose
+    later lines bring fields or types the first block did not have (Arrow rejects those). Reads
+    the file twice: once for the field names, once for the values.
+    """
+    def records():
+        with io.TextIOWrapper(open_input(file_path), encoding="utf-8") as lines:
+            for line in lines:
+                if line.strip():
+                    yield json.loads(line)
+
+    schema = pa.schema([(name, pa.string()) for name in dict.fromkeys(key for record in records() for key in record)])
+
+    def batches():
+        batch = []
+        for record in records():
+            batch.append(record)
+            if len(batch) == BATCH_ROWS:
+                yield text_batch(schema, batch)
+                batch = []
+        if batch:
+            yield text_batch(schema, batch)
+
+    return schema, batches()
+
+
+def text_batch(schema, records):
+    return pa.RecordBatch.from_arrays(
+        [pa.array([json_text(record.get(name)) for record in records], pa.string()) for name in schema.names],
+        schema=schema,
+    )
+
+
+def read_batches(file_path):
+    """
+    Returns (schema, record batches) for a supported file.
+
+    CSV column types are inferred from the first block, and the batches are then read as text
+    so that Postgres does the casting on COPY (see copy_batches). NDJSON types are inferred from
+    the first block too (see load_file for the files that do not keep to them). The other
+    formats carry their own types. Plain JSON arrays and Excel sheets have no streaming reader
+    and go through Python objects; only the first sheet of a workbook is read.
+    """
+    fmt = data_format(file_path)
+    read_options = pa_csv.ReadOptions(block_size=BLOCK_BYTES)
+
+    if fmt == "csv":
+        with open_input(file_path) as stream:
+            schema = pa_csv.open_csv(stream, read_options=read_options).schema
+        as_text = pa_csv.ConvertOptions(
+            column_types={name: pa.string() for name in schema.names}, strings_can_be_null=True
+        )
+        return schema, pa_csv.open_csv(open_input(file_path), read_options=read_options, convert_options=as_text)
+
+    if fmt == "parquet":
+        parquet_file = pq.ParquetFile(file_path)
+        return parquet_file.schema_arrow, parquet_file.iter_batches(batch_size=BATCH_ROWS)
+
+    if fmt == "ndjson":
+        reader = pa_json.open_json(open_input(file_path), read_options=pa_json.ReadOptions(block_size=BLOCK_BYTES))
+        return reader.schema, reader
+
+    if fmt == "json":
+        with open(file_path, encoding="utf-8") as f:
+            records = json.load(f)
+        if isinstance(records, dict) and len(records) == 1 and isinstance(next(iter(records.values())), list):
+            records = next(iter(records.values()))
+        table = records_table(records if isinstance(records, list) else [records])
+        return table.schema, table.to_batches(max_chunksize=BATCH_ROWS)
+
+    # xlsx: pandas is only needed here, so it is not imported with the module
+    import pandas as pd
+    df = pd.read_excel(file_path, sheet_name=0, engine="openpyxl")
+    for column in df.columns[df.dtypes == object]:
+        df[column] = df[column].map(lambda v: None if pd.isna(v) else str(v))
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    return table.schema, table.to_batches(max_chunksize=BATCH_ROWS)
+
+
+def is_ndjson(file_path):
+    """True if the first two lines of the file are separate JSON documents."""
+    with pa.input_stream(file_path, compression="detect") as stream:
+        head = stream.read(1024 * 1024)
+    lines = head.lstrip().split(b"\n", 2)
+    if len(lines) < 2 or not lines[1].strip():
+        return False
+    try:
+        json.loads(lines[0])
+        return True
+    except ValueError:
+        return False
+
+
+def widen_to_text(cur, schema, table_name, column_types):
+    """Turns every typed column into TEXT, for files whose first block was not representative."""
+    for column, column_type in column_types.items():
+        if column_type != "TEXT":
+            cur.execute(sql.SQL("ALTER TABLE {}.{} ALTER COLUMN {} TYPE TEXT").format(
+                sql.Identifier(schema), sql.Identifier(table_name), sql.Identifier(column)
+            ))
+            column_types[column] = "TEXT"
+
+
+def copy_batches(conn, schema, table_name, arrow_schema, batches):
+    """
+    Replaces schema.table_name with the record batches, in one transaction.
+
+    Each batch is written as CSV by Arrow and sent with COPY, without converting rows to
+    Python objects. If a batch does not fit the column types (e.g. "n/a" in a column that
+    looked numeric), the typed columns fall back to TEXT.
+    Returns (rows, batches, widened).
+    """
+    columns = [clean_header(name) for name in arrow_schema.names]
+    column_types = {c: postgres_type(field.type) for c, field in zip(columns, arrow_schema)}
+
+    table = sql.SQL("{}.{}").format(sql.Identifier(schema), sql.Identifier(table_name))
+    copy_query = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv)").format(
+        table, sql.SQL(", ").join(map(sql.Identifier, columns))
+    ).as_string(conn)
+
+    rows = 0
+    count = 0
+    widened = False
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL("DROP TABLE IF EXISTS {} CASCADE").format(table))
+        cur.execute(sql.SQL("CREATE TABLE {} ({})").format(table, sql.SQL(", ").join(
+            sql.SQL("{} {}").format(sql.Identifier(c), sql.SQL(t)) for c, t in column_types.items()
+        )))
+
+        for batch in batches:
+            buffer = batch_to_csv(batch)
+            cur.execute("SAVEPOINT batch")
+            try:
+                cur.copy_expert(copy_query, buffer)
+            except (errors.InvalidTextRepresentation, errors.NumericValueOutOfRange, errors.InvalidDatetimeFormat,
+                    errors.DatetimeFieldOverflow):
+                cur.execute("ROLLBACK TO SAVEPOINT batch")
+                widen_to_text(cur, schema, table_name, column_types)
+                widened = True
+                buffer.seek(0)
+                cur.copy_expert(copy_query, buffer)
+            cur.execute("RELEASE SAVEPOINT batch")
+            rows += batch.num_rows
+            count += 1
+    conn.commit()
+    return rows, count, widened
+
+
+def load_file(conn, file_path, schema, table_name):
+    """
+    Replaces schema.table_name with the contents of a CSV (plain, .gz or .zip), Parquet,
+    JSON/NDJSON or xlsx file. Returns a dict with rows, batches, bytes, seconds and widened.
+    """
+    started = time.perf_counter()
+    arrow_schema, batches = read_batches(file_path)
+    try:
+        rows, count, widened = copy_batches(conn, schema, table_name, arrow_schema, batches)
+    except pa.ArrowInvalid:
+        # An NDJSON line with a field or type the first block did not have: start over with text
+        if data_format(file_path) != "ndjson":
+            raise
+        conn.rollback()
+        arrow_schema, batches = read_ndjson_as_text(file_path)
+        rows, count, _ = copy_batches(conn, schema, table_name, arrow_schema, batches)
+        widened = True
+    return {
+        "rows": rows,
+        "batches": count,
+        "bytes": os.path.getsize(file_path),
+        "seconds": time.perf_counter() - started,
+        "widened": widened,
+    }
+
+
 def ingest_file(file_path: str, schema: str = 'staging') -> str:
     """
-    Ingests a CSV file into the PostgreSQL database.
-    Infers schema from the CSV file.
+    Ingests a data file into the PostgreSQL database: CSV (also .csv.gz or zipped), Parquet,
+    JSON/NDJSON or xlsx. Infers the table schema from the file and loads it in batches with COPY.
     """
     if not os.path.exists(file_path):
         return f"Error: File {file_path} not found."
 
+    conn = None
     try:
         # Load environment variables (usually done at app startup, but safe here)
         from utils.ingestion_utils import load_env
         load_env()
-        
-        # Get DB connection string for SQLAlchemy
-        DB_HOST = os.getenv("DB_HOST", "localhost")
-        DB_NAME = os.getenv("POSTGRES_DB", "jimwurst_db")
-        DB_USER = os.getenv("POSTGRES_USER", "jimwurst_user")
-        DB_PASS = os.getenv("POSTGRES_PASSWORD", "jimwurst_password")
-        DB_PORT = os.getenv("DB_PORT", "5432")
-        
-        db_string = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-        engine = create_engine(db_string)
-
-        # Read CSV
-        df = pd.read_csv(file_path)
-        
-        # Sanitize columns
-        df.columns = [clean_header(c) for c in df.columns]
-        
-        # Sanitize table name
+
         filename = os.path.basename(file_path)
-        table_name = sanitize_table_name(filename)
-        
-        # Ensure schema exists using raw connection
-        with get_db_connection() as conn:
-             ensure_schema(conn, schema)
-        
-        # Write to DB
-        df.to_sql(table_name, engine, schema=schema, if_exists='replace', index=False)
-        
-        return f"Successfully ingested {filename} into {schema}.{table_name} with {len(df)} rows."
+        table_name = table_name_for(file_path)
+
+        conn = get_db_connection()
+        ensure_schema(conn, schema)
+        result = load_file(conn, file_path, schema, table_name)
+
+        seconds = result["seconds"]
+        rows_per_second = result["rows"] / seconds if seconds else 0
+        mb_per_second = result["bytes"] / (1024 * 1024) / seconds if seconds else 0
+        message = (f"Successfully ingested {filename} into {schema}.{table_name} with {result['rows']} rows "
+                   f"in {seconds:.1f}s ({rows_per_second:,.0f} rows/s, {mb_per_second:.1f} MB/s).")
+        if result["widened"]:
+            message += " Some values did not match the types inferred from the first rows, so all columns were loaded as text."
+        return message
 
     except Exception as e:
+        if conn is not None:
+            conn.rollback()
         return f"Error during ingestion: {str(e)}"
+    finally:
+        if conn is not None:
+            conn.close()
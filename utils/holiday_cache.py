@@ -0,0 +1,105 @@
+"""
+Cache of the public holidays computed by the holidays library (jimwurst holidays).
+
+Holidays are stored per (country, subdivision, year) in
+LOCAL_DATA_PATH/.cache/public_holidays/holidays.json, so a wider year range or a new country
+only computes what is missing. Each entry is what holidays.country_holidays() returns for that
+single year, which adds up to what it returns for the whole range. The cache belongs to one
+version of the library (its rules and names change between releases) and is started afresh
+after an upgrade.
+
+The missing (country, subdivision) pairs are computed in a process pool; compute_years() lives
+here rather than in the job so that workers started with spawn (macOS) can import it.
+"""
+
+import os
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+from utils.ingestion_utils import get_local_data_path
+
+
+def holidays_version():
+    import holidays
+    return holidays.__version__
+
+
+def compute_years(country, subdiv, years):
+    """
+    (country, subdiv, {year: [[date, name], ...]}) for the given years, or
+    (country, subdiv, error) if the library cannot compute them.
+    """
+    import holidays
+
+    try:
+        return country, subdiv, {
+            str(year): sorted([d.isoformat(), name]
+                              for d, name in holidays.country_holidays(country, subdiv=subdiv, years=year).items())
+            for year in years
+        }
+    except Exception as e:
+        return country, subdiv, e
+
+
+def _key(country, subdiv):
+    return f"{country}/{subdiv or ''}"
+
+
+class HolidayCache:
+    """Holidays per (country, subdivision, year), computed once per version of the holidays library."""
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(get_local_data_path(), ".cache", "public_holidays", "holidays.json")
+        self.version = holidays_version()
+        self.entries = {}
+        try:
+            with open(self.path) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            cached = {}
+        if cached.get("holidays_version") == self.version:
+            self.entries = cached.get("entries", {})
+        elif cached:
+            print(f"Holiday cache is from holidays {cached.get('holidays_version')}, recomputing for {self.version}.")
+
+    def missing_years(self, country, subdiv, years):
+        cached = self.entries.get(_key(country, subdiv), {})
+        return [year for year in years if str(year) not in cached]
+
+    def fill(self, tasks, workers=None):
+        """
+        Computes the missing years of each (country, subdiv, years) task, in a process pool.
+        Returns the {(country, subdiv): error} of the ones the library could not compute.
+        """
+        workers = workers or os.cpu_count() or 1
+        tasks = [(country, subdiv, years) for country, subdiv, years in tasks if years]
+        if not tasks:
+            return {}
+        print(f"Computing {sum(len(years) for _, _, years in tasks)} country-years "
+              f"({len(tasks)} countries and subdivisions) on {min(workers, len(tasks))} processes...")
+        if workers == 1:
+            results = [compute_years(*task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(compute_years, *zip(*tasks), chunksize=max(1, len(tasks) // (workers * 4))))
+
+        errors = {}
+        for country, subdiv, result in results:
+            if isinstance(result, Exception):
+                errors[(country, subdiv)] = result
+            else:
+                self.entries.setdefault(_key(country, subdiv), {}).update(result)
+        self.save()
+        return errors
+
+    def holidays(self, country, subdiv, years):
+        """{date: name} of a country or subdivision over the years (all of them in the cache)."""
+        cached = self.entries.get(_key(country, subdiv), {})
+        return {d: name for year in years for d, name in cached.get(str(year), [])}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"holidays_version": self.version, "entries": self.entries}, f, ensure_ascii=False, sort_keys=True)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,263 @@
+"""
+Parquet cache of what the manual ingestion jobs loaded (--cache).
+
+After a successful run, the tables of the source's schema are saved under
+LOCAL_DATA_PATH/.cache/<source>/<key>/ as Parquet, with their column definitions, constraints
+and indexes in manifest.json. The key is a hash of the input files, so the next --cache run
+on the same export (with the same INGEST_FILTERS) skips parsing and COPYs the Parquet files back into Postgres (after a
+rebuilt Postgres volume, a schema tweak, ...). A changed export gets a new key and is parsed.
+
+Values are stored in their Postgres text form, which round-trips every column type
+(timestamps, JSONB, ...) exactly, including what a job derives while loading (e.g. the
+Substack event keys).
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from psycopg2 import sql
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+from utils.ingestion_utils import get_local_data_path
+from utils.export_files import archive_of
+from utils.ingestion_filters import load_filters
+from utils.generic_ingestor import batch_to_csv
+from utils.source_changes import mark_changed
+
+# Bump when the layout of the cache changes, so that old entries are not read
+CACHE_VERSION = 1
+HASH_BLOCK_BYTES = 8 * 1024 * 1024
+BATCH_ROWS = 100_000
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_BYTES), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ExportCache:
+    """Parquet cache of one source's tables, keyed by the hash of its input files."""
+
+    def __init__(self, source, schema, input_files, root=None):
+        """
+        input_files are named in the key by their path relative to root (for sources that store
+        folder names in their tables, such as Substack), or by their file name without one.
+        Members of a .zip archive (see utils/export_files.py) are keyed by the whole archive.
+        """
+        self.source = source
+        self.schema = schema
+        self.input_files = sorted({os.path.abspath(archive_of(f)) for f in input_files})
+        self.root = root
+        self.source_dir = os.path.join(get_local_data_path(), ".cache", source)
+        self._key = None
+
+    def _name(self, path):
+        return os.path.relpath(path, self.root) if self.root else os.path.basename(path)
+
+    @property
+    def key(self):
+        """
+        Hash of the names and contents of the input files (a moved export keeps its key), and
+        of the source's filters if it has any.
+        """
+        if self._key is None:
+            hashes = self._file_hashes()
+            digest = hashlib.sha256(f"v{CACHE_VERSION}\n".encode())
+            for path in self.input_files:
+                digest.update(f"{self._name(path)}:{hashes[path]}\n".encode())
+            # A filtered load is cached apart from the full export (see utils/ingestion_filters.py)
+            filters = load_filters(self.source).fingerprint()
+            if filters is not None:
+                digest.update(f"filters:{filters}\n".encode())
+            self._key = digest.hexdigest()[:32]
+        return self._key
+
+    def _file_hashes(self):
+        """
+        SHA-256 of each input file. Hashes are remembered by size and mtime in hashes.json,
+        so an unchanged multi-GB export is not read again just to find its key.
+        """
+        memo_path = os.path.join(self.source_dir, "hashes.json")
+        try:
+            with open(memo_path) as f:
+                memo = json.load(f)
+        except (OSError, ValueError):
+            memo = {}
+
+        hashes = {}
+        for path in self.input_files:
+            stat = os.stat(path)
+            entry = memo.get(path)
+            if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+                hashes[path] = entry[2]
+            else:
+                hashes[path] = file_sha256(path)
+                memo[path] = [stat.st_size, stat.st_mtime_ns, hashes[path]]
+
+        os.makedirs(self.source_dir, exist_ok=True)
+        with open(memo_path, "w") as f:
+            json.dump(memo, f)
+        return hashes
+
+    @property
+    def directory(self):
+        return os.path.join(self.source_dir, self.key)
+
+    def manifest(self):
+        """The manifest of a complete cache entry for the current input, or None."""
+        try:
+            with open(os.path.join(self.directory, "manifest.json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def load(self, conn, metrics=None):
+        """
+        Replaces the cached tables with their cached contents, in one transaction.
+        Returns False (and loads nothing) when there is no cache entry for the current input.
+        """
+        manifest = self.manifest()
+        if manifest is None:
+            return False
+
+        print(f"Loading {self.source} from cache {self.directory} (saved {manifest['created_at']})...")
+        with conn.cursor() as cur, (metrics.stage("write") if metrics is not None else nullcontext()):
+            for table in manifest["tables"]:
+                identifier = sql.SQL("{}.{}").format(sql.Identifier(self.schema), sql.Identifier(table["name"]))
+                cur.execute(sql.SQL("DROP TABLE IF EXISTS {} CASCADE").format(identifier))
+                cur.execute(sql.SQL("CREATE TABLE {} ({})").format(identifier, sql.SQL(", ").join(
+                    sql.SQL("{} {}{}").format(sql.Identifier(name), sql.SQL(column_type),
+                                              sql.SQL(" NOT NULL" if not_null else ""))
+                    for name, column_type, not_null in table["columns"]
+                )))
+                copy_query = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv)").format(
+                    identifier, sql.SQL(", ").join(sql.Identifier(name) for name, _, _ in table["columns"])
+                ).as_string(conn)
+
+                parquet_path = os.path.join(self.directory, table["file"])
+                if metrics is not None:
+                    metrics.add_file(parquet_path)
+                for batch in pq.ParquetFile(parquet_path).iter_batches(batch_size=BATCH_ROWS):
+                    cur.copy_expert(copy_query, batch_to_csv(batch))
+
+                # Constraints and indexes after the data, which is faster than maintaining them row by row
+                for constraint_name, definition in table["constraints"]:
+                    cur.execute(sql.SQL("ALTER TABLE {} ADD CONSTRAINT {} {}").format(
+                        identifier, sql.Identifier(constraint_name), sql.SQL(definition)
+                    ))
+                for definition in table["indexes"]:
+                    cur.execute(definition)
+                print(f"  {self.schema}.{table['name']}: {table['rows']:,} rows")
+        conn.commit()
+        for table in manifest["tables"]:
+            mark_changed(self.schema, table["name"])
+        if metrics is not None:
+            metrics.add_commit(sum(table["rows"] for table in manifest["tables"]))
+        return True
+
+    def save(self, conn):
+        """Saves every table of the schema as it is now, for the current input files."""
+        target = self.directory
+        staging = tempfile.mkdtemp(prefix=f".{self.key}-", dir=self.source_dir)
+        os.chmod(staging, 0o755)
+        try:
+            tables = [self._save_table(conn, name, staging) for name in self._table_names(conn)]
+            manifest = {
+                "source": self.source,
+                "schema": self.schema,
+                "key": self.key,
+                "version": CACHE_VERSION,
+                "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "input_files": [self._name(f) for f in self.input_files],
+                "tables": tables,
+            }
+            with open(os.path.join(staging, "manifest.json"), "w") as f:
+                json.dump(manifest, f, indent=2)
+            # Swap the finished entry in, and drop the entries of older exports
+            shutil.rmtree(target, ignore_errors=True)
+            os.rename(staging, target)
+            for entry in os.listdir(self.source_dir):
+                path = os.path.join(self.source_dir, entry)
+                if os.path.isdir(path) and entry != self.key:
+                    shutil.rmtree(path, ignore_errors=True)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        print(f"Cached {len(tables)} table(s) of {self.schema} in {target}")
+
+    def _table_names(self, conn):
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT table_name FROM information_schema.tables
+                WHERE table_schema = %s AND table_type = 'BASE TABLE'
+                ORDER BY table_name
+            """, (self.schema,))
+            return [row[0] for row in cur.fetchall()]
+
+    def _save_table(self, conn, name, staging):
+        identifier = sql.SQL("{}.{}").format(sql.Identifier(self.schema), sql.Identifier(name))
+        qualified = identifier.as_string(conn)
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT attname, format_type(atttypid, atttypmod), attnotnull
+                FROM pg_attribute
+                WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped
+                ORDER BY attnum
+            """, (qualified,))
+            columns = cur.fetchall()
+            cur.execute("""
+                SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+                WHERE conrelid = %s::regclass AND contype IN ('p', 'u', 'c', 'x')
+                ORDER BY conname
+            """, (qualified,))
+            constraints = cur.fetchall()
+            cur.execute("""
+                SELECT pg_get_indexdef(i.indexrelid) FROM pg_index i
+                WHERE i.indrelid = %s::regclass
+                  AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = i.indexrelid)
+                ORDER BY i.indexrelid
+            """, (qualified,))
+            indexes = [row[0] for row in cur.fetchall()]
+
+            # Stream the table out as CSV, then convert it to Parquet with every column as text
+            csv_path = os.path.join(staging, f"{name}.csv")
+            with open(csv_path, "wb") as f:
+                cur.copy_expert(sql.SQL("COPY {} TO STDOUT WITH (FORMAT csv)").format(identifier).as_string(conn), f)
+        conn.commit()
+
+        column_names = [column[0] for column in columns]
+        text_schema = pa.schema([(column, pa.string()) for column in column_names])
+        reader = pa_csv.open_csv(
+            csv_path,
+            read_options=pa_csv.ReadOptions(column_names=column_names),
+            parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+            # COPY writes NULL as an unquoted empty field and '' as ""; text such as "NA" stays text
+            convert_options=pa_csv.ConvertOptions(
+                column_types=text_schema, null_values=[""], strings_can_be_null=True, quoted_strings_can_be_null=False
+            ),
+        )
+        file_name = f"{name}.parquet"
+        rows = 0
+        with pq.ParquetWriter(os.path.join(staging, file_name), text_schema, compression="zstd") as writer:
+            for batch in reader:
+                writer.write_batch(batch)
+                rows += batch.num_rows
+        os.remove(csv_path)
+
+        return {
+            "name": name,
+            "file": file_name,
+            "rows": rows,
+            "columns": columns,
+            "constraints": constraints,
+            "indexes": indexes,
+        }
@@ -0,0 +1,233 @@
+"""
+Per-source include/exclude filters, applied while an export is read (INGEST_FILTERS).
+
+The dashboards use a handful of Apple Health types and a few Spotify and Telegram fields, but
+every record of an export is parsed, converted and loaded. A YAML file (by default
+LOCAL_DATA_PATH/ingest_filters.yml, see apps/data_ingestion/manual_job/ingest_filters.example.yml)
+narrows that down per source:
+
+    apple_health:
+      include:
+        records:
+          type: [HKQuantityTypeIdentifierStepCount, HKCategoryTypeIdentifierSleepAnalysis]
+      dates: {column: start_date, since: 2022-01-01}
+    spotify:
+      include:
+        files: ["StreamingHistory*.json", "Streaming_History_Audio_*.json"]
+      exclude:
+        columns: [ip_addr*, user_agent_decrypted]
+
+include and exclude take any of
+    files    globs on the path relative to the source's data folder (members of a .zip export
+             included, e.g. my_spotify_data.zip/Spotify Account Data/StreamingHistory0.json);
+             a glob without a / also matches the file name alone
+    columns  globs on the column names of the tables
+    records  column: [globs]; a record is kept if its value matches one of them (include), or
+             dropped if it does (exclude)
+and dates keeps the records of a column whose value starts with a date (YYYY-MM-DD...) from
+since to until, both inclusive; a list of columns uses the first one a table has.
+
+Column names are those of the table in Postgres (after the header clean-up), and a name may
+be given as table.column to apply to one table only. A filter on a column a table does not
+have does not apply to that table. Records are dropped before they are converted, and columns
+before anything is written; positions in the checkpoints still count the records read, so a
+filtered run resumes like any other. Files and tables a filter touches are always streamed
+(no --server-copy or parallel COPY), and --cache entries are keyed by the filters too.
+"""
+
+import os
+import sys
+import json
+import hashlib
+from fnmatch import fnmatchcase
+
+from utils.ingestion_utils import get_local_data_path
+
+SECTIONS = ("include", "exclude", "dates")
+KINDS = ("files", "columns", "records")
+
+_loaded = {}
+
+
+def filters_path():
+    """The filter file (INGEST_FILTERS, set it empty to load everything), or None."""
+    path = os.getenv("INGEST_FILTERS")
+    if path is None:
+        path = os.path.join(get_local_data_path(), "ingest_filters.yml")
+    return os.path.expanduser(path) if path else None
+
+
+def load_filters(source):
+    """The SourceFilter of a source, read once per process from the filter file."""
+    if source not in _loaded:
+        path = filters_path()
+        config = {}
+        if path and os.path.exists(path):
+            import yaml
+            with open(path) as f:
+                config = (yaml.safe_load(f) or {}).get(source) or {}
+        _loaded[source] = SourceFilter(source, config)
+        if _loaded[source].active:
+            print(f"Filtering {source} with {path}")
+    return _loaded[source]
+
+
+def _error(source, message):
+    print(f"Error in the {source} filters: {message}")
+    sys.exit(2)
+
+
+def _matches(value, patterns):
+    value = "" if value is None else str(value)
+    return any(fnmatchcase(value, str(p)) for p in patterns)
+
+
+def _value(item, key):
+    """A field of a record: a list row by index, or a dict (attributes, JSON) by key."""
+    if isinstance(key, int):
+        return item[key] if key < len(item) else None
+    return item.get(key)
+
+
+class SourceFilter:
+    """The include/exclude filters of one source (an empty config lets everything through)."""
+
+    def __init__(self, source, config):
+        if not isinstance(config, dict) or set(config) - set(SECTIONS):
+            _error(source, f"expected a mapping of {', '.join(SECTIONS)}")
+        self.source = source
+        self.config = config
+        self.include = self._section("include")
+        self.exclude = self._section("exclude")
+        dates = config.get("dates") or {}
+        if dates and ("column" not in dates or set(dates) - {"column", "since", "until"}):
+            _error(source, "dates takes a column and since and/or until")
+        self.date_columns = dates.get("column") or []
+        if isinstance(self.date_columns, str):
+            self.date_columns = [self.date_columns]
+        self.since = str(dates["since"]) if dates.get("since") is not None else None
+        self.until = str(dates["until"]) if dates.get("until") is not None else None
+
+    def _section(self, name):
+        section = self.config.get(name) or {}
+        if not isinstance(section, dict) or set(section) - set(KINDS):
+            _error(self.source, f"{name} takes {', '.join(KINDS)}")
+        if not isinstance(section.get("records") or {}, dict):
+            _error(self.source, f"{name}.records maps columns to lists of values")
+        return section
+
+    @property
+    def active(self):
+        return bool(self.include or self.exclude or self.date_columns)
+
+    def fingerprint(self):
+        """Hash of the filters, part of the --cache key of a filtered export (None without filters)."""
+        if not self.active:
+            return None
+        return hashlib.sha256(json.dumps(self.config, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+    def wants_file(self, path, root):
+        """True if the file (a path under the data folder root) is to be loaded."""
+        name = os.path.relpath(path, root).replace(os.sep, "/")
+        names = [name] if "/" not in name else [name, name.rsplit("/", 1)[1]]
+
+        def matches(patterns):
+            return any(fnmatchcase(n, p) for p in patterns for n in (names if "/" not in p else [name]))
+
+        include = self.include.get("files")
+        if include and not matches(include):
+            return False
+        return not matches(self.exclude.get("files") or [])
+
+    def _applies(self, pattern, table, column):
+        if "." in pattern:
+            return fnmatchcase(f"{table}.{column}", pattern)
+        return fnmatchcase(column, pattern)
+
+    def _column(self, table, columns, name):
+        """The first of columns the table.column (or column) name applies to, or None."""
+        return next((c for c in columns if self._applies(name, table, c)), None)
+
+    def kept_columns(self, table, columns):
+        """Indexes of the columns of a table to load, or None to load them all."""
+        include = self.include.get("columns")
+        exclude = self.exclude.get("columns") or []
+        kept = [
+            i for i, column in enumerate(columns)
+            if (not include or any(self._applies(p, table, column) for p in include))
+            and not any(self._applies(p, table, column) for p in exclude)
+        ]
+        if len(kept) == len(columns):
+            return None
+        if not kept:
+            _error(self.source, f"no column of {table} is left")
+        return kept
+
+    def filtered_table(self, table):
+        """(table, indexes): a Table with the kept columns only, and kept_columns() of it."""
+        from utils.ingestion_sinks import Table
+
+        kept = self.kept_columns(table.name, table.column_names)
+        if kept is None:
+            return table, None
+        columns = [table.columns[i] for i in kept]
+        names = [c for c, _ in columns]
+        # Keys on a dropped column are dropped with it
+        return Table(table.schema, table.name, columns,
+                     *(key if key in names else None
+                       for key in (table.primary_key, table.unique_key, table.newer_column))), kept
+
+    def record_filter(self, table, fields):
+        """
+        A function telling whether to keep a record of table, or None if all are kept.
+        fields maps the table's columns to where a record holds them (a list of column names
+        stands for rows in that order); the record can be a list or a dict.
+        """
+        if isinstance(fields, (list, tuple)):
+            fields = {column: i for i, column in enumerate(fields)}
+        checks = []
+        for section, keep in ((self.include, True), (self.exclude, False)):
+            for name, patterns in (section.get("records") or {}).items():
+                column = self._column(table, fields, name)
+                if column is not None:
+                    patterns = patterns if isinstance(patterns, list) else [patterns]
+                    checks.append((fields[column], patterns, keep))
+        date_key = next((fields[c] for c in (self._column(table, fields, d) for d in self.date_columns)
+                         if c is not None), None)
+        if not checks and date_key is None:
+            return None
+        since, until = self.since, self.until
+
+        def keep_record(record):
+            for key, patterns, keep in checks:
+                if _matches(_value(record, key), patterns) != keep:
+                    return False
+            if date_key is not None:
+                day = str(_value(record, date_key) or "")[:10]
+                if len(day) < 10 or (since and day < since) or (until and day > until):
+                    return False
+            return True
+
+        return keep_record
+
+    def reads_only(self, table, columns):
+        """
+        True if the record filters of table find every column they read among columns: each
+        records column (but those of other tables) and, with dates, one of its columns.
+        """
+        for section in (self.include, self.exclude):
+            for name in section.get("records") or {}:
+                if "." in name and not fnmatchcase(table, name.split(".", 1)[0]):
+                    continue
+                if self._column(table, columns, name) is None:
+                    return False
+        return not self.date_columns or any(self._column(table, columns, d) is not None for d in self.date_columns)
+
+    def filters(self, table, columns):
+        """True if any record or column of the table (with these columns) would be dropped."""
+        return self.kept_columns(table, columns) is not None or self.record_filter(table, columns) is not None
+
+
+def project(row, indexes):
+    """The values of a row at indexes (kept_columns), or the row itself for None."""
+    return row if indexes is None else [row[i] for i in indexes]
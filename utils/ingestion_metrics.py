@@ -0,0 +1,314 @@
+"""
+Per-run metrics for the manual ingestion jobs.
+
+Every run is stored in meta.ingestion_runs (source, files, rows, bytes, wall time,
+peak RSS, commits) with its time split by stage in meta.ingestion_stage_metrics:
+
+- parse: reading and parsing the export (XML/JSON/CSV)
+- transform: turning parsed records into rows
+- write: INSERTs and commits
+
+Jobs that parse on a producer thread (see utils/ingestion_pipeline.py) also record how long
+each side waited on the queue between them, as queue_full (parsing waited for the writes)
+and queue_empty (the writes waited for parsing), and how full the queue was on average.
+Parsing then runs alongside the other stages, so the stages can add up to more than the wall time.
+
+The tables a run created or wrote to go to meta.source_changes, for `jimwurst transform` to
+build only what depends on them (see utils/source_changes.py).
+"""
+
+import os
+import sys
+import time
+import resource
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from psycopg2 import sql
+
+from utils.ingestion_utils import ensure_schema, META_SCHEMA
+from utils.export_files import file_size
+from utils.source_changes import pop_changed, record_changes
+
+STAGES = ("parse", "transform", "write")
+
+# Set by `jimwurst ingest` when it runs several sources at once: a pipe to report loaded rows on
+PROGRESS_FD_ENV = "JIMWURST_PROGRESS_FD"
+PROGRESS_INTERVAL_SECONDS = 0.5
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+class RunMetrics:
+    """
+    Collects metrics for one ingestion run.
+
+    Stage timings are exclusive: time spent in a nested stage (e.g. write inside
+    transform) only counts for the inner stage, so the stages add up to the time
+    spent in instrumented code.
+    """
+
+    def __init__(self, source, profile_dir=None):
+        self.source = source
+        self.profile_dir = profile_dir
+        self.started_at = datetime.now(timezone.utc)
+        self._started = time.perf_counter()
+        self.stage_seconds = {stage: 0.0 for stage in STAGES}
+        self.stage_calls = {stage: 0 for stage in STAGES}
+        self.files = 0
+        self.rows = 0
+        self.bytes = 0
+        self.commits = 0
+        self.queue_samples = 0
+        self.queue_chunks_total = 0
+        self.queue_peak_bytes = 0
+        self._stack = []  # [stage, time spent in nested stages]
+        self.current_stage = None  # read by the profiler's sampler
+        progress_fd = os.getenv(PROGRESS_FD_ENV)
+        self._progress = os.fdopen(int(progress_fd), "w") if progress_fd else None
+        self._progress_reported_at = 0.0
+
+    def _add(self, stage, seconds):
+        self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + seconds
+        self.stage_calls[stage] = self.stage_calls.get(stage, 0) + 1
+
+    @contextmanager
+    def stage(self, name):
+        """Times a block of work as one stage."""
+        frame = [name, 0.0]
+        self._stack.append(frame)
+        outer, self.current_stage = self.current_stage, name
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.current_stage = outer
+            self._stack.pop()
+            self._add(name, elapsed - frame[1])
+            if self._stack:
+                self._stack[-1][1] += elapsed
+
+    def timed_iter(self, iterable, stage="parse"):
+        """Yields from iterable, counting the time spent producing items as stage."""
+        clock = time.perf_counter
+        iterator = iter(iterable)
+        total = 0.0
+        try:
+            while True:
+                outer, self.current_stage = self.current_stage, stage
+                started = clock()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    total += clock() - started
+                    self.current_stage = outer
+                yield item
+        finally:
+            self._add(stage, total)
+            if self._stack:
+                self._stack[-1][1] += total
+
+    def add_stage_time(self, stage, seconds):
+        """Counts time spent in a stage outside of stage() and timed_iter(), e.g. on another thread."""
+        self._add(stage, seconds)
+
+    def add_queue_wait(self, side, seconds):
+        """
+        Counts a wait on the pipeline queue: "full" (the producer waited for room) or
+        "empty" (the consumer waited for items, which does not count for its current stage).
+        """
+        self._add(f"queue_{side}", seconds)
+        if side == "empty" and self._stack:
+            self._stack[-1][1] += seconds
+
+    def sample_queue_depth(self, chunks, size):
+        """Records the chunks (and bytes) waiting in the pipeline queue as the consumer takes one."""
+        self.queue_samples += 1
+        self.queue_chunks_total += chunks
+        self.queue_peak_bytes = max(self.queue_peak_bytes, size)
+
+    def queue_depth_avg(self):
+        return self.queue_chunks_total / self.queue_samples if self.queue_samples else None
+
+    def queue_summary(self):
+        """e.g. "queue 14.2 chunks (peak 61 MB), parse waited 12.0s, write waited 0.1s: write-bound"."""
+        full = self.stage_seconds.get("queue_full", 0.0)
+        empty = self.stage_seconds.get("queue_empty", 0.0)
+        bottleneck = "write-bound" if full > empty else "parse-bound" if empty > full else "balanced"
+        return (f"queue {self.queue_depth_avg():.1f} chunks (peak {self.queue_peak_bytes / 1024 / 1024:.0f} MB), "
+                f"parse waited {full:.1f}s, write waited {empty:.1f}s: {bottleneck}")
+
+    @contextmanager
+    def track(self, conn):
+        """
+        Records the run when the block exits, with status 'failed' if it raised.
+        With a profile_dir, the block is also profiled (see utils/ingestion_profiler.py).
+        """
+        profiler = None
+        if self.profile_dir is not None:
+            from utils.ingestion_profiler import Profiler
+            profiler = Profiler(self, self.profile_dir or None)
+            profiler.start()
+        try:
+            yield self
+        except BaseException:
+            self.record(conn, status="failed")
+            raise
+        finally:
+            if profiler is not None:
+                profiler.stop()
+        self.record(conn)
+
+    def add_commit(self, rows):
+        """Counts a committed batch of rows."""
+        self.rows += rows
+        self.commits += 1
+        if self._progress is not None and time.perf_counter() - self._progress_reported_at >= PROGRESS_INTERVAL_SECONDS:
+            self.report_progress()
+
+    def report_progress(self):
+        """Writes the rows loaded so far to the progress pipe, as one line."""
+        self._progress_reported_at = time.perf_counter()
+        try:
+            self._progress.write(f"{self.rows}\n")
+            self._progress.flush()
+        except OSError:
+            # The CLI went away; the run itself can still finish
+            self._progress = None
+
+    def add_file(self, path):
+        """Counts an input file and its size (uncompressed, for a member of a .zip archive)."""
+        self.files += 1
+        self.bytes += file_size(path)
+
+    def wall_seconds(self):
+        return time.perf_counter() - self._started
+
+    def summary(self):
+        wall = self.wall_seconds()
+        parts = ", ".join(f"{stage} {self.stage_seconds[stage]:.1f}s" for stage in STAGES)
+        rate = self.rows / wall if wall else 0
+        if self.queue_samples:
+            parts += f"; {self.queue_summary()}"
+        return (f"{self.rows:,} rows from {self.files} file(s) in {wall:.1f}s ({rate:,.0f} rows/s; {parts}; "
+                f"{self.commits} commits; peak RSS {peak_rss_mb():.0f} MB)")
+
+    def record(self, conn, status="success"):
+        """Writes the run and its stage metrics to the meta schema (without a connection, only prints them)."""
+        wall = self.wall_seconds()
+        if conn is None:
+            if self._progress is not None:
+                self.report_progress()
+            print(f"Run metrics: {self.summary()}")
+            return None
+        if conn.closed:
+            return
+        conn.rollback()  # in case the run failed mid-transaction
+        ensure_meta_tables(conn)
+        with conn.cursor() as cur:
+            cur.execute(sql.SQL("""
+                INSERT INTO {}.ingestion_runs
+                    (source, status, started_at, finished_at, files, rows, bytes, wall_seconds, peak_rss_mb, commits,
+                 queue_depth_avg, queue_peak_mb)
+                VALUES (%s, %s, %s, now(), %s, %s, %s, %s, %s, %s, %s, %s)
+                RETURNING run_id
+            """).format(sql.Identifier(META_SCHEMA)), (
+                self.source, status, self.started_at, self.files, self.rows, self.bytes,
+                wall, peak_rss_mb(), self.commits,
+                self.queue_depth_avg(), self.queue_peak_bytes / 1024 / 1024 if self.queue_samples else None
+            ))
+            run_id = cur.fetchone()[0]
+            cur.executemany(sql.SQL("""
+                INSERT INTO {}.ingestion_stage_metrics (run_id, stage, seconds, calls)
+                VALUES (%s, %s, %s, %s)
+            """).format(sql.Identifier(META_SCHEMA)), [
+                (run_id, stage, seconds, self.stage_calls.get(stage, 0))
+                for stage, seconds in self.stage_seconds.items()
+            ])
+            # A failed run may have changed tables as well
+            record_changes(cur, pop_changed(), run_id)
+        conn.commit()
+        if self._progress is not None:
+            self.report_progress()
+        print(f"Run metrics: {self.summary()}")
+        return run_id
+
+
+def ensure_meta_tables(conn):
+    """Creates meta.ingestion_runs, meta.ingestion_stage_metrics and meta.source_changes if needed."""
+    ensure_schema(conn, META_SCHEMA)
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL("""
+            CREATE TABLE IF NOT EXISTS {schema}.ingestion_runs (
+                run_id BIGSERIAL PRIMARY KEY,
+                source TEXT NOT NULL,
+                status TEXT NOT NULL,
+                started_at TIMESTAMPTZ NOT NULL,
+                finished_at TIMESTAMPTZ NOT NULL,
+                files INTEGER,
+                rows BIGINT,
+                bytes BIGINT,
+                wall_seconds DOUBLE PRECISION,
+                peak_rss_mb DOUBLE PRECISION,
+                commits INTEGER
+            );
+            ALTER TABLE {schema}.ingestion_runs
+                ADD COLUMN IF NOT EXISTS queue_depth_avg DOUBLE PRECISION,
+                ADD COLUMN IF NOT EXISTS queue_peak_mb DOUBLE PRECISION;
+            CREATE INDEX IF NOT EXISTS ingestion_runs_source_started_idx
+                ON {schema}.ingestion_runs (source, started_at DESC);
+            CREATE TABLE IF NOT EXISTS {schema}.ingestion_stage_metrics (
+                run_id BIGINT NOT NULL REFERENCES {schema}.ingestion_runs (run_id) ON DELETE CASCADE,
+                stage TEXT NOT NULL,
+                seconds DOUBLE PRECISION NOT NULL,
+                calls BIGINT,
+                PRIMARY KEY (run_id, stage)
+            );
+            CREATE TABLE IF NOT EXISTS {schema}.source_changes (
+                change_id BIGSERIAL PRIMARY KEY,
+                run_id BIGINT REFERENCES {schema}.ingestion_runs (run_id) ON DELETE CASCADE,
+                table_schema TEXT NOT NULL,
+                table_name TEXT NOT NULL,
+                changed_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                built_at TIMESTAMPTZ
+            );
+            CREATE INDEX IF NOT EXISTS source_changes_pending_idx
+                ON {schema}.source_changes (table_schema, table_name) WHERE built_at IS NULL;
+        """).format(schema=sql.Identifier(META_SCHEMA)))
+    conn.commit()
+
+
+def historical_throughput(conn, source, unit="rows", last_runs=5):
+    """
+    Median rows/s (unit="rows") or bytes/s (unit="bytes") of the source's last successful runs.
+    Returns None when there is no history yet, so callers can fall back to a default.
+    """
+    if conn is None:
+        return None
+    column = sql.Identifier("rows" if unit == "rows" else "bytes")
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql.SQL("""
+                SELECT percentile_cont(0.5) WITHIN GROUP (ORDER BY {column} / wall_seconds)
+                FROM (
+                    SELECT {column}, wall_seconds
+                    FROM {schema}.ingestion_runs
+                    WHERE source = %s AND status = 'success' AND wall_seconds > 0 AND {column} > 0
+                    ORDER BY started_at DESC
+                    LIMIT %s
+                ) recent
+            """).format(column=column, schema=sql.Identifier(META_SCHEMA)), (source, last_runs))
+            value = cur.fetchone()[0]
+        conn.commit()
+        return value
+    except Exception:
+        # No meta tables yet (first run ever), or the database is unreachable
+        conn.rollback()
+        return None
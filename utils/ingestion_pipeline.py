@@ -0,0 +1,156 @@
+"""
+Parsing and database writes side by side (INGEST_PIPELINE, on by default).
+
+A job's loop parses a record, turns it into a row and every few thousand rows waits for
+Postgres to insert and commit the batch. While it waits nothing is parsed, and while it parses
+the database is idle. pipelined() runs the parsing in a producer thread that fills a bounded
+queue, and the loop consumes it:
+
+    for row in pipelined(reader, metrics):
+        ...
+        flush_batch(sink, table, batch, checkpoint, unit, metrics, row=count)
+
+The loop, and with it every database call, stays on its thread in the same order, so batches,
+checkpoints and commits work exactly as before. Parsed items travel in chunks of CHUNK_ITEMS,
+and the queue holds at most INGEST_QUEUE_MB of them (estimated from the first item of each
+chunk). When it is full the producer waits: parsing never gets further ahead of the database
+than that.
+
+A thread rather than a process: rows would have to be pickled back, which costs as much as
+parsing them (see utils/parallel_csv.py), and psycopg2 releases the GIL while it waits on the
+server, which is the time there is to overlap.
+
+How long either side waited, and how full the queue was, goes into the run metrics:
+a queue that is mostly full means the writes are the bottleneck, a mostly empty one parsing.
+"""
+
+import os
+import sys
+import time
+import threading
+from collections import deque
+from itertools import islice
+
+CHUNK_ITEMS = 1000
+QUEUE_BYTES = int(os.getenv("INGEST_QUEUE_MB", "64")) * 1024 * 1024
+
+_END = object()
+
+
+def pipeline_enabled():
+    return os.getenv("INGEST_PIPELINE", "1") != "0"
+
+
+def approx_size(item):
+    """Rough size in bytes of a parsed item: a value, or a tuple/list/dict of values."""
+    size = sys.getsizeof(item)
+    if isinstance(item, dict):
+        return size + sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in item.items())
+    if isinstance(item, (list, tuple)):
+        return size + sum(approx_size(v) for v in item)
+    return size
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+class BoundedQueue:
+    """Chunks in flight between the producer and the consumer, bounded by their total size."""
+
+    def __init__(self, max_bytes, metrics=None):
+        self.max_bytes = max_bytes
+        self.metrics = metrics
+        self.chunks = deque()
+        self.bytes = 0
+        self.stopped = False
+        self._changed = threading.Condition()
+
+    def put(self, chunk, size):
+        """Adds a chunk, waiting while the queue is full. Returns False once the consumer stopped."""
+        with self._changed:
+            if self.chunks and self.bytes + size > self.max_bytes and not self.stopped:
+                started = time.perf_counter()
+                # Backpressure: always room for one chunk, however large
+                self._changed.wait_for(lambda: not self.chunks or self.bytes + size <= self.max_bytes
+                                       or self.stopped)
+                if self.metrics is not None:
+                    self.metrics.add_queue_wait("full", time.perf_counter() - started)
+            if self.stopped:
+                return False
+            self.chunks.append((chunk, size))
+            self.bytes += size
+            self._changed.notify_all()
+            return True
+
+    def get(self):
+        """Takes the next chunk, waiting while the queue is empty."""
+        with self._changed:
+            if self.metrics is not None:
+                self.metrics.sample_queue_depth(len(self.chunks), self.bytes)
+            if not self.chunks:
+                started = time.perf_counter()
+                self._changed.wait_for(lambda: self.chunks)
+                if self.metrics is not None:
+                    self.metrics.add_queue_wait("empty", time.perf_counter() - started)
+            chunk, size = self.chunks.popleft()
+            self.bytes -= size
+            self._changed.notify_all()
+            return chunk
+
+    def stop(self):
+        with self._changed:
+            self.stopped = True
+            self._changed.notify_all()
+
+
+def _produce(iterable, queue, metrics):
+    """Producer thread: parses chunks of items into the queue, then _END (or the error it hit)."""
+    iterator = iter(iterable)
+    parse_seconds = 0.0
+    try:
+        while True:
+            started = time.perf_counter()
+            chunk = list(islice(iterator, CHUNK_ITEMS))
+            parse_seconds += time.perf_counter() - started
+            if not chunk or not queue.put(chunk, approx_size(chunk[0]) * len(chunk)):
+                break
+    except BaseException as e:
+        queue.put(_Failure(e), 0)
+    finally:
+        # A generator is closed on the thread that ran it (files it opened, ...)
+        if hasattr(iterator, "close"):
+            iterator.close()
+        if metrics is not None:
+            metrics.add_stage_time("parse", parse_seconds)
+    queue.put(_END, 0)
+
+
+def pipelined(iterable, metrics=None, max_bytes=None):
+    """
+    Yields the items of iterable, produced by a separate thread up to max_bytes
+    (INGEST_QUEUE_MB) ahead. Errors raised by the iterable are raised here.
+
+    With INGEST_PIPELINE=0, or in a profiled run (so that the profile sees the parsing),
+    the items are produced on this thread, timed as the parse stage.
+    """
+    if not pipeline_enabled() or (metrics is not None and metrics.profile_dir is not None):
+        yield from (iterable if metrics is None else metrics.timed_iter(iterable))
+        return
+
+    queue = BoundedQueue(max_bytes or QUEUE_BYTES, metrics)
+    producer = threading.Thread(target=_produce, args=(iterable, queue, metrics),
+                                name="ingestion-producer", daemon=True)
+    producer.start()
+    try:
+        while True:
+            chunk = queue.get()
+            if chunk is _END:
+                return
+            if isinstance(chunk, _Failure):
+                raise chunk.error
+            yield from chunk
+    finally:
+        queue.stop()
+        producer.join()
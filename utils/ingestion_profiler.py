@@ -0,0 +1,127 @@
+"""
+Profiling for the manual ingestion jobs (--profile).
+
+A profiled run writes two files to the profile directory:
+
+- <source>-<timestamp>.pstats: a cProfile dump of the whole run, for `python -m pstats`,
+  snakeviz, etc.
+- <source>-<timestamp>.folded: stacks of the main thread sampled every few milliseconds,
+  in the folded format of flamegraph.pl and speedscope. The first frame of every stack
+  is the ingestion stage (parse/transform/write) the run was in.
+
+At the end of the run, the hottest functions of each stage (by sampled self time) are
+printed and saved next to them as <source>-<timestamp>.txt.
+"""
+
+import io
+import os
+import sys
+import pstats
+import cProfile
+import threading
+from collections import Counter, defaultdict
+from datetime import datetime
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+DEFAULT_PROFILE_DIR = os.path.join(PROJECT_ROOT, "profiles")
+SAMPLE_INTERVAL_SECONDS = 0.005
+TOP_N = 15
+
+
+def frame_label(code):
+    """Flame graph label of a code object, e.g. 'parse_date (ingest.py:42)'."""
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler(threading.Thread):
+    """Samples the stack of one thread, tagging each sample with the current stage of a RunMetrics."""
+
+    def __init__(self, metrics, thread_id, interval=SAMPLE_INTERVAL_SECONDS):
+        super().__init__(name="ingestion-profiler", daemon=True)
+        self.metrics = metrics
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(frame_label(frame.f_code))
+                frame = frame.f_back
+            labels.append(self.metrics.current_stage or "other")
+            self.stacks[tuple(reversed(labels))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def hot_functions(self):
+        """{stage: [(label, self samples, total samples), ...]} sorted by self samples."""
+        own = defaultdict(Counter)
+        total = defaultdict(Counter)
+        for stack, count in self.stacks.items():
+            stage, frames = stack[0], stack[1:]
+            if frames:
+                own[stage][frames[-1]] += count
+            for label in set(frames):
+                total[stage][label] += count
+        return {
+            stage: [(label, samples, total[stage][label]) for label, samples in counter.most_common()]
+            for stage, counter in own.items()
+        }
+
+    def write_folded(self, path):
+        with open(path, "w") as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f"{';'.join(stack)} {count}\n")
+
+
+class Profiler:
+    """Runs cProfile and a StackSampler around an ingestion run."""
+
+    def __init__(self, metrics, output_dir=None, top_n=TOP_N):
+        self.metrics = metrics
+        self.output_dir = output_dir or DEFAULT_PROFILE_DIR
+        self.top_n = top_n
+        stamp = datetime.now().strftime("%Y%m%dT%H%M%S")
+        self.base_path = os.path.join(self.output_dir, f"{metrics.source}-{stamp}")
+        self.profile = cProfile.Profile()
+        self.sampler = StackSampler(metrics, threading.get_ident())
+
+    def start(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.sampler.start()
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+        self.sampler.stop()
+        self.profile.dump_stats(f"{self.base_path}.pstats")
+        self.sampler.write_folded(f"{self.base_path}.folded")
+        report = self.report()
+        with open(f"{self.base_path}.txt", "w") as f:
+            f.write(report)
+        print(report)
+        print(f"Profile written to {self.base_path}.pstats / .folded / .txt")
+
+    def report(self):
+        """Top-N functions per stage from the samples, then the cProfile top-N for the whole run."""
+        out = io.StringIO()
+        hot = self.sampler.hot_functions()
+        all_samples = sum(self.sampler.stacks.values()) or 1
+        for stage in sorted(hot, key=lambda s: -sum(n for _, n, _ in hot[s])):
+            stage_samples = sum(n for _, n, _ in hot[stage])
+            out.write(f"\n[{stage}] {stage_samples} samples ({stage_samples / all_samples:.0%} of the run)\n")
+            out.write(f"{'self':>7}{'total':>8}  function\n")
+            for label, own, total in hot[stage][:self.top_n]:
+                out.write(f"{own / stage_samples:>7.1%}{total / stage_samples:>8.1%}  {label}\n")
+
+        out.write(f"\n[cProfile] top {self.top_n} by internal time\n")
+        stats = pstats.Stats(self.profile, stream=out)
+        stats.sort_stats(pstats.SortKey.TIME).print_stats(self.top_n)
+        return out.getvalue()
@@ -0,0 +1,596 @@
+"""
+Output sinks for the manual ingestion jobs (--sink).
+
+- postgres (default): the warehouse, through psycopg2.
+- parquet: one directory of Parquet files per table, <path>/<schema>/<table>/.
+- duckdb, sqlite: an embedded database file. SQLite has no schemas, so s_bolt.rides is
+  the table s_bolt__rides there.
+
+The file sinks need no running Postgres, which makes for fast local runs and lets a
+benchmark time parsing apart from database writes. A job describes each table once as a
+Table and writes batches of rows through the sink. Rows are lists or tuples in the column
+order of the table as it was created, like a plain INSERT ... VALUES:
+
+    rides = Table(SCHEMA_NAME, "rides", [(column, "TEXT") for column in columns])
+    sink.create_table(rides, checkpoint, unit, row=0)
+    flush_batch(sink, rides, batch, checkpoint, unit, metrics, row=count)
+
+Checkpoints, run metrics and --cache are kept in Postgres, so --resume and --cache need the
+postgres sink; with the others a run always starts from scratch and its metrics are printed only.
+"""
+
+import os
+import sys
+import json
+import shutil
+from datetime import datetime, timezone
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import execute_values, Json
+
+from utils.ingestion_utils import get_db_connection, ensure_schema, get_local_data_path
+from utils.source_changes import mark_changed
+
+SINKS = ("postgres", "parquet", "duckdb", "sqlite")
+
+# Where docker/docker-compose.yml mounts LOCAL_DATA_PATH inside the Postgres container
+DEFAULT_SERVER_DATA_PATH = "/local_data"
+
+
+def default_sink_path(name):
+    """Where a file sink writes without --sink-path: LOCAL_DATA_PATH/.sinks/..."""
+    base = os.path.join(get_local_data_path(), ".sinks")
+    return {
+        "parquet": os.path.join(base, "parquet"),
+        "duckdb": os.path.join(base, "jimwurst.duckdb"),
+        "sqlite": os.path.join(base, "jimwurst.sqlite"),
+    }[name]
+
+
+def open_sink(args):
+    """The sink chosen with --sink/--sink-path (see build_arg_parser)."""
+    name = getattr(args, "sink", "postgres")
+    if getattr(args, "append", False) and getattr(args, "cache", False):
+        # A cache entry holds the tables as one export left them, not as appended to
+        print("Error: --append and --cache cannot be combined.")
+        sys.exit(2)
+    if name == "postgres":
+        return PostgresSink()
+    if getattr(args, "resume", False) or getattr(args, "cache", False):
+        print(f"Error: --resume and --cache keep their state in Postgres and cannot be used with --sink {name}.")
+        sys.exit(2)
+    if getattr(args, "server_copy", False):
+        print(f"Error: --server-copy loads into Postgres and cannot be used with --sink {name}.")
+        sys.exit(2)
+    path = os.path.expanduser(args.sink_path) if getattr(args, "sink_path", None) else default_sink_path(name)
+    sink = {"parquet": ParquetSink, "duckdb": DuckDBSink, "sqlite": SQLiteSink}[name](path)
+    print(f"Writing to {name}: {path}")
+    return sink
+
+
+class Table:
+    """
+    A table a job writes to: schema, name and (column, Postgres type) pairs.
+
+    With a unique_key, a row whose key is already in the table replaces the existing row
+    only if its newer_column is greater (Substack keeps an event from the newest export folder).
+    """
+
+    def __init__(self, schema, name, columns, primary_key=None, unique_key=None, newer_column=None):
+        self.schema = schema
+        self.name = name
+        self.columns = list(columns)
+        self.primary_key = primary_key
+        self.unique_key = unique_key
+        self.newer_column = newer_column
+
+    @property
+    def column_names(self):
+        return [column for column, _ in self.columns]
+
+    def __str__(self):
+        return f"{self.schema}.{self.name}"
+
+
+def plain_value(value, column_type):
+    """
+    A row value as a file sink stores it: JSON as text, and an aware datetime in a TIMESTAMP
+    column as UTC without offset (what Postgres stores with the warehouse's UTC time zone).
+    """
+    if isinstance(value, Json):
+        return json.dumps(value.adapted)
+    if isinstance(value, datetime) and value.tzinfo is not None and column_type.upper() == "TIMESTAMP":
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def arrow_type(column_type):
+    """Arrow type for a Postgres column type; anything without a counterpart is stored as text."""
+    import pyarrow as pa
+
+    base = column_type.upper().split("(")[0].strip()
+    return {
+        "SMALLINT": pa.int64(),
+        "INTEGER": pa.int64(),
+        "INT": pa.int64(),
+        "BIGINT": pa.int64(),
+        "REAL": pa.float64(),
+        "DOUBLE PRECISION": pa.float64(),
+        "NUMERIC": pa.float64(),
+        "BOOLEAN": pa.bool_(),
+        "DATE": pa.date32(),
+        "TIMESTAMP": pa.timestamp("us"),
+        "TIMESTAMPTZ": pa.timestamp("us", tz="UTC"),
+    }.get(base, pa.string())
+
+
+def rows_to_arrow(table, rows):
+    """A batch of rows as an Arrow table with the table's column types."""
+    import pyarrow as pa
+
+    columns = list(zip(*rows)) if rows else [()] * len(table.columns)
+    return pa.table({
+        name: pa.array([plain_value(v, column_type) for v in values], arrow_type(column_type))
+        for (name, column_type), values in zip(table.columns, columns)
+    })
+
+
+class PostgresSink:
+    """
+    Writes to Postgres, committing each batch together with its checkpoint. The tables it
+    creates or writes to are marked as changed for dbt (see utils/source_changes.py).
+    """
+
+    name = "postgres"
+
+    def __init__(self, conn=None):
+        self.conn = conn or get_db_connection()
+
+    def ensure_schema(self, schema):
+        ensure_schema(self.conn, schema)
+
+    def _identifier(self, table):
+        return sql.SQL("{}.{}").format(sql.Identifier(table.schema), sql.Identifier(table.name))
+
+    def create_table(self, table, /, checkpoint=None, unit=None, append=False, **position):
+        """
+        Drops and recreates the table, saving the checkpoint in the same transaction.
+        With append (--append), an existing table and its rows are kept, and it only gets the
+        columns of table it lacks; its columns that table does not have are left NULL by the writes.
+        """
+        identifier = self._identifier(table)
+        with self.conn.cursor() as cur:
+            existing = self._column_names(cur, table) if append else []
+            if existing:
+                self._add_columns(cur, table, existing)
+            else:
+                definitions = [sql.SQL("{} {}").format(sql.Identifier(c), sql.SQL(t)) for c, t in table.columns]
+                if table.primary_key:
+                    definitions.append(sql.SQL("PRIMARY KEY ({})").format(sql.Identifier(table.primary_key)))
+                cur.execute(sql.SQL("DROP TABLE IF EXISTS {} CASCADE").format(identifier))
+                cur.execute(sql.SQL("CREATE TABLE {} ({})").format(identifier, sql.SQL(", ").join(definitions)))
+                if table.unique_key:
+                    cur.execute(sql.SQL("CREATE UNIQUE INDEX {} ON {} ({})").format(
+                        sql.Identifier(f"{table.name}_{table.unique_key.lstrip('_')}_idx"),
+                        identifier, sql.Identifier(table.unique_key)
+                    ))
+            if checkpoint is not None:
+                checkpoint.save(cur, unit, **position)
+        self.conn.commit()
+        mark_changed(table.schema, table.name)
+
+    def _column_names(self, cur, table):
+        """Columns of the table as it is in Postgres ([] if it does not exist)."""
+        cur.execute("""
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = %s AND table_name = %s
+            ORDER BY ordinal_position
+        """, (table.schema, table.name))
+        return [row[0] for row in cur.fetchall()]
+
+    def _add_columns(self, cur, table, existing):
+        """Schema drift of an appended export: ALTER TABLE ADD COLUMN for its new fields."""
+        added = [(c, t) for c, t in table.columns if c not in existing]
+        for column, column_type in added:
+            cur.execute(sql.SQL("ALTER TABLE {} ADD COLUMN {} {}").format(
+                self._identifier(table), sql.Identifier(column), sql.SQL(column_type)
+            ))
+        if added:
+            print(f"  {table}: added column(s) {', '.join(c for c, _ in added)}")
+        missing = [c for c in existing if c not in table.column_names]
+        if missing:
+            print(f"  {table}: not in this export, left NULL: {', '.join(missing)}")
+
+    def _insert_query(self, table, query=None):
+        """INSERT ... VALUES %s for execute_values (or the given INSERT), with the upsert of unique_key tables."""
+        if query is None:
+            # Named columns: an appended table can have more columns, or in another order
+            query = sql.SQL("INSERT INTO {} ({}) VALUES %s").format(
+                self._identifier(table), sql.SQL(", ").join(map(sql.Identifier, table.column_names))
+            )
+        if table.unique_key:
+            # Overwrite an existing row only if the incoming one is newer
+            query = sql.SQL("{} ON CONFLICT ({}) DO UPDATE SET {} WHERE {}.{} < EXCLUDED.{}").format(
+                query,
+                sql.Identifier(table.unique_key),
+                sql.SQL(", ").join(
+                    sql.SQL("{0} = EXCLUDED.{0}").format(sql.Identifier(c))
+                    for c in table.column_names if c != table.unique_key
+                ),
+                self._identifier(table),
+                sql.Identifier(table.newer_column),
+                sql.Identifier(table.newer_column),
+            )
+        return query
+
+    def write(self, batches, /, checkpoint=None, unit=None, **position):
+        """Inserts [(table, rows), ...] and saves the checkpoint in one transaction, then commits."""
+        with self.conn.cursor() as cur:
+            for table, rows in batches:
+                if rows:
+                    execute_values(cur, self._insert_query(table), rows)
+            if checkpoint is not None:
+                checkpoint.save(cur, unit, **position)
+        self.conn.commit()
+        for table, rows in batches:
+            if rows:
+                mark_changed(table.schema, table.name)
+
+    def server_path(self, file_path):
+        """
+        The path of a local file as the Postgres server sees it (SERVER_DATA_PATH, /local_data by
+        default), or None if it is outside LOCAL_DATA_PATH, or the server cannot stat it or
+        sees a file of another size there (not mounted, another folder, no privilege).
+        """
+        relative = os.path.relpath(os.path.abspath(file_path), os.path.abspath(get_local_data_path()))
+        if relative.startswith(os.pardir):
+            return None
+        path = os.path.join(os.getenv("SERVER_DATA_PATH", DEFAULT_SERVER_DATA_PATH), relative)
+        with self.conn.cursor() as cur:
+            cur.execute("SAVEPOINT server_path")
+            try:
+                # pg_stat_file needs superuser or an explicit grant, like COPY FROM a file
+                cur.execute("SELECT (pg_stat_file(%s, true)).size", (path,))
+                size = cur.fetchone()[0]
+            except psycopg2.Error:
+                size = None
+                cur.execute("ROLLBACK TO SAVEPOINT server_path")
+            cur.execute("RELEASE SAVEPOINT server_path")
+        return path if size == os.path.getsize(file_path) else None
+
+    def copy_server_csv(self, table, file_path, csv_columns, /, extra_columns=None, checkpoint=None, unit=None,
+                        **position):
+        """
+        Loads a CSV file (with a header line) into the table with a server-side COPY, so the
+        rows never pass through Python. csv_columns are the table columns of the file's fields;
+        extra_columns maps the other columns to SQL expressions over them (e.g. a constant or a
+        hash). A unique_key table gets the same upsert as write(), keeping the last copy of a
+        duplicate key within the file. The unit is checkpointed as done in the same transaction.
+
+        Returns the number of rows copied, or None when nothing was written because the server
+        cannot read the file, or COPY rejected it (e.g. a row with a missing or extra field,
+        which the Python readers pad or truncate); the caller then streams the file itself.
+        """
+        path = self.server_path(file_path)
+        if path is None:
+            print(f"  {os.path.basename(file_path)} is not readable by the server, streaming it instead.")
+            return None
+
+        columns = sql.SQL(", ").join(map(sql.Identifier, csv_columns))
+        options = sql.SQL("FORMAT csv, HEADER true, ENCODING 'UTF8', FORCE_NOT_NULL ({})").format(columns)
+        with self.conn.cursor() as cur:
+            cur.execute("SAVEPOINT server_copy")
+            try:
+                rows = self._copy(cur, table, csv_columns, extra_columns, sql.Literal(path), options)
+            except psycopg2.Error as e:
+                cur.execute("ROLLBACK TO SAVEPOINT server_copy")
+                cur.execute("RELEASE SAVEPOINT server_copy")
+                self.conn.commit()
+                print(f"  Server-side COPY of {os.path.basename(file_path)} failed ({str(e).strip().splitlines()[0]}), "
+                      f"streaming it instead.")
+                return None
+            cur.execute("RELEASE SAVEPOINT server_copy")
+            if checkpoint is not None:
+                checkpoint.save(cur, unit, done=True, row=rows, **position)
+        self.conn.commit()
+        if rows:
+            mark_changed(table.schema, table.name)
+        return rows
+
+    def copy_csv(self, table, csv_columns, data, /, extra_columns=None, checkpoint=None, unit=None, **position):
+        """
+        Loads COPY ... WITH (FORMAT csv) input without a header (a file-like object, see
+        utils/parallel_csv.py) like copy_server_csv, and saves the checkpoint in the same transaction.
+        Returns the number of rows copied.
+        """
+        with self.conn.cursor() as cur:
+            rows = self._copy(cur, table, csv_columns, extra_columns, sql.SQL("STDIN"),
+                              sql.SQL("FORMAT csv, ENCODING 'UTF8'"), data)
+            if checkpoint is not None:
+                checkpoint.save(cur, unit, **position)
+        self.conn.commit()
+        if rows:
+            mark_changed(table.schema, table.name)
+        return rows
+
+    def _copy(self, cur, table, csv_columns, extra_columns, source, options, data=None):
+        """COPY from a server file or STDIN (with data) into the table, or through a staging table."""
+        if not extra_columns and not table.unique_key:
+            return self._run_copy(cur, self._identifier(table), csv_columns, source, options, data)
+        return self._copy_staged(cur, table, csv_columns, extra_columns or {}, source, options, data)
+
+    def _run_copy(self, cur, target, csv_columns, source, options, data):
+        query = sql.SQL("COPY {} ({}) FROM {} WITH ({})").format(
+            target, sql.SQL(", ").join(map(sql.Identifier, csv_columns)), source, options
+        )
+        if data is None:
+            cur.execute(query)
+        else:
+            cur.copy_expert(query.as_string(cur), data)
+        return cur.rowcount
+
+    def _copy_staged(self, cur, table, csv_columns, extra_columns, source, options, data):
+        """COPY into a temporary table, then INSERT ... SELECT with the extra columns (and the upsert)."""
+        staging = sql.Identifier(f"_copy_{table.name}")
+        cur.execute(sql.SQL("CREATE TEMP TABLE {} ({}, _line BIGSERIAL) ON COMMIT DROP").format(
+            staging, sql.SQL(", ").join(sql.SQL("{} TEXT").format(sql.Identifier(c)) for c in csv_columns)
+        ))
+        rows = self._run_copy(cur, staging, csv_columns, source, options, data)
+
+        expressions = {c: sql.Identifier(c) for c in csv_columns}
+        expressions.update(extra_columns)
+        columns = sql.SQL(", ").join(map(sql.Identifier, table.column_names))
+        rows_query = sql.SQL("SELECT {}, _line FROM {}").format(
+            sql.SQL(", ").join(sql.SQL("{} AS {}").format(expressions[c], sql.Identifier(c)) for c in table.column_names),
+            staging,
+        )
+        if table.unique_key:
+            # ON CONFLICT cannot update a row twice in one statement, so one row per key goes in
+            select = sql.SQL("SELECT DISTINCT ON ({key}) {columns} FROM ({rows}) s ORDER BY {key}, _line DESC").format(
+                key=sql.Identifier(table.unique_key), columns=columns, rows=rows_query
+            )
+        else:
+            select = sql.SQL("SELECT {} FROM ({}) s ORDER BY _line").format(columns, rows_query)
+        cur.execute(self._insert_query(table, sql.SQL("INSERT INTO {} ({}) {}").format(
+            self._identifier(table), columns, select
+        )))
+        return rows
+
+    def close(self):
+        self.conn.close()
+
+
+class ParquetSink:
+    """
+    Writes every table to <path>/<schema>/<table>/part-*.parquet, readable as one dataset
+    (pyarrow.dataset, DuckDB's read_parquet('<dir>/*.parquet'), pandas).
+    """
+
+    name = "parquet"
+    conn = None
+
+    def __init__(self, path):
+        self.path = path
+        self._writers = {}
+        self._tables = {}
+
+    def ensure_schema(self, schema):
+        os.makedirs(os.path.join(self.path, schema), exist_ok=True)
+
+    def _directory(self, table):
+        return os.path.join(self.path, table.schema, table.name)
+
+    def create_table(self, table, /, checkpoint=None, unit=None, append=False, **position):
+        """
+        Empties the table's directory. With append, the parts already there (of this run or
+        earlier ones) are kept and the rows go to new parts next to them, a file with other
+        columns to a part of its own; close() merges the parts by column name.
+        """
+        if append:
+            writer = self._writers.get(str(table))
+            if writer is not None and writer.schema.names != table.column_names:
+                self._writers.pop(str(table)).close()
+            os.makedirs(self._directory(table), exist_ok=True)
+            self._tables[str(table)] = table
+            return
+        writer = self._writers.pop(str(table), None)
+        if writer is not None:
+            writer.close()
+        shutil.rmtree(self._directory(table), ignore_errors=True)
+        os.makedirs(self._directory(table))
+        self._tables[str(table)] = table
+
+    def write(self, batches, /, checkpoint=None, unit=None, **position):
+        import pyarrow.parquet as pq
+
+        for table, rows in batches:
+            if not rows:
+                continue
+            data = rows_to_arrow(table, rows)
+            writer = self._writers.get(str(table))
+            if writer is None:
+                directory = self._directory(table)
+                os.makedirs(directory, exist_ok=True)
+                part = len([f for f in os.listdir(directory) if f.endswith(".parquet")])
+                writer = pq.ParquetWriter(os.path.join(directory, f"part-{part:05d}.parquet"), data.schema,
+                                          compression="zstd")
+                self._writers[str(table)] = writer
+                self._tables[str(table)] = table
+            if data.schema.names != writer.schema.names:
+                # Appending a file whose headers were renamed: columns go by position, as in the databases
+                data = data.rename_columns(writer.schema.names).cast(writer.schema)
+            writer.write_table(data)
+        if checkpoint is not None:
+            checkpoint.save(None, unit, **position)
+
+    def close(self):
+        for writer in self._writers.values():
+            writer.close()
+        self._writers = {}
+        for table in self._tables.values():
+            self._merge_parts(table)
+            if table.unique_key:
+                self._deduplicate(table)
+
+    def _merge_parts(self, table):
+        """Rewrites the parts of an appended table that have other columns as one file with all of them."""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        directory = self._directory(table)
+        paths = sorted(os.path.join(directory, f) for f in os.listdir(directory) if f.endswith(".parquet"))
+        if len({tuple(pq.read_schema(path).names) for path in paths}) <= 1:
+            return
+        # Columns an appended file lacks are left NULL, as in the databases
+        data = pa.concat_tables([pq.read_table(path) for path in paths], promote_options="default")
+        shutil.rmtree(directory)
+        os.makedirs(directory)
+        pq.write_table(data, os.path.join(directory, "part-00000.parquet"), compression="zstd")
+
+    def _deduplicate(self, table):
+        """Keeps one row per unique_key, the one with the greatest newer_column (what the upsert does in a database)."""
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+
+        directory = self._directory(table)
+        data = pq.read_table(directory)
+        if data.num_rows == 0:
+            return
+        data = data.sort_by([(table.unique_key, "ascending"), (table.newer_column, "descending")])
+        keys = data.column(table.unique_key)
+        first_of_key = pa.concat_arrays([
+            pa.array([True]),
+            pc.not_equal(keys.slice(1), keys.slice(0, len(keys) - 1)).combine_chunks().fill_null(True),
+        ])
+        shutil.rmtree(directory)
+        os.makedirs(directory)
+        pq.write_table(data.filter(first_of_key), os.path.join(directory, "part-00000.parquet"), compression="zstd")
+
+
+class EmbeddedSink:
+    """Common part of the DuckDB and SQLite sinks: one database file, one transaction per write."""
+
+    conn = None
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = self._connect(path)
+
+    def _quote(self, name):
+        return '"' + name.replace('"', '""') + '"'
+
+    def _identifier(self, table):
+        return f"{self._quote(table.schema)}.{self._quote(table.name)}"
+
+    def _column_type(self, column_type):
+        return column_type
+
+    def create_table(self, table, /, checkpoint=None, unit=None, append=False, **position):
+        """
+        Drops and recreates the table. With append (--append, or a later file of the same table
+        in this run), an existing table is kept and only gets the columns of table it lacks.
+        """
+        existing = self._column_names(table) if append else []
+        if existing:
+            for column, column_type in table.columns:
+                if column not in existing:
+                    self.db.execute(f"ALTER TABLE {self._identifier(table)} "
+                                    f"ADD COLUMN {self._quote(column)} {self._column_type(column_type)}")
+            self.db.commit()
+            return
+        definitions = [f"{self._quote(c)} {self._column_type(t)}" for c, t in table.columns]
+        if table.primary_key:
+            definitions.append(f"PRIMARY KEY ({self._quote(table.primary_key)})")
+        if table.unique_key:
+            definitions.append(f"UNIQUE ({self._quote(table.unique_key)})")
+        self.db.execute(f"DROP TABLE IF EXISTS {self._identifier(table)}")
+        self.db.execute(f"CREATE TABLE {self._identifier(table)} ({', '.join(definitions)})")
+        self.db.commit()
+
+    def _columns(self, table):
+        """The column list of an INSERT: an appended table can have more columns, or in another order."""
+        return ", ".join(self._quote(c) for c in table.column_names)
+
+    def _upsert_clause(self, table):
+        if not table.unique_key:
+            return ""
+        updates = ", ".join(
+            f"{self._quote(c)} = excluded.{self._quote(c)}" for c in table.column_names if c != table.unique_key
+        )
+        newer = self._quote(table.newer_column)
+        return (f" ON CONFLICT ({self._quote(table.unique_key)}) DO UPDATE SET {updates}"
+                f" WHERE {self._identifier(table)}.{newer} < excluded.{newer}")
+
+    def write(self, batches, /, checkpoint=None, unit=None, **position):
+        for table, rows in batches:
+            if rows:
+                self._insert(table, rows)
+        self.db.commit()
+        if checkpoint is not None:
+            checkpoint.save(None, unit, **position)
+
+    def close(self):
+        self.db.close()
+
+
+class DuckDBSink(EmbeddedSink):
+    """Writes to a DuckDB file; batches go in as Arrow tables, which DuckDB reads without per-row overhead."""
+
+    name = "duckdb"
+
+    def _connect(self, path):
+        import duckdb
+        return duckdb.connect(path)
+
+    def ensure_schema(self, schema):
+        self.db.execute(f"CREATE SCHEMA IF NOT EXISTS {self._quote(schema)}")
+
+    def _column_type(self, column_type):
+        return "VARCHAR" if column_type.upper() in ("JSON", "JSONB") else column_type
+
+    def _column_names(self, table):
+        return [row[0] for row in self.db.execute(
+            "SELECT column_name FROM information_schema.columns WHERE table_schema = ? AND table_name = ? "
+            "ORDER BY ordinal_position", [table.schema, table.name]
+        ).fetchall()]
+
+    def _insert(self, table, rows):
+        batch = rows_to_arrow(table, rows)
+        self.db.register("batch", batch)
+        try:
+            self.db.execute(f"INSERT INTO {self._identifier(table)} ({self._columns(table)}) "
+                            f"SELECT * FROM batch{self._upsert_clause(table)}")
+        finally:
+            self.db.unregister("batch")
+
+
+class SQLiteSink(EmbeddedSink):
+    """Writes to a SQLite file; <schema>.<table> becomes the table <schema>__<table>."""
+
+    name = "sqlite"
+
+    def _connect(self, path):
+        import sqlite3
+        return sqlite3.connect(path)
+
+    def ensure_schema(self, schema):
+        pass
+
+    def _identifier(self, table):
+        return self._quote(f"{table.schema}__{table.name}")
+
+    def _column_names(self, table):
+        return [row[1] for row in self.db.execute(f"PRAGMA table_info({self._identifier(table)})").fetchall()]
+
+    def _insert(self, table, rows):
+        types = [t for _, t in table.columns]
+        values = [
+            [v.isoformat(sep=" ") if isinstance(v, datetime) else v
+             for v in (plain_value(value, t) for value, t in zip(row, types))]
+            for row in rows
+        ]
+        placeholders = ", ".join("?" for _ in table.columns)
+        self.db.executemany(f"INSERT INTO {self._identifier(table)} ({self._columns(table)}) VALUES ({placeholders})"
+                            f"{self._upsert_clause(table)}", values)
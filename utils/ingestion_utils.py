@@ -2,11 +2,17 @@
 Common utilities for data ingestion scripts.
 """
 
+import io
 import os
 import re
+import argparse
+from contextlib import nullcontext
 from dotenv import load_dotenv
 import psycopg2
 from psycopg2 import sql
+from psycopg2.extras import Json
+
+META_SCHEMA = "meta"
 
 
 def load_env():
@@ -21,6 +27,11 @@ def load_env():
         load_dotenv(ENV_REAL, override=True)
 
 
+def get_local_data_path():
+    """The folder holding the local exports (LOCAL_DATA_PATH, mounted into Postgres as /local_data)."""
+    return os.path.expanduser(os.getenv("LOCAL_DATA_PATH", "~/Documents/jimwurst_local_data"))
+
+
 def get_db_connection():
     """Get a PostgreSQL database connection."""
     DB_HOST = os.getenv("DB_HOST", "localhost")
@@ -58,4 +69,191 @@ def clean_header(header):
 
 def sanitize_table_name(filename):
     """Sanitize filename to create valid table name."""
-    return os.path.splitext(filename)[0].lower().replace(' ', '_').replace('-', '_').replace('(', '').replace(')', '')
\ No newline at end of file
+    return os.path.splitext(filename)[0].lower().replace(' ', '_').replace('-', '_').replace('(', '').replace(')', '')
+
+
+def build_arg_parser(description):
+    """Argument parser with the options shared by all manual ingestion jobs."""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--yes', '-y', action='store_true', help='Skip confirmation prompt')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue from the last committed checkpoint instead of starting from scratch')
+    parser.add_argument('--cache', action='store_true',
+                        help='Load from the Parquet cache of this export if there is one, and update it after a parse '
+                             '(LOCAL_DATA_PATH/.cache/<source>/)')
+    parser.add_argument('--profile', nargs='?', const='', default=None, metavar='DIR',
+                        help='Write a cProfile dump, a flame graph stack file and the hottest functions per stage '
+                             '(default DIR: profiles/ in the project root)')
+    from utils.ingestion_sinks import SINKS
+    parser.add_argument('--sink', choices=SINKS, default='postgres',
+                        help='Where to write the tables (default: postgres; see utils/ingestion_sinks.py)')
+    parser.add_argument('--sink-path', metavar='PATH',
+                        help='Output directory (parquet) or database file (duckdb, sqlite) of a file sink '
+                             '(default: LOCAL_DATA_PATH/.sinks/)')
+    parser.add_argument('--server-copy', action='store_true',
+                        help='Let Postgres read plain CSV files itself from its /local_data mount, falling back '
+                             'to streaming them when it cannot (postgres sink only)')
+    parser.add_argument('--append', action='store_true',
+                        help='Add the rows to the existing tables instead of rebuilding them; columns new in this '
+                             'export are added, missing ones are left NULL')
+    return parser
+
+
+class Checkpoint:
+    """
+    Tracks the progress of an ingestion run in meta.ingestion_checkpoints.
+
+    A unit is whatever a source loads in one go (a file, the records of an XML export,
+    the chat list of a Telegram export). Its position is a small dict, e.g. {"row": 5000}
+    or {"done": True}, saved in the same transaction as the rows it covers, so after a
+    crash the table and the checkpoint always agree.
+
+    Without a connection (a file sink, see utils/ingestion_sinks.py), positions are only
+    kept in memory for the run and nothing can be resumed.
+    """
+
+    def __init__(self, conn, source, resume=False):
+        self.conn = conn
+        self.source = source
+        self.positions = {}
+        if conn is None:
+            return
+
+        ensure_schema(conn, META_SCHEMA)
+        with conn.cursor() as cur:
+            cur.execute(sql.SQL("""
+                CREATE TABLE IF NOT EXISTS {}.ingestion_checkpoints (
+                    source TEXT NOT NULL,
+                    unit TEXT NOT NULL,
+                    position JSONB NOT NULL,
+                    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                    PRIMARY KEY (source, unit)
+                )
+            """).format(sql.Identifier(META_SCHEMA)))
+            if resume:
+                cur.execute(sql.SQL("SELECT unit, position FROM {}.ingestion_checkpoints WHERE source = %s").format(
+                    sql.Identifier(META_SCHEMA)), (source,))
+                self.positions = dict(cur.fetchall())
+            else:
+                cur.execute(sql.SQL("DELETE FROM {}.ingestion_checkpoints WHERE source = %s").format(
+                    sql.Identifier(META_SCHEMA)), (source,))
+        conn.commit()
+
+        if self.positions:
+            print(f"Resuming {source} from {len(self.positions)} checkpoint(s).")
+
+    def get(self, unit):
+        """Returns the saved position of a unit, or None if it was never started."""
+        return self.positions.get(unit)
+
+    def rows_done(self, unit):
+        """Number of rows of a unit already committed."""
+        return (self.positions.get(unit) or {}).get('row', 0)
+
+    def is_done(self, unit):
+        return bool((self.positions.get(unit) or {}).get('done'))
+
+    def save(self, cur, unit, **position):
+        """Records a unit's position. Does not commit: the caller commits it with the data."""
+        self.positions[unit] = position
+        if cur is None:
+            return
+        cur.execute(sql.SQL("""
+            INSERT INTO {}.ingestion_checkpoints (source, unit, position, updated_at)
+            VALUES (%s, %s, %s, now())
+            ON CONFLICT (source, unit) DO UPDATE SET position = EXCLUDED.position, updated_at = now()
+        """).format(sql.Identifier(META_SCHEMA)), (self.source, unit, Json(position)))
+
+    def mark_done(self, unit, **position):
+        """Marks a unit as fully loaded and commits."""
+        if self.conn is None:
+            self.save(None, unit, done=True, **position)
+            return
+        with self.conn.cursor() as cur:
+            self.save(cur, unit, done=True, **position)
+        self.conn.commit()
+
+    def finish(self):
+        """Clears the checkpoints of a completed run."""
+        self.positions = {}
+        if self.conn is None:
+            return
+        with self.conn.cursor() as cur:
+            cur.execute(sql.SQL("DELETE FROM {}.ingestion_checkpoints WHERE source = %s").format(
+                sql.Identifier(META_SCHEMA)), (self.source,))
+        self.conn.commit()
+
+
+def flush_batch(sink, table, rows, /, checkpoint=None, unit=None, metrics=None, **position):
+    """
+    Writes a batch of rows to a table of the sink (see utils/ingestion_sinks.py), saves the
+    checkpoint in the same transaction and commits.
+    With metrics (a RunMetrics), the batch is timed as the write stage and counted.
+    """
+    if metrics is None:
+        sink.write([(table, rows)], checkpoint, unit, **position)
+        return
+    with metrics.stage("write"):
+        sink.write([(table, rows)], checkpoint, unit, **position)
+    metrics.add_commit(len(rows))
+
+
+def copy_on_server(sink, table, file_path, csv_columns, /, extra_columns=None, checkpoint=None, unit=None,
+                   metrics=None, **position):
+    """
+    Has Postgres load a CSV file itself (see PostgresSink.copy_server_csv), timed as the write
+    stage. Returns the number of rows, or None if the caller has to stream the file.
+    """
+    from utils.export_files import is_member
+
+    if is_member(file_path):
+        print(f"  {os.path.basename(file_path)} is inside a .zip archive, streaming it.")
+        return None
+    if metrics is None:
+        return sink.copy_server_csv(table, file_path, csv_columns, extra_columns, checkpoint, unit, **position)
+    with metrics.stage("write"):
+        rows = sink.copy_server_csv(table, file_path, csv_columns, extra_columns, checkpoint, unit, **position)
+    if rows is not None:
+        metrics.add_commit(rows)
+    return rows
+
+
+def copy_in_parallel(sink, table, file_path, csv_columns, /, encoding="utf-8", extra_columns=None, checkpoint=None,
+                     unit=None, metrics=None, **position):
+    """
+    Loads a large CSV file parsed on every core (see utils/parallel_csv.py) with COPY, one
+    commit per chunk with its checkpoint, and marks the unit done. Returns the number of rows,
+    or None (nothing written) when the file is too small or inside a .zip archive, the machine
+    has a single core or the sink is not Postgres; the caller then reads the file itself.
+    """
+    from utils.parallel_csv import is_parallel, copy_chunks, csv_workers
+    from utils.export_files import is_member
+
+    if not hasattr(sink, "copy_csv") or is_member(file_path) or not is_parallel(file_path, encoding):
+        return None
+    print(f"  Parsing {os.path.basename(file_path)} on {csv_workers()} cores...")
+    stage = metrics.stage if metrics is not None else (lambda name: nullcontext())
+    chunks = copy_chunks(file_path, len(csv_columns), encoding)
+    count = 0
+    while True:
+        # Time spent waiting for the workers is parsing; the main process only copies bytes
+        with stage("parse"):
+            chunk = next(chunks, None)
+        if chunk is None:
+            break
+        rows, data = chunk
+        count += rows
+        with stage("write"):
+            sink.copy_csv(table, csv_columns, io.BytesIO(data), extra_columns, checkpoint, unit, row=count, **position)
+        if metrics is not None:
+            metrics.add_commit(rows)
+    if checkpoint is not None:
+        checkpoint.mark_done(unit, row=count, **position)
+    return count
+
+
+def skip_rows(reader, count):
+    """Advances an iterator past rows that were already loaded by a previous run."""
+    for _ in range(count):
+        if next(reader, None) is None:
+            break
@@ -0,0 +1,170 @@
+"""
+Multi-core parsing of large CSV files into COPY input.
+
+csv.reader runs on one core, and sending parsed rows back from worker processes costs about
+as much as parsing them again (every value is rebuilt as a Python string on the other side).
+So the workers here hand back COPY input instead: each chunk of the file is parsed with
+csv.reader exactly as the jobs read it (same encoding, universal newlines, rows padded with
+NULL or truncated to the header's width), written back out as CSV bytes, and loaded with
+COPY ... FROM STDIN without the main process touching a single row.
+
+The file is memory-mapped and cut into chunks at line ends outside quoted fields, found by
+counting the quote characters before them. A stray quote inside an unquoted field (5" screen)
+can fool the count; each worker therefore checks that its chunk ends outside a quoted field,
+and from the first chunk that does not, the rest of the file is parsed in order in this process.
+Chunks are yielded in file order, with a bounded number in flight.
+
+    for rows, data in copy_chunks(path, width=len(headers), encoding="utf-8-sig"):
+        cur.copy_expert("COPY ... FROM STDIN WITH (FORMAT csv)", io.BytesIO(data))
+"""
+
+import io
+import os
+import csv
+import mmap
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+# Files below this size are read with a plain csv.reader; process start-up is not worth it
+PARALLEL_MIN_BYTES = int(os.getenv("PARALLEL_CSV_MIN_MB", "64")) * 1024 * 1024
+CHUNK_BYTES = 16 * 1024 * 1024
+# Rows per chunk when the rest of a file is parsed in this process
+FALLBACK_CHUNK_ROWS = 100_000
+
+# Multi-byte safe to cut at b"\n"; other encodings are read sequentially
+SPLITTABLE_ENCODINGS = ("utf-8", "utf-8-sig", "utf8")
+# A line no export contains: parsed as a row of its own only if the chunk ends outside quotes
+END_SENTINEL = "jimwurst-end-of-chunk"
+
+
+def csv_workers():
+    """Worker processes for parallel parsing (CSV_WORKERS, default: one per core)."""
+    return int(os.getenv("CSV_WORKERS", "0")) or os.cpu_count() or 1
+
+
+def is_parallel(file_path, encoding="utf-8"):
+    """True if the file is big enough, and the machine has the cores, for parallel parsing."""
+    return (encoding.lower() in SPLITTABLE_ENCODINGS and csv_workers() > 1
+            and os.path.getsize(file_path) >= PARALLEL_MIN_BYTES)
+
+
+def copy_lines(rows, width):
+    """
+    Rows as COPY ... WITH (FORMAT csv) input: values quoted (so '' stays ''), and the fields
+    a short row lacks as unquoted empty fields (NULL), like the jobs' [None] padding.
+    Returns (number of rows, text).
+    """
+    out = io.StringIO()
+    writer = csv.writer(out, quoting=csv.QUOTE_ALL, lineterminator="")
+    count = 0
+    for row in rows:
+        if len(row) > width:
+            row = row[:width]
+        writer.writerow(row)
+        out.write("," * (width - max(len(row), 1)) + "\n")
+        count += 1
+    return count, out.getvalue()
+
+
+def chunk_ranges(file_path, chunk_bytes=CHUNK_BYTES):
+    """
+    (start, end) byte ranges of about chunk_bytes that start and end on a line break
+    outside quoted fields, going by the parity of the quote characters before it.
+    """
+    size = os.path.getsize(file_path)
+    with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = 0
+        counted_to = 0
+        quotes = 0
+        while start < size:
+            candidate = start + chunk_bytes
+            end = size
+            while candidate < size:
+                newline = mm.find(b"\n", candidate)
+                if newline == -1:
+                    break
+                quotes += mm[counted_to:newline].count(b'"')
+                counted_to = newline
+                if quotes % 2 == 0:
+                    end = newline + 1
+                    break
+                candidate = newline + 1
+            yield start, end
+            start = end
+
+
+def parse_chunk(file_path, start, end, encoding, width, skip_header, check_end):
+    """
+    Parses one byte range of the file (in a worker) into COPY input.
+    Returns (ended_outside_quotes, rows, data); with check_end=False the first is always True.
+    """
+    with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        text = mm[start:end].decode(encoding)
+    if check_end:
+        text += END_SENTINEL + "\n"
+    rows = list(csv.reader(io.StringIO(text, newline=None)))
+    del text
+    if check_end:
+        if rows and rows[-1] == [END_SENTINEL]:
+            rows.pop()
+        else:
+            return False, 0, b""
+    count, data = copy_lines(islice(rows, 1 if skip_header else 0, None), width)
+    return True, count, data.encode("utf-8")
+
+
+def _chunk_encoding(encoding, start):
+    # The byte order mark is only at the start of the file
+    return encoding if start == 0 else "utf-8"
+
+
+def _sequential_chunks(file_path, start, encoding, width, skip_header):
+    """The rest of the file from a record boundary, parsed in this process."""
+    with open(file_path, "rb") as raw:
+        raw.seek(start)
+        with io.TextIOWrapper(raw, encoding=_chunk_encoding(encoding, start)) as f:
+            reader = csv.reader(f)
+            if skip_header:
+                next(reader, None)
+            while True:
+                rows, text = copy_lines(islice(reader, FALLBACK_CHUNK_ROWS), width)
+                if not rows:
+                    return
+                yield rows, text.encode("utf-8")
+
+
+def copy_chunks(file_path, width, encoding="utf-8", workers=None):
+    """
+    Yields (rows, data) for the data rows of a CSV file (the header line is skipped), in file
+    order: data is COPY ... WITH (FORMAT csv) input for rows rows, each padded or truncated
+    to width fields.
+    """
+    workers = workers or csv_workers()
+    ranges = chunk_ranges(file_path)
+    size = os.path.getsize(file_path)
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        def submit():
+            for start, end in ranges:
+                pending.append((start, pool.submit(
+                    parse_chunk, file_path, start, end, _chunk_encoding(encoding, start), width,
+                    start == 0, end < size,
+                )))
+                return
+
+        # Two chunks per worker in flight keeps them busy and bounds memory
+        for _ in range(workers * 2):
+            submit()
+        while pending:
+            start, future = pending.popleft()
+            clean, rows, data = future.result()
+            if not clean:
+                for _, other in pending:
+                    other.cancel()
+                break
+            submit()
+            yield rows, data
+        else:
+            return
+    yield from _sequential_chunks(file_path, start, encoding, width, skip_header=start == 0)
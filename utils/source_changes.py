@@ -0,0 +1,92 @@
+"""
+Which source tables the ingestion runs changed, for dbt builds of only those (jimwurst transform).
+
+The Postgres sink and the --cache loader mark every table they create or write to, and the run
+stores them with its metrics in meta.source_changes (see utils/ingestion_metrics.py). A build
+then selects the dbt sources among the tables changed since the last successful build, and
+everything downstream of them:
+
+    jimwurst ingest spotify substack --yes
+    jimwurst transform      # dbt build --select source:substack.post_delivers+ source:substack.post_opens+ ...
+
+Tables that no dbt source declares (Spotify, Bolt, Telegram) are recorded too but select
+nothing, so a new Spotify export builds no model. A failed build leaves its changes pending,
+and the next one selects them again.
+"""
+
+import os
+from psycopg2 import sql
+
+from utils.ingestion_utils import META_SCHEMA
+
+# (schema, table) marked in this process since the last run was recorded
+_changed = set()
+
+
+def mark_changed(schema, table):
+    _changed.add((schema, table))
+
+
+def pop_changed():
+    """The tables marked since the last call, sorted."""
+    tables = sorted(_changed)
+    _changed.clear()
+    return tables
+
+
+def record_changes(cur, tables, run_id=None):
+    """Adds the (schema, table) changes of a run to meta.source_changes (see ensure_meta_tables)."""
+    if tables:
+        cur.executemany(sql.SQL("""
+            INSERT INTO {}.source_changes (run_id, table_schema, table_name) VALUES (%s, %s, %s)
+        """).format(sql.Identifier(META_SCHEMA)), [(run_id, schema, table) for schema, table in tables])
+
+
+def pending_changes(conn):
+    """([(schema, table), ...], last change_id) of the changes no build has picked up yet."""
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL("""
+            SELECT table_schema, table_name, max(change_id)
+            FROM {}.source_changes
+            WHERE built_at IS NULL
+            GROUP BY table_schema, table_name
+            ORDER BY table_schema, table_name
+        """).format(sql.Identifier(META_SCHEMA)))
+        rows = cur.fetchall()
+    return [(schema, table) for schema, table, _ in rows], max((row[2] for row in rows), default=None)
+
+
+def mark_built(conn, last_change_id):
+    """Marks the pending changes up to last_change_id as built (later runs stay pending)."""
+    if last_change_id is None:
+        return
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL("""
+            UPDATE {}.source_changes SET built_at = now() WHERE built_at IS NULL AND change_id <= %s
+        """).format(sql.Identifier(META_SCHEMA)), (last_change_id,))
+    conn.commit()
+
+
+def dbt_sources(dbt_dir):
+    """{(schema, table): "source_name.table_name"} of the sources declared in the dbt project's models."""
+    import yaml
+
+    sources = {}
+    for root, dirs, files in os.walk(os.path.join(dbt_dir, "models")):
+        dirs.sort()
+        for name in sorted(files):
+            if not name.endswith((".yml", ".yaml")):
+                continue
+            with open(os.path.join(root, name)) as f:
+                config = yaml.safe_load(f) or {}
+            for source in config.get("sources") or []:
+                for table in source.get("tables") or []:
+                    key = (source.get("schema", source["name"]), table.get("identifier", table["name"]))
+                    sources[key] = f"{source['name']}.{table['name']}"
+    return sources
+
+
+def selectors(tables, dbt_dir):
+    """The dbt --select arguments (source:<source>.<table>+) for the changed tables."""
+    sources = dbt_sources(dbt_dir)
+    return [f"source:{sources[table]}+" for table in tables if table in sources]
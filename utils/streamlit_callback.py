@@ -1,6 +1,11 @@
+import threading
 from typing import Any, Dict, List, Optional
 from langchain.callbacks.base import BaseCallbackHandler
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+# dbt log lines shown under a running tool
+DBT_TAIL_LINES = 30
 
 class StreamlitThinkingCallback(BaseCallbackHandler):
     """Callback Handler that prints to a Streamlit container."""
@@ -10,6 +15,9 @@ class StreamlitThinkingCallback(BaseCallbackHandler):
         self.container = container
         self.text = ""
         self.placeholder = container.empty()
+        self.dbt_lines = []
+        # dbt reports from its own threads, which need the session's context to update the page
+        self.script_run_ctx = get_script_run_ctx()
 
     def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any) -> None:
         """Run when LLM starts running."""
@@ -31,10 +39,19 @@ class StreamlitThinkingCallback(BaseCallbackHandler):
             output = "*No output*"
         elif output == "":
             output = "*Empty result*"
+        self.dbt_lines = []
             
         self.text += f"**Observation:**\n```\n{output}\n```\n"
         self.placeholder.markdown(self.text)
         
+    def on_dbt_event(self, message: str) -> None:
+        """Run for each dbt log message while a transformation runs (see utils/dbt_runner.py)."""
+        if self.script_run_ctx is not None:
+            add_script_run_ctx(threading.current_thread(), self.script_run_ctx)
+        self.dbt_lines.append(message)
+        tail = "\n".join(self.dbt_lines[-DBT_TAIL_LINES:])
+        self.placeholder.markdown(f"{self.text}```\n{tail}\n```\n")
+
     def on_tool_error(self, error: Exception, **kwargs: Any) -> None:
         """Run when tool errors."""
         self.text += f"\n**Tool Error:** {error}\n"